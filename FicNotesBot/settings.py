@@ -10,8 +10,13 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
+from django.core.exceptions import ImproperlyConfigured
+
+from FicNotesBot import database_url
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -19,9 +24,13 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/3.1/howto/deployment/checklist/
 
-secret_key = ''
-with open(BASE_DIR / 'secret', 'r') as file:
-    secret_key = file.read()
+# DJANGO_SECRET_KEY, if set, takes the place of the secret file, so test runs
+# and other throwaway processes need not read the deployment's key
+
+secret_key = os.getenv('DJANGO_SECRET_KEY', '')
+if not secret_key:
+    with open(BASE_DIR / 'secret', 'r') as file:
+        secret_key = file.read()
 
 # SECURITY WARNING: keep the secret key used in production secret!
 SECRET_KEY = secret_key
@@ -85,6 +94,46 @@ DATABASES = {
     }
 }
 
+# DATABASE_URL replaces the SQLite database above, for example with a shared
+# PostgreSQL database so more than one bot host can serve the same notes; see
+# FicNotesBot.database_url for the forms it takes.
+
+if os.getenv('DATABASE_URL'):
+    DATABASES['default'] = database_url.parse(os.getenv('DATABASE_URL'), BASE_DIR)
+
+# SQLite tuning profiles, selected with the FICNOTESBOT_DB_PROFILE environment
+# variable. The pragmas are applied to every new connection by notes.sqlite;
+# profiles other than 'default' also keep connections open between commands.
+
+FICNOTESBOT_SQLITE_PROFILES = {
+    'default': {},
+    'production': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'mmap_size': 268435456,
+        'cache_size': -65536,
+        'busy_timeout': 5000,
+    },
+}
+
+# The 'pooled' profile, the default for PostgreSQL, runs queries on the pool
+# of FICNOTESBOT_DB_WORKERS database threads, each keeping its connection open.
+# Each bot process then holds that many connections, so the server's
+# max_connections must cover workers times shards times hosts.
+
+FICNOTESBOT_DB_PROFILES = list(FICNOTESBOT_SQLITE_PROFILES) + ['pooled']
+
+FICNOTESBOT_DB_PROFILE = os.getenv('FICNOTESBOT_DB_PROFILE',
+                                   'pooled' if DATABASES['default']['ENGINE'] == 'django.db.backends.postgresql' else 'default')
+
+if FICNOTESBOT_DB_PROFILE not in FICNOTESBOT_DB_PROFILES:
+    raise ImproperlyConfigured('FICNOTESBOT_DB_PROFILE must be one of ' + ', '.join(FICNOTESBOT_DB_PROFILES))
+
+FICNOTESBOT_SQLITE_PRAGMAS = FICNOTESBOT_SQLITE_PROFILES.get(FICNOTESBOT_DB_PROFILE, {})
+
+if FICNOTESBOT_DB_PROFILE != 'default':
+    DATABASES['default']['CONN_MAX_AGE'] = None
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.1/ref/settings/#auth-password-validators
@@ -123,3 +172,36 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/3.1/howto/static-files/
 
 STATIC_URL = '/static/'
+
+
+# Bot database execution
+# 'serial' runs every query on one shared thread; 'pool' runs them on a bounded
+# thread pool with one connection per worker. 'async' (SQLite only, needs
+# aiosqlite) awaits the list commands and note writes on the event loop and
+# runs everything else on the pool. Calls beyond the queue depth are refused
+# with a busy reply instead of waiting.
+
+FICNOTESBOT_DB_MODE = os.getenv('FICNOTESBOT_DB_MODE', 'pool' if FICNOTESBOT_DB_PROFILE == 'pooled' else 'serial')
+
+FICNOTESBOT_DB_WORKERS = int(os.getenv('FICNOTESBOT_DB_WORKERS', '4'))
+
+FICNOTESBOT_DB_QUEUE_DEPTH = int(os.getenv('FICNOTESBOT_DB_QUEUE_DEPTH', '64'))
+
+# Write-behind for notes: with FICNOTESBOT_NOTE_BATCH_MS set, add note commands
+# queue their insert and are confirmed once it commits, together with the other
+# notes added within that many milliseconds, up to FICNOTESBOT_NOTE_BATCH_ROWS.
+# Unset or 0 saves each note as it comes.
+
+FICNOTESBOT_NOTE_BATCH_MS = int(os.getenv('FICNOTESBOT_NOTE_BATCH_MS', '0'))
+
+FICNOTESBOT_NOTE_BATCH_ROWS = int(os.getenv('FICNOTESBOT_NOTE_BATCH_ROWS', '100'))
+
+# Port the bot serves Prometheus metrics on at /metrics, on localhost; unset
+# turns the endpoint off. Sharded bots serve shard N on this port plus N.
+
+FICNOTESBOT_METRICS_PORT = int(os.getenv('FICNOTESBOT_METRICS_PORT')) if os.getenv('FICNOTESBOT_METRICS_PORT') else None
+
+# Where rundiscordbot --profile-sample and --profile-slow-ms save command
+# profiles, and where profilesummary reads them from
+
+FICNOTESBOT_PROFILE_DIR = os.getenv('FICNOTESBOT_PROFILE_DIR', str(BASE_DIR / 'profiles'))
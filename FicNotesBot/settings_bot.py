@@ -0,0 +1,23 @@
+"""
+Settings for the bot process, selected with
+DJANGO_SETTINGS_MODULE=FicNotesBot.settings_bot as run.sh does.
+
+The bot only needs its own models, so it leaves out the admin, sessions,
+templates and middleware, and keeps DEBUG off so executed queries are not
+recorded. Everything else comes from FicNotesBot.settings.
+"""
+
+from FicNotesBot.settings import *
+
+DEBUG = False
+
+INSTALLED_APPS = [
+    'notes.apps.NotesConfig',
+    'django.contrib.contenttypes',
+]
+
+MIDDLEWARE = []
+
+TEMPLATES = []
+
+ROOT_URLCONF = 'FicNotesBot.urls_bot'
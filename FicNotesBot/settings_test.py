@@ -0,0 +1,19 @@
+"""
+Settings for running the tests, selected with
+python manage.py test notes --settings=FicNotesBot.settings_test
+
+The tests never touch the deployment's secret file or database: a key is
+made for the run, and DATABASE_URL points at a database in a temporary
+directory unless it is already set. Both go into the environment, so the
+processes the tests start use them too. Everything else comes from
+FicNotesBot.settings.
+"""
+
+import os
+import secrets
+import tempfile
+
+os.environ.setdefault('DJANGO_SECRET_KEY', secrets.token_urlsafe(50))
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='ficnotesbot-'), 'db.sqlite3'))
+
+from FicNotesBot.settings import *
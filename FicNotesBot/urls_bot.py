@@ -0,0 +1,6 @@
+"""FicNotesBot URL Configuration for the bot process
+
+The bot serves no pages, and the admin isn't installed under settings_bot.
+"""
+
+urlpatterns = []
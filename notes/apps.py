@@ -1,5 +1,19 @@
 from django.apps import AppConfig
+from django.core import checks
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
 
 
 class NotesConfig(AppConfig):
     name = 'notes'
+
+    def ready(self):
+        from notes import cache
+        from notes.models import DiscordUser, Story, StoryElement
+        from notes.sqlite import check_sqlite_version, configure_connection
+        connection_created.connect(configure_connection)
+        checks.register(check_sqlite_version, checks.Tags.compatibility)
+        for signal in (post_save, post_delete):
+            signal.connect(cache.story_changed, sender=Story)
+            signal.connect(cache.element_changed, sender=StoryElement)
+        post_delete.connect(cache.user_deleted, sender=DiscordUser)
@@ -0,0 +1,212 @@
+# Copyright 2020 called2voyage
+#
+# This file is part of FicNotesBot.
+#
+# FicNotesBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# FicNotesBot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with FicNotesBot.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import time
+
+from django.conf import settings
+from django.db import connection
+
+try:
+    import aiosqlite
+except ImportError:
+    aiosqlite = None
+
+from notes import cache, metrics, queries
+from notes.exceptions import NoteNotFoundError
+from notes.models import Story, StoryElement, StorySummary
+
+# The hot read and note paths in raw SQL, awaited on the event loop through
+# aiosqlite instead of running the ORM helpers in notes.queries on a database
+# thread. Each returns the same rows as its notes.queries counterpart. Only
+# the happy path is native: when a lookup comes back empty or ambiguous, the
+# call is handed to the ORM helper, which works out which error to raise.
+
+# Rows without a LIMIT; SQLite reads -1 as no limit
+NO_LIMIT = -1
+
+STORY_JOIN = ('JOIN notes_story s ON s.id = e.story_id JOIN notes_discorduser u ON u.id = s.owner_id '
+              'WHERE s.name = ? AND u.user_id = ?')
+
+# A story's element and note totals, as queries.STORY_TOTALS
+SUMMARY_JOIN = 'LEFT JOIN notes_storysummary ss ON ss.story_id = s.id '
+STORY_TOTALS = 'COALESCE(%s, 0), COALESCE(ss.note_count, 0)' % ' + '.join('ss.' + field for field in StorySummary.TYPE_FIELDS.values())
+
+def available():
+    """Whether the default database can be reached through aiosqlite"""
+    return aiosqlite is not None and connection.vendor == 'sqlite'
+
+def _limit(limit):
+    return NO_LIMIT if limit is None else limit
+
+class AsyncQueries:
+    """Native async versions of the notes.queries helpers, on one aiosqlite connection
+
+    fallbacks maps each helper to its awaitable ORM version, which is called
+    whenever the native one would have to raise.
+    """
+
+    def __init__(self, fallbacks):
+        self.fallbacks = fallbacks
+        self.connection = None
+        self.connecting = None
+
+    async def connect(self):
+        if self.connection is not None:
+            return self.connection
+        # Commands arriving together share the first connection attempt
+        if self.connecting is None:
+            self.connecting = asyncio.ensure_future(self._open())
+        try:
+            self.connection = await asyncio.shield(self.connecting)
+        finally:
+            self.connecting = None
+        return self.connection
+
+    async def _open(self):
+        params = connection.get_connection_params()
+        kwargs = {'uri': params.get('uri', False), 'isolation_level': None}
+        if 'timeout' in params:
+            kwargs['timeout'] = params['timeout']
+        db = await aiosqlite.connect(params['database'], **kwargs)
+        for name, value in getattr(settings, 'FICNOTESBOT_SQLITE_PRAGMAS', {}).items():
+            await db.execute('PRAGMA %s = %s' % (name, value))
+        return db
+
+    def close(self):
+        """Stop the connection's thread; safe to call from outside the event loop"""
+        if self.connection is not None:
+            self.connection.stop()
+            self.connection = None
+
+    async def execute(self, sql, params=()):
+        """Run sql, charging it to the running command, and return its rows"""
+        db = await self.connect()
+        stats = metrics.current()
+        start = time.perf_counter()
+        try:
+            return await db.execute_fetchall(sql, params)
+        finally:
+            if stats is not None:
+                elapsed = time.perf_counter() - start
+                stats.queries += 1
+                stats.db += elapsed
+                if stats.sql is not None:
+                    stats.sql.append((sql, elapsed))
+
+    async def fallback(self, func, *args):
+        return await self.fallbacks[func](*args)
+
+    async def list_stories(self, user_id, limit=None):
+        user_pk = cache.users.get(user_id)
+        if user_pk is not None:
+            rows = await self.execute('SELECT s.name, s.name, %s FROM notes_story s %sWHERE s.owner_id = ? ORDER BY s.name LIMIT ?'
+                                      % (STORY_TOTALS, SUMMARY_JOIN), (user_pk, _limit(limit)))
+            return user_pk, [tuple(row) for row in rows]
+        rows = await self.execute('SELECT s.owner_id, s.name, s.name, %s FROM notes_story s JOIN notes_discorduser u ON u.id = s.owner_id %s'
+                                  'WHERE u.user_id = ? ORDER BY s.name LIMIT ?' % (STORY_TOTALS, SUMMARY_JOIN), (user_id, _limit(limit)))
+        if not rows:
+            return await self.fallback(queries.list_stories, user_id, limit)
+        cache.users.set(user_id, rows[0][0])
+        return rows[0][0], [tuple(row[1:]) for row in rows]
+
+    async def list_stories_after(self, user_pk, after, limit):
+        rows = await self.execute('SELECT s.name, s.name, %s FROM notes_story s %sWHERE s.owner_id = ? AND s.name > ? ORDER BY s.name LIMIT ?'
+                                  % (STORY_TOTALS, SUMMARY_JOIN), (user_pk, after, _limit(limit)))
+        return [tuple(row) for row in rows]
+
+    def _elements_columns(self, type):
+        if type == StoryElement.PLOTPOINT:
+            return 'e.story_id, p.sort_key, e.name, p.header', 'p.sort_key'
+        return 'e.story_id, e.name, e.name', 'e.name'
+
+    async def list_elements_by_type(self, user_id, story, type, limit=None):
+        columns, order = self._elements_columns(type)
+        join = 'LEFT JOIN notes_plotpoint p ON p.index_id = e.id ' if type == StoryElement.PLOTPOINT else ''
+        cached = cache.stories.get((user_id, story))
+        if cached is not None:
+            rows = await self.execute('SELECT %s FROM notes_storyelement e %sWHERE e.story_id = ? AND e.type = ? ORDER BY %s LIMIT ?'
+                                      % (columns, join, order), (cached[0], type, _limit(limit)))
+        else:
+            rows = await self.execute('SELECT %s FROM notes_storyelement e %s%s AND e.type = ? ORDER BY %s LIMIT ?'
+                                      % (columns, join, STORY_JOIN, order), (story, user_id, type, _limit(limit)))
+        if not rows:
+            return await self.fallback(queries.list_elements_by_type, user_id, story, type, limit)
+        return rows[0][0], [tuple(row[1:]) for row in rows]
+
+    async def list_elements_after(self, story_pk, type, after, limit):
+        if type == StoryElement.PLOTPOINT:
+            rows = await self.execute('SELECT p.sort_key, e.name, p.header FROM notes_storyelement e JOIN notes_plotpoint p ON p.index_id = e.id '
+                                      'WHERE e.story_id = ? AND e.type = ? AND p.sort_key > ? ORDER BY p.sort_key LIMIT ?',
+                                      (story_pk, type, after, _limit(limit)))
+        else:
+            rows = await self.execute('SELECT name, name FROM notes_storyelement WHERE story_id = ? AND type = ? AND name > ? ORDER BY name LIMIT ?',
+                                      (story_pk, type, after, _limit(limit)))
+        return [tuple(row) for row in rows]
+
+    async def resolve_element(self, user_id, element, story, type=None):
+        """The element's primary key, or None when the ORM helper has to work out the error"""
+        cached = cache.stories.get((user_id, story))
+        if cached is not None:
+            sql = 'SELECT e.id FROM notes_storyelement e WHERE e.story_id = ? AND e.name = ?'
+            params = [cached[0], element]
+        else:
+            sql = 'SELECT e.id, s.id, s.owner_id FROM notes_storyelement e ' + STORY_JOIN + ' AND e.name = ?'
+            params = [story, user_id, element]
+        if type is not None:
+            sql += ' AND e.type = ?'
+            params.append(type)
+        rows = await self.execute(sql, params)
+        if len(rows) != 1:
+            return None
+        if cached is None:
+            queries.cache_story(user_id, Story(pk=rows[0][1], owner_id=rows[0][2], name=story))
+        return rows[0][0]
+
+    async def list_notes(self, user_id, element, story, type=None, limit=None):
+        element_pk = await self.resolve_element(user_id, element, story, type)
+        if element_pk is None:
+            return await self.fallback(queries.list_notes, user_id, element, story, type, limit)
+        notes = await self.list_notes_after(element_pk, 0, limit)
+        if not notes:
+            raise NoteNotFoundError
+        return element_pk, notes
+
+    async def list_notes_after(self, element_pk, after, limit):
+        rows = await self.execute('SELECT id, note FROM notes_note WHERE element_id = ? AND id > ? ORDER BY id LIMIT ?',
+                                  (element_pk, after, _limit(limit)))
+        return [tuple(row) for row in rows]
+
+    async def note_element(self, user_id, element, story, type=None):
+        element_pk = await self.resolve_element(user_id, element, story, type)
+        if element_pk is None:
+            return await self.fallback(queries.note_element, user_id, element, story, type)
+        return element_pk, element
+
+    async def save_note(self, user_id, note, element, story, type=None):
+        element_pk = await self.resolve_element(user_id, element, story, type)
+        if element_pk is None:
+            return await self.fallback(queries.save_note, user_id, note, element, story, type)
+        await self.execute('INSERT INTO notes_note (element_id, note) VALUES (?, ?)', (element_pk, note))
+        # The lookup matched the name exactly, so it is the element's own
+        return element
+
+# notes.queries helpers with a native version, by the name of the AsyncQueries method
+NATIVE = {getattr(queries, name): name for name in [
+    'list_stories', 'list_stories_after', 'list_elements_by_type', 'list_elements_after',
+    'list_notes', 'list_notes_after', 'save_note', 'note_element',
+]}
@@ -0,0 +1,816 @@
+# Copyright 2020 called2voyage
+#
+# This file is part of FicNotesBot.
+#
+# FicNotesBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# FicNotesBot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with FicNotesBot.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import timeit
+import tracemalloc
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import OperationalError, connection, connections
+from django.test.utils import CaptureQueriesContext, override_settings, setup_test_environment, teardown_test_environment
+
+from notes import cache, core, dbpool, exporter, fakegateway, importer, outbound, queries, router, search, shards, summaries, writebehind
+from notes.fakegateway import FakeChannel, FakeClick, FakeGuild, FakeMessage, FakeUser
+from notes.exceptions import UserNotCreatedError, ElementNotFoundError
+from notes.pagination import Pager, PAGE_ROWS, MESSAGE_LIMIT
+from notes.models import DiscordUser, Story, StoryElement, StorySummary, PlotPoint, Note
+from notes.testing import USER_ID, USER_NAME, HELPER_CALLS, seed_notes, seed_story, simulate_messages
+
+# The prefixes the bot used to test, one after another, for every message,
+# with the number of times it re-split the arguments on ' > ' after a match
+LEGACY_ADD_PREFIXES = [
+    ('!ficnotesbot add story ', 0),
+    ('!ficnotesbot add character ', 2),
+    ('!ficnotesbot add object ', 2),
+    ('!ficnotesbot add event ', 2),
+    ('!ficnotesbot add place ', 2),
+    ('!ficnotesbot add concept ', 2),
+    ('!ficnotesbot add plotpoint ', 2),
+    ('!ficnotesbot add note ', 3),
+]
+
+LEGACY_LIST_PREFIXES = [
+    ('!ficnotesbot list stories', 0),
+    ('!ficnotesbot list characters in ', 0),
+    ('!ficnotesbot list objects in ', 0),
+    ('!ficnotesbot list events in ', 0),
+    ('!ficnotesbot list places in ', 0),
+    ('!ficnotesbot list concepts in ', 0),
+    ('!ficnotesbot list plotpoints in ', 0),
+    ('!ficnotesbot list notes for ', 2),
+]
+
+DISPATCH_MESSAGES = {
+    'non-matching': 'has anyone seen the new chapter yet? I think the ending was rushed',
+    'add note': '!ficnotesbot add note Has a scar on her left hand > Alice > My Story',
+    'list notes': '!ficnotesbot list notes for Alice > My Story',
+}
+
+def _legacy_match(content, prefixes):
+    args = None
+    for prefix, splits in prefixes:
+        if content.startswith(prefix):
+            rest = content.split(prefix)[1]
+            args = [rest.split(' > ')[i] for i in range(splits)] or [rest]
+    return args
+
+def _legacy_dispatch(content):
+    args = None
+    if content.startswith('!ficnotesbot add '):
+        args = _legacy_match(content, LEGACY_ADD_PREFIXES)
+    if content.startswith('!ficnotesbot list '):
+        args = _legacy_match(content, LEGACY_LIST_PREFIXES)
+    return args
+
+def bench_dispatch(write, number=200000):
+    """Compare per-message dispatch cost of the router with the old startswith chain"""
+    write('%-14s %14s %14s' % ('message', 'router (ns)', 'legacy (ns)'))
+    for label, content in DISPATCH_MESSAGES.items():
+        routed = min(timeit.repeat(lambda: router.parse(content), number=number, repeat=5))
+        legacy = min(timeit.repeat(lambda: _legacy_dispatch(content), number=number, repeat=5))
+        write('%-14s %14.1f %14.1f' % (label, routed / number * 1e9, legacy / number * 1e9))
+
+@contextmanager
+def test_database(name=None, **overrides):
+    """Run the enclosed block against a freshly migrated throwaway database
+
+    name puts the database in that file instead of in memory, and overrides
+    replace keys of the connection's settings for the duration.
+    """
+    saved = {key: connection.settings_dict.get(key) for key in overrides}
+    saved_test = dict(connection.settings_dict['TEST'])
+    connection.settings_dict.update(overrides)
+    if name is not None:
+        connection.settings_dict['TEST']['NAME'] = name
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+        connection.settings_dict.update(saved)
+        connection.settings_dict['TEST'] = saved_test
+        cache.clear()
+
+def bench_cache(write, repeat=5):
+    """Show how the user and story cache cuts queries for repeated commands"""
+    with test_database():
+        seed_story()
+        cache.clear()
+        for name in ['list_notes', 'save_note', 'list_elements_by_type', 'list_stories']:
+            call = HELPER_CALLS[name][0]
+            counts = []
+            for i in range(repeat):
+                with CaptureQueriesContext(connection) as context:
+                    call()
+                counts.append(len(context.captured_queries))
+            write('%-22s queries per call: %s' % (name, ' '.join(str(c) for c in counts)))
+        for name, stats in cache.stats().items():
+            write('%-22s %s' % (name + ' cache', stats))
+
+def bench_concurrency(write, messages=400, pool_sizes=(1, 2, 4, 8), latency=0.002):
+    """Throughput of concurrent simulated commands for each database execution mode"""
+    with test_database():
+        seed_story()
+        for label, delay in [('local', 0), ('%gms per query' % (latency * 1000), latency)]:
+            write('%s database' % label)
+            setups = [('serial', dbpool.database_executor('serial', queue_depth=messages))]
+            setups += [('pool x%d' % n, dbpool.database_executor('pool', n, messages)) for n in pool_sizes]
+            for name, executor in setups:
+                elapsed, refused = asyncio.run(simulate_messages(executor, messages, delay))
+                executor.shutdown()
+                write('  %-10s %8.0f msg/s  %d refused' % (name, messages / elapsed, refused))
+        executor = dbpool.database_executor('pool', 2, 16)
+        elapsed, refused = asyncio.run(simulate_messages(executor, messages))
+        executor.shutdown()
+        write('pool x2 with queue depth 16: %d of %d refused as busy' % (refused, messages))
+
+async def _write_notes(executor, count):
+    save_note = executor.wrap(queries.save_note)
+
+    async def write_note(i):
+        try:
+            await save_note(USER_ID, 'Note %d' % i, 'Alice', 'Story')
+            return True
+        except OperationalError:
+            return False
+    start = time.perf_counter()
+    results = await asyncio.gather(*[write_note(i) for i in range(count)])
+    return time.perf_counter() - start, results.count(False)
+
+def bench_writes(write, notes=2000, pool_sizes=(1, 4)):
+    """Throughput of save_note on a file database under each SQLite tuning profile"""
+    write('%-12s %-8s %10s %8s' % ('profile', 'mode', 'notes/s', 'errors'))
+    for profile, pragmas in settings.FICNOTESBOT_SQLITE_PROFILES.items():
+        conn_max_age = 0 if profile == 'default' else None
+        for workers in pool_sizes:
+            with tempfile.TemporaryDirectory() as directory:
+                name = os.path.join(directory, 'bench.sqlite3')
+                with override_settings(FICNOTESBOT_SQLITE_PRAGMAS=pragmas), test_database(name, CONN_MAX_AGE=conn_max_age):
+                    seed_story()
+                    executor = dbpool.database_executor('pool', workers, notes)
+                    elapsed, errors = asyncio.run(_write_notes(executor, notes))
+                    executor.shutdown()
+            write('%-12s %-8s %10.0f %8d' % (profile, 'pool x%d' % workers, notes / elapsed, errors))
+
+def bench_search(write, notes=1000000, repeat=20, budget=0.010):
+    """Latency of search over a large database, against the icontains scan it replaces"""
+    failures = []
+    with test_database():
+        write('Seeding %d notes...' % notes)
+        words = seed_notes(notes)
+        user_id = USER_ID + 1000
+        story = 'Seed %d' % user_id
+        searches = {
+            'common word': words[20],
+            'typical word': words[200],
+            'rare word': words[1500],
+            'two words': words[20] + ' ' + words[200],
+            'plural form': words[200] + 's',
+            'no match': 'nothingmatchesthis',
+        }
+        write('%-14s %8s %10s %10s' % ('search', 'results', 'median ms', 'max ms'))
+        for label, terms in searches.items():
+            cache.clear()
+            results = search.search_notes(user_id, terms, story)
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                search.search_notes(user_id, terms, story)
+                timings.append(time.perf_counter() - start)
+            timings.sort()
+            write('%-14s %8d %10.2f %10.2f' % (label, len(results), timings[len(timings) // 2] * 1000, timings[-1] * 1000))
+            if timings[len(timings) // 2] > budget:
+                failures.append(label)
+        start = time.perf_counter()
+        scanned = list(Note.objects.filter(element__story__name=story, note__icontains=words[1500])[:search.SEARCH_LIMIT])
+        write('icontains scan for the rare word: %d results, %.2f ms' % (len(scanned), (time.perf_counter() - start) * 1000))
+    return failures
+
+NAME_ONSETS = ['b', 'br', 'c', 'ch', 'd', 'dr', 'f', 'fl', 'g', 'gr', 'h', 'j', 'k', 'l', 'm', 'n', 'p', 'pr', 'qu', 'r', 's', 'sh', 'st', 't', 'th', 'tr', 'v', 'w', 'y', 'z']
+NAME_VOWELS = ['a', 'e', 'i', 'o', 'u', 'ae', 'ai', 'ea', 'ie', 'ou', 'y']
+NAME_CODAS = ['', '', '', 'n', 'r', 's', 'l', 'th', 'nd', 'st', 'm']
+
+def seed_name(rng):
+    """A made-up two word name like a character or place might have"""
+    return ' '.join(
+        ''.join(rng.choice(NAME_ONSETS) + rng.choice(NAME_VOWELS) + rng.choice(NAME_CODAS) for _ in range(rng.randint(1, 3))).capitalize()
+        for _ in range(2)
+    )
+
+def misspell(rng, name):
+    """name with one letter dropped, added, replaced or swapped with the next"""
+    i = rng.randrange(1, len(name) - 1)
+    typo = rng.randrange(4)
+    if typo == 0:
+        return name[:i] + name[i + 1:]
+    if typo == 1:
+        return name[:i] + rng.choice('aeiourstn') + name[i:]
+    if typo == 2:
+        return name[:i] + rng.choice('aeiourstn') + name[i + 1:]
+    return name[:i] + name[i + 1] + name[i] + name[i + 2:]
+
+def bench_fuzzy(write, elements=50000, lookups=1000, budget=0.001):
+    """Cost of suggesting element names for misspelt lookups in a story with many elements"""
+    rng = random.Random(0)
+    with test_database():
+        seed_story()
+        story_pk = queries.resolve_story(USER_ID, 'Story').pk
+        names = {seed_name(rng) for _ in range(elements)}
+        types = [t for t, _ in StoryElement.ELEMENT_TYPE_CHOICES if t != StoryElement.PLOTPOINT]
+        StoryElement.objects.bulk_create([StoryElement(story_id=story_pk, type=types[i % len(types)], name=name) for i, name in enumerate(names)], batch_size=5000)
+        start = time.perf_counter()
+        index = queries.element_names(story_pk)
+        write('index of %d names built in %.1f ms' % (len(index), (time.perf_counter() - start) * 1000))
+        targets = rng.sample(sorted(names), lookups)
+        typos = [misspell(rng, name) for name in targets]
+        timings = []
+        found = 0
+        for name, typo in zip(targets, typos):
+            start = time.perf_counter()
+            suggestions = index.suggest(typo)
+            timings.append(time.perf_counter() - start)
+            found += name in suggestions
+        timings.sort()
+        median = timings[len(timings) // 2]
+        write('suggest: median %.3f ms, p99 %.3f ms, misspelt name suggested %d/%d' % (median * 1000, timings[len(timings) * 99 // 100] * 1000, found, lookups))
+        with CaptureQueriesContext(connection) as context:
+            try:
+                queries.save_note(USER_ID, 'A note', typos[0], 'Story')
+            except ElementNotFoundError as e:
+                write('save_note %r: %d queries, suggested %s' % (typos[0], len(context.captured_queries), e.args[0]))
+        if median > budget:
+            return ['suggest']
+
+def _seed_export(story, elements, notes_per_element):
+    queries.save_story(USER_ID, USER_NAME, story)
+    story_pk = queries.resolve_story(USER_ID, story).pk
+    types = [t for t, _ in StoryElement.ELEMENT_TYPE_CHOICES if t != StoryElement.PLOTPOINT]
+    StoryElement.objects.bulk_create([StoryElement(story_id=story_pk, type=types[i % len(types)], name='Element %d' % i) for i in range(elements)], batch_size=5000)
+    element_ids = StoryElement.objects.filter(story_id=story_pk).values_list('id', flat=True)
+    Note.objects.bulk_create([Note(element_id=id, note='Note %d about element %d' % (i, id)) for id in element_ids for i in range(notes_per_element)], batch_size=5000)
+
+def bench_export(write, sizes=(2000, 20000), notes_per_element=10):
+    """Time, queries and peak memory of exporting stories of growing size"""
+    write('%-9s %-9s %8s %10s %10s %12s' % ('elements', 'format', 'ms', 'queries', 'MB out', 'peak KB'))
+    failures = []
+    with test_database():
+        for elements in sizes:
+            story = 'Export %d' % elements
+            _seed_export(story, elements, notes_per_element)
+            for format in exporter.WRITERS:
+                with tempfile.TemporaryFile() as file, CaptureQueriesContext(connection) as context:
+                    start = time.perf_counter()
+                    _, size = exporter.export_story_file(USER_ID, story, file, format)
+                    elapsed = time.perf_counter() - start
+                    if format == 'json' and len(json.load(file)['elements']) != elements:
+                        failures.append('json %d' % elements)
+                # Again with allocations traced, which is too slow to time
+                with tempfile.TemporaryFile() as file:
+                    tracemalloc.start()
+                    exporter.export_story_file(USER_ID, story, file, format)
+                    _, peak = tracemalloc.get_traced_memory()
+                    tracemalloc.stop()
+                write('%-9d %-9s %8.0f %10d %10.1f %12.0f' % (elements, format, elapsed * 1000, len(context.captured_queries), size / 1e6, peak / 1024))
+    return failures
+
+def bench_pages(write, notes=10000):
+    """Cost of the first page of list notes for a large element, and of paging through all of it"""
+    with test_database():
+        seed_story()
+        element_pk, _ = queries.list_notes(USER_ID, 'Alice', 'Story')
+        Note.objects.bulk_create([Note(element_id=element_pk, note='Note number %d about Alice' % i) for i in range(notes)])
+        fetched = []
+        executor = dbpool.database_executor('pool', 1, 16)
+        list_notes = executor.wrap(queries.list_notes)
+        list_notes_after = executor.wrap(queries.list_notes_after)
+
+        async def fetch(after, limit):
+            rows = await list_notes_after(element_pk, after, limit)
+            fetched.append(len(rows))
+            return rows
+
+        async def first_page():
+            _, rows = await list_notes(USER_ID, 'Alice', 'Story', None, PAGE_ROWS + 1)
+            fetched.append(len(rows))
+            pager = Pager('<@%d> ' % USER_ID, 'Alice notes', rows, fetch)
+            return pager, await pager.next_message()
+
+        async def all_pages(pager):
+            sizes = []
+            message = await pager.next_message()
+            while message is not None:
+                sizes.append(len(message))
+                message = await pager.next_message()
+            return sizes
+
+        start = time.perf_counter()
+        pager, message = asyncio.run(first_page())
+        elapsed = time.perf_counter() - start
+        write('first page: %d rows fetched, %d characters, %.2f ms' % (sum(fetched), len(message), elapsed * 1000))
+        start = time.perf_counter()
+        sizes = asyncio.run(all_pages(pager))
+        elapsed = time.perf_counter() - start
+        executor.shutdown()
+        write('remaining pages: %d messages, longest %d characters, %d rows fetched, %.2f ms' % (len(sizes), max(sizes), sum(fetched), elapsed * 1000))
+        if max(sizes + [len(message)]) > MESSAGE_LIMIT:
+            return ['pages']
+
+async def _burst(outbox, channels, replies):
+    sends = []
+    for i in range(replies):
+        channel = channels[i % len(channels)]
+        if i % 10 == 0:
+            sends.append(outbox.send(channel, 'page %d' % i, outbound.PAGE, False))
+        else:
+            sends.append(outbox.send(channel, 'confirmation %d' % i))
+    await asyncio.gather(*sends)
+
+def bench_outbox(write, replies=200, channels=4):
+    """How a burst of replies across a few channels is merged and rate limited"""
+    fakes = [FakeChannel(i) for i in range(channels)]
+    outbox = outbound.Outbox()
+    start = time.perf_counter()
+    asyncio.run(_burst(outbox, fakes, replies))
+    elapsed = time.perf_counter() - start
+    stats = outbox.stats()
+    write('%d replies to %d channels went out in %d messages in %.2f s' % (replies, channels, sum(len(f.sent) for f in fakes), elapsed))
+    write('merged %(merged)d, average wait %(wait_avg).3f s, longest wait %(wait_max).3f s' % stats)
+    write('first sends to channel 0: %s' % [content.split('\n')[0] for content in fakes[0].sent[:4]])
+
+def shard_messages(shard_id, shard_count, guilds, per_guild):
+    """The messages Discord would send shard_id: per_guild commands from each guild on that shard, one in ten a write"""
+    messages = []
+    ids = itertools.count(1)
+    for g in range(guilds):
+        # Guild ids carry their shard in the bits above the timestamp's low 22
+        guild = FakeGuild(g << 22)
+        if shards.shard_for(guild.id, shard_count) != shard_id:
+            continue
+        channel = FakeChannel(g + 1, latency=0, guild=guild)
+        author = FakeUser(USER_ID + g, USER_NAME)
+        for i in range(per_guild):
+            if i % 10 == 0:
+                content = '!ficnotesbot add note Seen again > Alice > Story'
+            else:
+                content = '!ficnotesbot list notes for Alice > Story'
+            messages.append(FakeMessage(next(ids), content, author, channel))
+    return messages
+
+def _run_shard(args):
+    shard_id, shard_count, guilds, per_guild = args
+    messages = shard_messages(shard_id, shard_count, guilds, per_guild)
+    return len(messages), fakegateway.run_bot(messages, shard_id, shard_count)
+
+def bench_shards(write, shard_counts=(1, 2, 4), guilds=64, per_guild=100):
+    """Messages per second handled by the real bot handlers with the guilds split over more shard processes"""
+    pragmas = settings.FICNOTESBOT_SQLITE_PROFILES['production']
+    write('%d cores available' % os.cpu_count())
+    write('%-7s %10s %10s %12s' % ('shards', 'messages', 'wall s', 'messages/s'))
+    with tempfile.TemporaryDirectory() as directory:
+        name = os.path.join(directory, 'bench.sqlite3')
+        with override_settings(FICNOTESBOT_SQLITE_PRAGMAS=pragmas), test_database(name, CONN_MAX_AGE=None):
+            for g in range(guilds):
+                queries.save_story(USER_ID + g, USER_NAME, 'Story')
+                queries.save_element(USER_ID + g, 'Alice', 'Story', StoryElement.CHARACTER)
+                for i in range(20):
+                    queries.save_note(USER_ID + g, 'Note %d' % i, 'Alice', 'Story')
+            for count in shard_counts:
+                # Each shard process opens its own connection
+                connections.close_all()
+                context = multiprocessing.get_context('fork')
+                start = time.perf_counter()
+                with context.Pool(count) as pool:
+                    results = pool.map(_run_shard, [(i, count, guilds, per_guild) for i in range(count)])
+                elapsed = time.perf_counter() - start
+                handled = sum(n for n, _ in results)
+                write('%-7d %10d %10.2f %12.0f' % (count, handled, elapsed, handled / elapsed))
+
+# Run in a fresh interpreter: set Django up and build everything rundiscordbot
+# does before it connects, optionally importing discord.py up front as the bot
+# used to, then print the seconds since the interpreter started
+STARTUP_PROBE = '''
+import json, os, sys, time
+import django
+django.setup()
+from notes import core, dbpool
+from notes.management.commands import rundiscordbot
+if sys.argv[1] == 'eager':
+    import discord
+core.Core(dbpool.database_executor())
+print(json.dumps({'seconds': time.time() - float(sys.argv[2]), 'modules': len(sys.modules)}))
+'''
+
+# Run in a fresh interpreter: replay a generated session through the command
+# core on a single database thread, then print the resident set size
+RSS_PROBE = '''
+import asyncio, json, sys
+import django
+django.setup()
+from django.db import connection
+from notes import core, dbpool, replay
+from notes.benchmarks import test_database, resident_kb
+
+async def run(requests):
+    executor = dbpool.database_executor('pool', 1, 64)
+    bot = core.Core(executor)
+    for request in requests:
+        await bot.handle(request)
+    stored = await executor.wrap(lambda: len(connection.queries_log))()
+    executor.shutdown()
+    return stored
+
+with test_database():
+    stored = asyncio.run(run(replay.generate_log(commands=int(sys.argv[1]))))
+    print(json.dumps({'kb': resident_kb(), 'stored_queries': stored}))
+'''
+
+def resident_kb():
+    """This process's resident set size in kB"""
+    try:
+        with open('/proc/self/status') as file:
+            for line in file:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def _probe(settings_module, script, *args):
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE=settings_module)
+    output = subprocess.run([sys.executable, '-c', script] + [str(arg) for arg in args], env=env, cwd=settings.BASE_DIR,
+                            check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+# (label, settings module, whether discord.py is imported before connecting)
+STARTUP_SETUPS = [
+    ('full settings, discord at import', 'FicNotesBot.settings', 'eager'),
+    ('full settings, discord deferred', 'FicNotesBot.settings', 'lazy'),
+    ('bot settings, discord deferred', 'FicNotesBot.settings_bot', 'lazy'),
+]
+
+def bench_startup(write, runs=11):
+    """Seconds from interpreter start until the bot is ready to connect, under each settings module"""
+    write('%-36s %10s %10s' % ('setup', 'median s', 'modules'))
+    for label, module, discord in STARTUP_SETUPS:
+        results = [_probe(module, STARTUP_PROBE, discord, time.time()) for _ in range(runs)]
+        seconds = sorted(result['seconds'] for result in results)
+        write('%-36s %10.3f %10d' % (label, seconds[len(seconds) // 2], results[0]['modules']))
+
+def bench_rss(write, commands=20000):
+    """Resident memory after replaying a long session under each settings module"""
+    write('%-26s %10s %16s' % ('settings', 'RSS MB', 'queries stored'))
+    for module in ('FicNotesBot.settings', 'FicNotesBot.settings_bot'):
+        result = _probe(module, RSS_PROBE, commands)
+        write('%-26s %10.1f %16d' % (module, result['kb'] / 1024, result['stored_queries']))
+
+# name -> (command answered by clicking 1️⃣, most API calls allowed)
+PROMPT_FLOWS = {
+    'add note (ambiguous)': ('!ficnotesbot add note Seen at the station > Paris > Story', 2),
+    'list notes (ambiguous)': ('!ficnotesbot list notes for Paris > Story', 2),
+}
+
+def bench_prompts(write):
+    """Discord API calls made to ask which element was meant and act on the answer"""
+    failures = []
+    with test_database():
+        seed_story()
+        author = FakeUser(USER_ID, USER_NAME)
+        write('%-26s %8s %8s  %s' % ('flow', 'calls', 'budget', 'calls made'))
+        for name, (content, budget) in PROMPT_FLOWS.items():
+            channel = FakeChannel(1, latency=0, guild=FakeGuild(1))
+            fakegateway.run_bot([FakeMessage(1, content, author, channel), FakeClick(channel, USER_ID, '1️⃣')], concurrency=1)
+            calls = [call for call, _ in channel.calls]
+            write('%-26s %8d %8d  %s' % (name, len(calls), budget, ', '.join(calls)))
+            if len(calls) > budget:
+                failures.append(name)
+    return failures
+
+# Run in a fresh interpreter against DATABASE_URL: time save_note and the list
+# commands on a pool of each size, then print notes and lists per second
+BACKEND_PROBE = '''
+import asyncio, json, sys
+import django
+django.setup()
+from notes import dbpool
+from notes.testing import seed_story, simulate_messages
+from notes.benchmarks import test_database, _write_notes
+count = int(sys.argv[2])
+results = []
+with test_database(sys.argv[1] or None):
+    seed_story()
+    for workers in json.loads(sys.argv[3]):
+        executor = dbpool.database_executor('pool', workers, count)
+        written, write_errors = asyncio.run(_write_notes(executor, count))
+        listed, _ = asyncio.run(simulate_messages(executor, count))
+        executor.shutdown()
+        results.append([workers, count / written, count / listed, write_errors])
+print(json.dumps(results))
+'''
+
+def bench_backends(write, notes=2000, pool_sizes=(1, 4)):
+    """save_note and list throughput on SQLite and, given FICNOTESBOT_BENCH_POSTGRES_URL, pooled PostgreSQL"""
+    write('%-12s %-8s %10s %10s %8s' % ('backend', 'mode', 'notes/s', 'lists/s', 'errors'))
+    with tempfile.TemporaryDirectory() as directory:
+        name = os.path.join(directory, 'bench.sqlite3')
+        backends = [('sqlite', 'sqlite:///' + name, 'production', name)]
+        postgres_url = os.getenv('FICNOTESBOT_BENCH_POSTGRES_URL')
+        if postgres_url:
+            backends.append(('postgresql', postgres_url, 'pooled', ''))
+        for label, url, profile, test_name in backends:
+            env = dict(os.environ, DATABASE_URL=url, FICNOTESBOT_DB_PROFILE=profile)
+            output = subprocess.run([sys.executable, '-c', BACKEND_PROBE, test_name, str(notes), json.dumps(pool_sizes)],
+                                    env=env, cwd=settings.BASE_DIR, check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+            for workers, written, listed, errors in json.loads(output.splitlines()[-1]):
+                write('%-12s %-8s %10.0f %10.0f %8d' % (label, 'pool x%d' % workers, written, listed, errors))
+    if not postgres_url:
+        write('Set FICNOTESBOT_BENCH_POSTGRES_URL to a PostgreSQL database URL whose user may create databases to compare.')
+
+# name -> (helper, arguments) for bench_async; the write goes to another user's
+# story, so the reads return the same rows in every mode
+ASYNC_CALLS = {
+    'list_stories': (queries.list_stories, (USER_ID,)),
+    'list_elements_by_type': (queries.list_elements_by_type, (USER_ID, 'Story', StoryElement.CHARACTER)),
+    'list_elements_by_type (plot points)': (queries.list_elements_by_type, (USER_ID, 'Story', StoryElement.PLOTPOINT)),
+    'list_notes': (queries.list_notes, (USER_ID, 'Alice', 'Story')),
+    'list_notes (by type)': (queries.list_notes, (USER_ID, 'Paris', 'Story', StoryElement.PLACE)),
+    'save_note': (queries.save_note, (USER_ID + 1, 'A note', 'Scratch', 'Scratch')),
+}
+
+async def _time_calls(executor, repeat):
+    results = {}
+    timings = {}
+    for name, (func, args) in ASYNC_CALLS.items():
+        call = executor.wrap(func)
+        results[name] = await call(*args)
+        seconds = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            await call(*args)
+            seconds.append(time.perf_counter() - start)
+        timings[name] = sorted(seconds)
+    return results, timings
+
+def bench_async(write, repeat=1000):
+    """Per-call latency of the hot helpers through sync_to_async threads and awaited natively through aiosqlite"""
+    if not dbpool.asyncdb.available():
+        write('Install aiosqlite to compare the async database mode.')
+        return []
+    failures = []
+    measured = {}
+    with tempfile.TemporaryDirectory() as directory:
+        name = os.path.join(directory, 'bench.sqlite3')
+        pragmas = settings.FICNOTESBOT_SQLITE_PROFILES['production']
+        with override_settings(FICNOTESBOT_SQLITE_PRAGMAS=pragmas), test_database(name, CONN_MAX_AGE=None):
+            seed_story()
+            queries.save_story(USER_ID + 1, USER_NAME, 'Scratch')
+            queries.save_element(USER_ID + 1, 'Scratch', 'Scratch', StoryElement.CHARACTER)
+            for mode in ('serial', 'pool', 'async'):
+                cache.clear()
+                executor = dbpool.database_executor(mode, 1, repeat)
+                try:
+                    measured[mode] = asyncio.run(_time_calls(executor, repeat))
+                finally:
+                    executor.shutdown()
+    write('%-36s %27s %27s' % ('', 'p50 us', 'p99 us'))
+    write('%-36s %8s %8s %8s  %8s %8s %8s' % ('helper', 'serial', 'pool x1', 'async', 'serial', 'pool x1', 'async'))
+    for name in ASYNC_CALLS:
+        timings = [measured[mode][1][name] for mode in ('serial', 'pool', 'async')]
+        write('%-36s %8.0f %8.0f %8.0f  %8.0f %8.0f %8.0f' % ((name,) + tuple(t[len(t) // 2] * 1e6 for t in timings)
+                                                            + tuple(t[len(t) * 99 // 100] * 1e6 for t in timings)))
+        if measured['async'][0][name] != measured['serial'][0][name]:
+            failures.append(name + ' (rows differ)')
+    return failures
+
+# Statements that change rows, and so commit when run under autocommit
+WRITE_STATEMENTS = ('INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+@contextmanager
+def count_commits():
+    """Count the transactions the default connection commits in the enclosed block, in a one item list
+
+    A write outside any atomic block counts as its own commit, as autocommit makes it.
+    """
+    commits = [0]
+    wrapper = connections['default']
+
+    def count(execute, sql, params, many, context):
+        if not context['connection'].in_atomic_block and sql.lstrip().upper().startswith(WRITE_STATEMENTS):
+            commits[0] += 1
+        return execute(sql, params, many, context)
+
+    def commit():
+        commits[0] += 1
+        type(wrapper).commit(wrapper)
+    wrapper.commit = commit
+    try:
+        with wrapper.execute_wrapper(count):
+            yield commits
+    finally:
+        del wrapper.commit
+
+def _legacy_save_story(user_id, user_name, name):
+    try:
+        user_pk = queries.resolve_user(user_id)
+    except UserNotCreatedError:
+        user = DiscordUser(user_id=user_id, name=user_name)
+        user.save()
+        user_pk = user.pk
+    Story(owner_id=user_pk, name=name).save()
+
+def _legacy_save_plotpoint(user_id, index, header, story):
+    story = queries.resolve_story(user_id, story)
+    element = StoryElement(story=story, type=StoryElement.PLOTPOINT, name=index)
+    element.save()
+    PlotPoint(index=element, header=header).save(force_insert=True)
+
+# name -> (callable, the same write as it was before each save ran in one transaction or None)
+COMMIT_CALLS = {
+    'save_story (new user)': (lambda n: queries.save_story(USER_ID + n, USER_NAME, 'Story'),
+                              lambda n: _legacy_save_story(USER_ID + 1000 + n, USER_NAME, 'Story')),
+    'save_story': (lambda n: queries.save_story(USER_ID, USER_NAME, 'Story %d' % n),
+                   lambda n: _legacy_save_story(USER_ID, USER_NAME, 'Legacy %d' % n)),
+    'save_element': (lambda n: queries.save_element(USER_ID, 'Element %d' % n, 'Story', StoryElement.CHARACTER), None),
+    'save_plotpoint': (lambda n: queries.save_plotpoint(USER_ID, str(n + 10), 'Things happen', 'Story'),
+                       lambda n: _legacy_save_plotpoint(USER_ID, str(n + 1000), 'Things happen', 'Story')),
+    'save_note': (lambda n: queries.save_note(USER_ID, 'A note', 'Alice', 'Story'), None),
+    'import_notes': (lambda n: importer.import_notes(USER_ID, 'One > Alice > Story\nTwo > Alice > Story'), None),
+}
+
+def bench_commits(write, repeat=200):
+    """Commits per write command, now and before each ran in a single transaction, with what each costs"""
+    failures = []
+    with tempfile.TemporaryDirectory() as directory:
+        name = os.path.join(directory, 'bench.sqlite3')
+        with test_database(name):
+            seed_story()
+            write('%-24s %8s %8s %10s %10s' % ('helper', 'commits', 'before', 'us/call', 'before'))
+            for label, (call, legacy) in COMMIT_CALLS.items():
+                results = []
+                for func in (call, legacy):
+                    if func is None:
+                        results.append(None)
+                        continue
+                    cache.clear()
+                    with count_commits() as commits:
+                        start = time.perf_counter()
+                        for n in range(1, repeat + 1):
+                            func(n)
+                        elapsed = time.perf_counter() - start
+                    results.append((commits[0] / repeat, elapsed / repeat * 1e6))
+                before = results[1] or (None, None)
+                write('%-24s %8.1f %8s %10.0f %10s' % (label, results[0][0], '-' if before[0] is None else '%.1f' % before[0],
+                                                         results[0][1], '-' if before[1] is None else '%.0f' % before[1]))
+                if results[0][0] > 1:
+                    failures.append(label)
+    return failures
+
+class CommitCountingExecutor(dbpool.PoolExecutor):
+    """Runs calls on a pool, counting the commits they make"""
+
+    def __init__(self, queue_depth, workers):
+        super().__init__(queue_depth, workers)
+        self.commits = 0
+        self.lock = threading.Lock()
+
+    def runner(self, func):
+        def counted(*args, **kwargs):
+            with count_commits() as commits:
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    with self.lock:
+                        self.commits += commits[0]
+        return super().runner(counted)
+
+def _note_requests(count, users=4):
+    return [core.Request(USER_ID, USER_NAME, 1 + i % users, '!ficnotesbot add note Sprint note %d > Alice > Story' % i)
+            for i in range(count)]
+
+async def _note_burst(bot, requests, rate):
+    async def send(i, request):
+        # Arrive at rate commands a second rather than all at once
+        await asyncio.sleep(i / rate)
+        start = time.perf_counter()
+        await bot.handle(request)
+        return time.perf_counter() - start
+    start = time.perf_counter()
+    latencies = await asyncio.gather(*[send(i, request) for i, request in enumerate(requests)])
+    if bot.batcher is not None:
+        await bot.batcher.drain()
+    return time.perf_counter() - start, sorted(latencies)
+
+async def _abandon_burst(bot, requests):
+    for request in requests:
+        asyncio.ensure_future(bot.handle(request))
+    # Stop once every note is queued, well inside the batch interval;
+    # asyncio.run then cancels the waiting commands as a stopping bot would
+    while bot.batcher.batch is None or len(bot.batcher.batch.rows) < len(requests):
+        await asyncio.sleep(0.01)
+
+def bench_writebehind(write, notes=2000, rates=(300, 1000), workers=4, batches=((0, None), (5, 50), (10, 100), (25, 500))):
+    """Notes and commits per second for a burst of add note commands, saving each note or batching them"""
+    failures = []
+    write('%-8s %-16s %10s %10s %8s %10s %10s' % ('msg/s', 'batching', 'notes/s', 'commits/s', 'commits', 'p50 ms', 'p99 ms'))
+    pragmas = settings.FICNOTESBOT_SQLITE_PROFILES['production']
+    for rate in rates:
+        for interval_ms, size in batches:
+            with tempfile.TemporaryDirectory() as directory, override_settings(FICNOTESBOT_SQLITE_PRAGMAS=pragmas):
+                with test_database(os.path.join(directory, 'bench.sqlite3'), CONN_MAX_AGE=None):
+                    seed_story()
+                    executor = CommitCountingExecutor(notes, workers)
+                    batcher = writebehind.note_batcher(executor, interval_ms, size) if interval_ms else None
+                    elapsed, latencies = asyncio.run(_note_burst(core.Core(executor, batcher=batcher), _note_requests(notes), rate))
+                    executor.shutdown()
+                    saved = Note.objects.filter(note__startswith='Sprint note').count()
+            label = '%d ms / %d rows' % (interval_ms, size) if interval_ms else 'off'
+            write('%-8d %-16s %10.0f %10.0f %8d %10.2f %10.2f' % (rate, label, notes / elapsed, executor.commits / elapsed, executor.commits,
+                                                                latencies[len(latencies) // 2] * 1000, latencies[len(latencies) * 99 // 100] * 1000))
+            if saved != notes:
+                failures.append('%s at %d msg/s (%d of %d notes saved)' % (label, rate, saved, notes))
+    with test_database():
+        seed_story()
+        executor = dbpool.database_executor('pool', 1, notes)
+        batcher = writebehind.note_batcher(executor, 60000, notes + 1)
+        asyncio.run(_abandon_burst(core.Core(executor, batcher=batcher), _note_requests(notes)))
+        executor.shutdown()
+        drained = batcher.drain_sync()
+        saved = Note.objects.filter(note__startswith='Sprint note').count()
+    write('stopped mid-batch: %d of %d notes written by the shutdown drain' % (drained, notes))
+    if saved != notes:
+        failures.append('shutdown drain (%d of %d notes saved)' % (saved, notes))
+    return failures
+
+def _overview_by_listing(user_id, story):
+    """A story's counts the way they had to be found before StorySummary: list each type, then count each element's notes"""
+    counts = {}
+    names = []
+    for type, field in StorySummary.TYPE_FIELDS.items():
+        try:
+            _, rows = queries.list_elements_by_type(user_id, story, type)
+        except ElementNotFoundError:
+            rows = []
+        counts[field] = len(rows)
+        if type != StoryElement.PLOTPOINT:
+            names.extend((row[0], type) for row in rows)
+    counts['note_count'] = sum(Note.objects.filter(element__story__owner__user_id=user_id, element__story__name=story,
+                                                   element__name=name, element__type=type).count() for name, type in names)
+    return counts
+
+def bench_summaries(write, notes=100000, repeat=20):
+    """Cost of a story overview from StorySummary against counting it, and whether the triggers keep the counts exact"""
+    failures = []
+    with test_database():
+        write('Seeding %d notes...' % notes)
+        seed_notes(notes)
+        seed_story()
+        drift = summaries.reconcile()
+        write('after seeding with bulk_create: %d summary fields differ from their counts' % len(drift))
+        if drift:
+            failures.append('seeded counts')
+        user_id, story = Story.objects.filter(name__startswith='Seed ').values_list('owner__user_id', 'name').first()
+        write('%-22s %10s %10s' % ('overview', 'queries', 'ms'))
+        results = []
+        for name, call in [('counted from lists', _overview_by_listing), ('StorySummary', queries.story_summary)]:
+            cache.clear()
+            with CaptureQueriesContext(connection) as context:
+                results.append(call(user_id, story))
+            elapsed = min(timeit.repeat(lambda: call(user_id, story), number=1, repeat=repeat))
+            write('%-22s %10d %10.2f' % (name, len(context.captured_queries), elapsed * 1000))
+        if results[0] != results[1]:
+            failures.append('overview counts differ')
+        story_pk = Story.objects.get(name=story).pk
+        StorySummary.objects.filter(story_id=story_pk).update(note_count=0)
+        StoryElement.objects.filter(story_id=story_pk, type=StoryElement.CHARACTER).first().delete()
+        drift = summaries.reconcile(fix=True)
+        write('after zeroing a note count and deleting an element: %d fields differ; %d after reconciling' % (len(drift), len(summaries.reconcile())))
+        if [field for _, field, _, _ in drift] != ['note_count'] or summaries.reconcile():
+            failures.append('reconcile')
+    return failures
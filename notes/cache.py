@@ -0,0 +1,120 @@
+# Copyright 2020 called2voyage
+#
+# This file is part of FicNotesBot.
+#
+# FicNotesBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# FicNotesBot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with FicNotesBot.  If not, see <https://www.gnu.org/licenses/>.
+
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+class LRUCache:
+    """Bounded mapping that evicts the least recently used key and expires keys after ttl seconds"""
+
+    def __init__(self, maxsize, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, expires = entry
+                if expires is None or expires > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, value):
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def discard_if(self, predicate):
+        """Drop every entry for which predicate(key, value) is true"""
+        with self._lock:
+            for key in [key for key, (value, _) in self._data.items() if predicate(key, value)]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._data), 'hits': self.hits, 'misses': self.misses}
+
+CACHE_SIZE = getattr(settings, 'FICNOTESBOT_CACHE_SIZE', 4096)
+CACHE_TTL = getattr(settings, 'FICNOTESBOT_CACHE_TTL', 600)
+NAME_INDEX_CACHE_SIZE = getattr(settings, 'FICNOTESBOT_NAME_INDEX_CACHE_SIZE', 256)
+
+# user_id -> DiscordUser primary key
+users = LRUCache(CACHE_SIZE, CACHE_TTL)
+# (user_id, story name) -> (Story primary key, DiscordUser primary key)
+stories = LRUCache(CACHE_SIZE, CACHE_TTL)
+# (Story primary key, element name, type) -> StoryElement primary key. Lookups
+# without a type aren't kept: another process adding an element of the same
+# name would make them ambiguous without this one hearing of it.
+elements = LRUCache(CACHE_SIZE, CACHE_TTL)
+# Story primary key -> fuzzy.TrigramIndex of its element names
+element_names = LRUCache(NAME_INDEX_CACHE_SIZE, CACHE_TTL)
+
+def clear():
+    users.clear()
+    stories.clear()
+    elements.clear()
+    element_names.clear()
+
+def stats():
+    return {'users': users.stats(), 'stories': stories.stats(), 'elements': elements.stats(), 'element_names': element_names.stats()}
+
+# Receivers for the models' save and delete signals, connected by NotesConfig.
+# The bot's own saves write through above; these catch rows changed any other
+# way, such as a story renamed from the shell, so a stale entry can't outlive
+# its row until the TTL.
+
+def story_changed(sender, instance, created=False, **kwargs):
+    if created:
+        return
+    stories.discard_if(lambda key, value: value[0] == instance.pk)
+    elements.discard_if(lambda key, value: key[0] == instance.pk)
+    element_names.discard(instance.pk)
+
+def element_changed(sender, instance, created=False, **kwargs):
+    if created:
+        return
+    elements.discard_if(lambda key, value: value == instance.pk)
+    element_names.discard(instance.story_id)
+
+def user_deleted(sender, instance, **kwargs):
+    users.discard_if(lambda key, value: value == instance.pk)
+    stories.discard_if(lambda key, value: value[1] == instance.pk)
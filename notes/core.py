@@ -0,0 +1,503 @@
+# Copyright 2020 called2voyage
+#
+# This file is part of FicNotesBot.
+#
+# FicNotesBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# FicNotesBot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with FicNotesBot.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import json
+import tempfile
+import time
+
+from django.core.exceptions import MultipleObjectsReturned
+from django.db import IntegrityError
+
+from notes import exporter, importer, metrics, outbound, queries, router, search
+from notes.exceptions import UserNotCreatedError, StoryNotFoundError, ElementNotFoundError, NoteNotFoundError, DatabaseBusyError
+from notes.models import StoryElement, StorySummary
+from notes.pagination import Pager, PAGE_ROWS, MESSAGE_LIMIT, NEXT_PAGE_EMOJI
+from notes.pending import Choice, PendingChoices
+
+# The bot's commands, independent of Discord: a Request goes in and a list of
+# replies comes out. rundiscordbot delivers the replies through the outbox, and
+# replaybot times them against a local database.
+
+ELEMENT_TYPE_PLURALS = {
+    StoryElement.CHARACTER: 'characters',
+    StoryElement.OBJECT: 'objects',
+    StoryElement.EVENT: 'events',
+    StoryElement.PLACE: 'places',
+    StoryElement.CONCEPT: 'concepts',
+    StoryElement.PLOTPOINT: 'plot points',
+}
+
+ELEMENT_TYPES_BY_DISPLAY = {display: type for type, display in StoryElement.ELEMENT_TYPE_CHOICES}
+
+ELEMENT_TYPE_USAGE = {
+    StoryElement.CHARACTER: 'character [name]',
+    StoryElement.OBJECT: 'object [name]',
+    StoryElement.EVENT: 'event [name]',
+    StoryElement.PLACE: 'place [name]',
+    StoryElement.CONCEPT: 'concept [name]',
+    StoryElement.PLOTPOINT: 'plotpoint "[index]" [header]',
+}
+
+class Attachment:
+    """A file sent with a request, read the way a discord.Attachment is"""
+
+    def __init__(self, filename, data):
+        self.filename = filename
+        self.data = data
+
+    async def read(self):
+        return self.data
+
+class Request:
+    """A message to the bot and who sent it where
+
+    attachments are objects with a filename and an async read(), such as
+    Attachment or discord.Attachment.
+    """
+
+    def __init__(self, user_id, user_name, channel_id, content, guild_id=None, attachments=(), mention=None):
+        self.user_id = user_id
+        self.user_name = user_name
+        self.channel_id = channel_id
+        self.guild_id = guild_id
+        self.content = content
+        self.attachments = list(attachments)
+        self.mention = mention or '<@' + str(user_id) + '>'
+
+def request_to_json(request):
+    """request as a JSON-compatible dict, leaving out its attachments"""
+    return {'user_id': request.user_id, 'user_name': request.user_name, 'channel_id': request.channel_id,
+            'guild_id': request.guild_id, 'content': request.content}
+
+def request_from_json(data):
+    return Request(data['user_id'], data['user_name'], data['channel_id'], data['content'], data.get('guild_id'))
+
+class Prompt:
+    """Buttons to send with a reply and the choice to wait on once it is sent"""
+
+    def __init__(self, kind, options, payload, state=None):
+        self.kind = kind
+        self.options = options
+        self.payload = payload
+        self.state = state
+
+    def choice(self, prompt_id, user_id, channel_id, guild_id=None):
+        choice = Choice(prompt_id, self.kind, user_id, channel_id, self.options, self.payload, guild_id=guild_id)
+        choice.state = self.state
+        return choice
+
+class Reply:
+    """A message to send to the channel the request came from
+
+    file is an open binary file to attach as filename, which the transport
+    closes once it has been sent.
+    """
+
+    def __init__(self, content, priority=outbound.CONFIRMATION, coalesce=True, file=None, filename=None, prompt=None):
+        self.content = content
+        self.priority = priority
+        self.coalesce = coalesce
+        self.file = file
+        self.filename = filename
+        self.prompt = prompt
+
+class Edit:
+    """Replace a prompt the bot sent earlier with the outcome of answering it
+
+    prompt, if set, asks a new question of the edited message in place of the
+    old one. A content of None leaves the text as it is and only takes the
+    old question's buttons off.
+    """
+
+    def __init__(self, message_id, content, prompt=None):
+        self.message_id = message_id
+        self.content = content
+        self.prompt = prompt
+
+def did_you_mean(error):
+    """The suggestions carried by an ElementNotFoundError, as a sentence to add to the reply"""
+    if not error.args or not error.args[0]:
+        return ''
+    names = error.args[0]
+    if len(names) == 1:
+        return ' Did you mean ' + names[0] + '?'
+    return ' Did you mean ' + ', '.join(names[:-1]) + ' or ' + names[-1] + '?'
+
+def _counted(count, noun):
+    return str(count) + ' ' + noun + ('' if count == 1 else 's')
+
+def _no_stories(mention):
+    return Reply(mention+ ' You have not created any stories yet.')
+
+def _story_not_found(mention, story):
+    return Reply(mention+ ' ' + story + ' not found. Try adding it first with "!ficnotesbot add story ' + story + '".')
+
+def _element_not_found(mention, element, story, error):
+    return Reply(mention+ ' ' + element + ' not found in ' + story + '.' + did_you_mean(error) + ' Try adding it first with "!ficnotesbot add [type] ' + element + ' > ' + story + '".')
+
+def _no_notes(mention, element, story):
+    return Reply(mention+ ' You have not added any notes to ' + element + '. Try adding one first with "!ficnotesbot add note [note_text] > ' + element + ' > ' + story + '".')
+
+def _edited(choice, reply):
+    """reply in place of the prompt choice answered"""
+    return Edit(choice.prompt_id, reply.content)
+
+class Core:
+    """Runs bot commands against the database through executor, a notes.dbpool.DatabaseExecutor
+
+    profiler, a notes.profiling.Profiler, captures a sample of the commands.
+    batcher, a notes.writebehind.NoteBatcher, commits added notes in batches.
+    """
+
+    def __init__(self, executor, profiler=None, batcher=None):
+        self.profiler = profiler
+        self.batcher = batcher
+        self.pending = PendingChoices()
+        self.save_story = executor.wrap(queries.save_story)
+        self.save_element = executor.wrap(queries.save_element)
+        self.save_plotpoint = executor.wrap(queries.save_plotpoint)
+        self.save_note = executor.wrap(queries.save_note)
+        self.note_element = executor.wrap(queries.note_element)
+        self.list_stories = executor.wrap(queries.list_stories)
+        self.list_stories_after = executor.wrap(queries.list_stories_after)
+        self.list_elements_by_type = executor.wrap(queries.list_elements_by_type)
+        self.list_elements_after = executor.wrap(queries.list_elements_after)
+        self.list_notes = executor.wrap(queries.list_notes)
+        self.list_notes_after = executor.wrap(queries.list_notes_after)
+        self.story_summary = executor.wrap(queries.story_summary)
+        self.import_notes = executor.wrap(importer.import_notes)
+        self.search_notes = executor.wrap(search.search_notes)
+        self.export_story_file = executor.wrap(exporter.export_story_file)
+        self.save_pending = executor.wrap(queries.save_pending)
+        self.delete_pending = executor.wrap(queries.delete_pending)
+        self.load_pending = executor.wrap(queries.load_pending)
+        self.handlers = {
+            'add_story': self.add_story,
+            'add_element': self.add_element,
+            'add_plotpoint': self.add_plotpoint,
+            'add_note': self.add_note,
+            'add_notes': self.add_notes,
+            'list_stories': self.list_stories_command,
+            'list_elements': self.list_elements,
+            'list_notes': self.list_notes_command,
+            'search': self.search_command,
+            'story_stats': self.story_stats,
+            'export_story': self.export_story,
+        }
+        self.choice_handlers = {
+            'add_note': self.add_note_choice,
+            'list_notes': self.list_notes_choice,
+            'page': self.page_choice,
+        }
+
+    async def handle(self, request):
+        """Run the command in request and return its replies, or None if it is not a bot command"""
+        command = router.parse(request.content)
+        if command is None:
+            return None
+        return await self.run(request, command)
+
+    async def run(self, request, command):
+        with metrics.command(command.name, self.profiler, request.content) as stats:
+            try:
+                return await self.handlers[command.name](request, command)
+            except DatabaseBusyError as e:
+                stats.errors.append(e)
+                return [Reply(request.mention+ " I'm busy right now. Try again in a moment.")]
+
+    async def choose(self, choice, value):
+        """Act on the user picking value for choice and return the replies"""
+        mention = '<@' + str(choice.user_id) + '>'
+        with metrics.command(choice.kind + '_choice', self.profiler, choice.kind + ' choice ' + repr(value) + ' for ' + json.dumps(choice.payload)) as stats:
+            try:
+                # Inside the try, so a busy database still gets the user an answer
+                await self.forget(choice)
+                return await self.choice_handlers[choice.kind](mention, choice, value)
+            except DatabaseBusyError as e:
+                stats.errors.append(e)
+                return [Reply(mention+ " I'm busy right now. Try again in a moment.")]
+
+    async def expire(self, choice):
+        """Forget a choice nobody made and return the replies"""
+        await self.forget(choice)
+        if choice.kind == 'page':
+            # The page stays readable; only its next page button goes
+            return [Edit(choice.prompt_id, None)]
+        return [Edit(choice.prompt_id, 'Timeout. Try again.')]
+
+    async def wait_for_choice(self, choice):
+        # Listen first, so an answer arriving while the choice is saved is taken
+        self.pending.add(choice)
+        choice.saving = asyncio.ensure_future(self.save_pending(choice))
+        await choice.saving
+
+    async def forget(self, choice):
+        if choice.saving is not None:
+            # Deleting before the save commits would leave the row to be restored
+            await asyncio.wait([choice.saving])
+        await self.delete_pending(choice.prompt_id)
+
+    async def restore(self, shard_id=None, shard_count=None):
+        """Wait again for the choices saved before a restart and return those that have already expired"""
+        now = time.time()
+        expired = []
+        for choice in await self.load_pending(shard_id, shard_count):
+            if choice.expires <= now:
+                expired.append(choice)
+            else:
+                self.pending.add(choice)
+        return expired
+
+    async def add_story(self, request, command):
+        name, = command.args
+        try:
+            story = await self.save_story(request.user_id, request.user_name, name)
+            return [Reply(request.mention+ ' ' + story + ' has been added to your stories.')]
+        except IntegrityError:
+            return [Reply(request.mention+ ' ' + name + ' already exists.')]
+
+    async def add_element(self, request, command):
+        name, story = command.args
+        try:
+            story, element = await self.save_element(request.user_id, name, story, command.type)
+            return [Reply(request.mention+ ' ' + element + ' has been added to ' + story + '.')]
+        except UserNotCreatedError:
+            return [_no_stories(request.mention)]
+        except StoryNotFoundError:
+            return [_story_not_found(request.mention, story)]
+        except IntegrityError:
+            return [Reply(request.mention+ ' ' + name + ' is already in ' + story + '.')]
+
+    async def add_plotpoint(self, request, command):
+        index, header, story = command.args
+        try:
+            story, index = await self.save_plotpoint(request.user_id, index, header, story)
+            return [Reply(request.mention+ ' ' + index + ' has been added to ' + story + '.')]
+        except UserNotCreatedError:
+            return [_no_stories(request.mention)]
+        except StoryNotFoundError:
+            return [_story_not_found(request.mention, story)]
+        except IntegrityError:
+            return [Reply(request.mention+ ' ' + index + ' is already in ' + story + '.')]
+
+    def ask_type(self, mention, element, type_list, kind, payload):
+        message_str = mention + ' Which ' + element + ' did you mean?\n'
+        emoji = ['6️⃣', '5️⃣', '4️⃣', '3️⃣', '2️⃣', '1️⃣']
+        sent_emoji = {}
+        for display in type_list:
+            em = emoji.pop()
+            message_str = message_str + ' ' + em + ' - ' + display + '\n'
+            sent_emoji[em] = ELEMENT_TYPES_BY_DISPLAY[display]
+        return Reply(message_str, coalesce=False, prompt=Prompt(kind, sent_emoji, payload))
+
+    async def add_note(self, request, command):
+        note, element, story = command.args
+        try:
+            element = await self.add_one_note(request.user_id, note, element, story)
+            return [Reply(request.mention+ ' Added a note to ' + element + '.')]
+        except UserNotCreatedError:
+            return [_no_stories(request.mention)]
+        except StoryNotFoundError:
+            return [_story_not_found(request.mention, story)]
+        except ElementNotFoundError as e:
+            return [_element_not_found(request.mention, element, story, e)]
+        except MultipleObjectsReturned as e:
+            return [self.ask_type(request.mention, element, e.args[0], 'add_note', {'note': note, 'element': element, 'story': story})]
+
+    async def add_one_note(self, user_id, note, element, story, type=None):
+        """Save note, through the batcher if there is one, and return the name of its element"""
+        if self.batcher is None:
+            return await self.save_note(user_id, note, element, story, type)
+        element_pk, element = await self.note_element(user_id, element, story, type)
+        await self.batcher.add(element_pk, note)
+        return element
+
+    async def add_notes(self, request, command):
+        text, = command.args
+        format = 'text'
+        if request.attachments:
+            attachment = request.attachments[0]
+            text = (await attachment.read()).decode('utf-8', 'replace')
+            format = importer.format_for(attachment.filename)
+        try:
+            result = await self.import_notes(request.user_id, text, format)
+        except UserNotCreatedError:
+            return [_no_stories(request.mention)]
+        msg = request.mention + ' Added ' + str(result.created) + ' notes.'
+        if result.failures:
+            msg = msg + ' These lines were skipped:\n'
+            for i, (line, reason) in enumerate(result.failures):
+                entry = '* Line ' + str(line) + ': ' + reason + '\n'
+                more = '...and ' + str(len(result.failures) - i) + ' more.'
+                if len(msg) + len(entry) + len(more) > MESSAGE_LIMIT:
+                    msg = msg + more
+                    break
+                msg = msg + entry
+        return [Reply(msg, coalesce=False)]
+
+    async def add_note_choice(self, mention, choice, type):
+        payload = choice.payload
+        element, story = payload['element'], payload['story']
+        # The element or story may have gone while the prompt waited
+        try:
+            element = await self.add_one_note(choice.user_id, payload['note'], element, story, type)
+        except UserNotCreatedError:
+            return [_edited(choice, _no_stories(mention))]
+        except StoryNotFoundError:
+            return [_edited(choice, _story_not_found(mention, story))]
+        except ElementNotFoundError as e:
+            return [_edited(choice, _element_not_found(mention, element, story, e))]
+        return [Edit(choice.prompt_id, mention+ ' Added a note to ' + element + '.')]
+
+    def make_pager(self, mention, state, rows=None):
+        source = state['source']
+        format = None
+        if source == 'stories':
+            async def fetch(after, limit):
+                return await self.list_stories_after(state['id'], after, limit)
+            format = lambda row: row[1] + ' (' + _counted(row[2], 'element') + ', ' + _counted(row[3], 'note') + ')'
+        elif source == 'elements':
+            async def fetch(after, limit):
+                return await self.list_elements_after(state['id'], state['type'], after, limit)
+            if state['type'] == StoryElement.PLOTPOINT:
+                format = lambda row: row[1] + ' ' + row[2]
+        else:
+            async def fetch(after, limit):
+                return await self.list_notes_after(state['id'], after, limit)
+        return Pager(mention + ' ', state['title'], rows, fetch, format, after=state.get('after'), page=state.get('page', 0))
+
+    async def next_page(self, state, pager):
+        """A reply with the pager's next page, asking for a click if there is more"""
+        content = await pager.next_message()
+        prompt = None
+        if pager.has_more:
+            state = dict(state, after=pager.sent_after, page=pager.page)
+            prompt = Prompt('page', {NEXT_PAGE_EMOJI: None}, state, pager)
+        return Reply(content, outbound.PAGE, False, prompt=prompt)
+
+    async def page_choice(self, mention, choice, value):
+        pager = choice.state or self.make_pager(mention, choice.payload)
+        # The next page asks about the one after, so the button comes off this one
+        return [Edit(choice.prompt_id, None), await self.next_page(choice.payload, pager)]
+
+    async def list_stories_command(self, request, command):
+        try:
+            user_pk, rows = await self.list_stories(request.user_id, PAGE_ROWS + 1)
+        except UserNotCreatedError:
+            return [_no_stories(request.mention)]
+        state = {'source': 'stories', 'id': user_pk, 'title': 'You have the following stories'}
+        return [await self.next_page(state, self.make_pager(request.mention, state, rows))]
+
+    async def story_stats(self, request, command):
+        story, = command.args
+        try:
+            counts = await self.story_summary(request.user_id, story)
+        except UserNotCreatedError:
+            return [_no_stories(request.mention)]
+        except StoryNotFoundError:
+            return [_story_not_found(request.mention, story)]
+        msg = request.mention + ' ' + story + ' has:\n'
+        for type, field in StorySummary.TYPE_FIELDS.items():
+            msg += '* ' + ELEMENT_TYPE_PLURALS[type].capitalize() + ': ' + str(counts[field]) + '\n'
+        msg += '* Notes: ' + str(counts['note_count'])
+        return [Reply(msg)]
+
+    async def list_elements(self, request, command):
+        story, = command.args
+        plural = ELEMENT_TYPE_PLURALS[command.type]
+        try:
+            story_pk, rows = await self.list_elements_by_type(request.user_id, story, command.type, PAGE_ROWS + 1)
+        except UserNotCreatedError:
+            return [_no_stories(request.mention)]
+        except StoryNotFoundError:
+            return [_story_not_found(request.mention, story)]
+        except ElementNotFoundError:
+            return [Reply(request.mention+ ' You have not added any ' + plural + ' to ' + story + '. Try adding one first with "!ficnotesbot add ' + ELEMENT_TYPE_USAGE[command.type] + ' > ' + story + '".')]
+        state = {'source': 'elements', 'id': story_pk, 'type': command.type, 'title': story + ' ' + plural}
+        return [await self.next_page(state, self.make_pager(request.mention, state, rows))]
+
+    async def notes_page(self, mention, element, element_pk, rows):
+        state = {'source': 'notes', 'id': element_pk, 'title': element + ' notes'}
+        return await self.next_page(state, self.make_pager(mention, state, rows))
+
+    async def list_notes_command(self, request, command):
+        element, story = command.args
+        try:
+            element_pk, rows = await self.list_notes(request.user_id, element, story, None, PAGE_ROWS + 1)
+        except UserNotCreatedError:
+            return [_no_stories(request.mention)]
+        except StoryNotFoundError:
+            return [_story_not_found(request.mention, story)]
+        except ElementNotFoundError as e:
+            return [_element_not_found(request.mention, element, story, e)]
+        except NoteNotFoundError:
+            return [_no_notes(request.mention, element, story)]
+        except MultipleObjectsReturned as e:
+            return [self.ask_type(request.mention, element, e.args[0], 'list_notes', {'element': element, 'story': story})]
+        return [await self.notes_page(request.mention, element, element_pk, rows)]
+
+    async def list_notes_choice(self, mention, choice, type):
+        payload = choice.payload
+        element, story = payload['element'], payload['story']
+        try:
+            element_pk, rows = await self.list_notes(choice.user_id, element, story, type, PAGE_ROWS + 1)
+        except UserNotCreatedError:
+            return [_edited(choice, _no_stories(mention))]
+        except StoryNotFoundError:
+            return [_edited(choice, _story_not_found(mention, story))]
+        except ElementNotFoundError as e:
+            return [_edited(choice, _element_not_found(mention, element, story, e))]
+        except NoteNotFoundError:
+            return [_edited(choice, _no_notes(mention, element, story))]
+        page = await self.notes_page(mention, element, element_pk, rows)
+        return [Edit(choice.prompt_id, page.content, page.prompt)]
+
+    async def search_command(self, request, command):
+        terms, story = command.args
+        try:
+            rows = await self.search_notes(request.user_id, terms, story)
+        except UserNotCreatedError:
+            return [_no_stories(request.mention)]
+        except StoryNotFoundError:
+            return [_story_not_found(request.mention, story)]
+        if not rows:
+            return [Reply(request.mention+ ' No notes in ' + story + ' match ' + terms + '.')]
+        rows = [(i, name, type, snippet) for i, (name, type, snippet) in enumerate(rows)]
+        pager = Pager(request.mention + ' ', 'Notes in ' + story + ' matching ' + terms, rows, format=lambda row: row[1] + ': ' + row[3])
+        return [Reply(await pager.next_message(), outbound.PAGE, False)]
+
+    async def export_story(self, request, command):
+        story, format = command.args
+        if format not in exporter.WRITERS:
+            return [Reply(request.mention+ ' Stories can be exported as ' + ' or '.join(sorted(exporter.WRITERS)) + '.')]
+        file = tempfile.TemporaryFile()
+        try:
+            story, size = await self.export_story_file(request.user_id, story, file, format)
+        except UserNotCreatedError:
+            file.close()
+            return [_no_stories(request.mention)]
+        except StoryNotFoundError:
+            file.close()
+            return [_story_not_found(request.mention, story)]
+        except BaseException:
+            file.close()
+            raise
+        if size > exporter.ATTACHMENT_LIMIT:
+            file.close()
+            return [Reply(request.mention+ ' ' + story + ' is too big to attach.')]
+        return [Reply(request.mention+ ' Here is ' + story + '.', file=file, filename=exporter.filename_for(story, format))]
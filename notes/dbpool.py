@@ -0,0 +1,150 @@
+# Copyright 2020 called2voyage
+#
+# This file is part of FicNotesBot.
+#
+# FicNotesBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# FicNotesBot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with FicNotesBot.  If not, see <https://www.gnu.org/licenses/>.
+
+import abc
+import asyncio
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import SyncToAsync, sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+from notes import asyncdb, metrics
+from notes.exceptions import DatabaseBusyError
+
+class DatabaseExecutor(abc.ABC):
+    """Runs database helpers for the event loop, refusing work beyond queue_depth waiting calls"""
+
+    def __init__(self, queue_depth):
+        self.queue_depth = queue_depth
+        self.pending = 0
+
+    def wrap(self, func):
+        return self.admit(self.call(func))
+
+    def call(self, func):
+        """Run func off the event loop, charging it to the running command, whatever the queue depth"""
+        run = self.runner(metrics.measured(func))
+
+        @functools.wraps(func)
+        async def call(*args, **kwargs):
+            return await run(metrics.current(), time.perf_counter(), *args, **kwargs)
+        return call
+
+    def admit(self, call):
+        """Await call, or raise DatabaseBusyError if queue_depth calls are already waiting"""
+        @functools.wraps(call)
+        async def run(*args, **kwargs):
+            # Only touched from the event loop, so no lock is needed
+            if self.pending >= self.queue_depth:
+                raise DatabaseBusyError
+            self.pending += 1
+            try:
+                return await call(*args, **kwargs)
+            finally:
+                self.pending -= 1
+        return run
+
+    @abc.abstractmethod
+    def runner(self, func):
+        """An async callable that runs func off the event loop"""
+
+    def shutdown(self):
+        pass
+
+class SerialExecutor(DatabaseExecutor):
+    """Runs every call on the single thread shared by thread sensitive sync_to_async"""
+
+    def runner(self, func):
+        return sync_to_async(func, thread_sensitive=True)
+
+    def shutdown(self):
+        # Cancelling an await doesn't stop its call, which carries on after the
+        # event loop has gone. The thread takes calls in order, so once this
+        # no-op has run, every call handed to it has finished.
+        SyncToAsync.single_thread_executor.submit(lambda: None).result()
+
+class PoolExecutor(DatabaseExecutor):
+    """Runs calls on a bounded pool of threads, each with its own Django connection"""
+
+    def __init__(self, queue_depth, workers):
+        super().__init__(queue_depth)
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ficnotesbot-db')
+
+    def runner(self, func):
+        async def run(*args, **kwargs):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, functools.partial(_call, func, *args, **kwargs))
+        return run
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+class AsyncExecutor(PoolExecutor):
+    """Awaits the helpers notes.asyncdb has native versions of on the event loop, and runs the rest on a pool"""
+
+    def __init__(self, queue_depth, workers):
+        super().__init__(queue_depth, workers)
+        self.queries = asyncdb.AsyncQueries({})
+
+    def wrap(self, func):
+        name = asyncdb.NATIVE.get(func)
+        if name is None:
+            return super().wrap(func)
+        # The native call was already admitted, so its fallback isn't checked again
+        self.queries.fallbacks[func] = self.call(func)
+        native = getattr(self.queries, name)
+
+        @functools.wraps(func)
+        async def run(*args, **kwargs):
+            try:
+                return await native(*args, **kwargs)
+            except Exception as e:
+                stats = metrics.current()
+                if stats is not None and e not in stats.errors:
+                    stats.errors.append(e)
+                raise
+        return self.admit(run)
+
+    def shutdown(self):
+        self.queries.close()
+        super().shutdown()
+
+def _call(func, *args, **kwargs):
+    # Connections are per thread; drop ones that are broken or past CONN_MAX_AGE
+    close_old_connections()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+def database_executor(mode=None, workers=None, queue_depth=None):
+    """Build the executor selected by the FICNOTESBOT_DB_* settings"""
+    mode = mode or settings.FICNOTESBOT_DB_MODE
+    queue_depth = queue_depth or settings.FICNOTESBOT_DB_QUEUE_DEPTH
+    if mode == 'serial':
+        return SerialExecutor(queue_depth)
+    if mode == 'pool':
+        return PoolExecutor(queue_depth, workers or settings.FICNOTESBOT_DB_WORKERS)
+    if mode == 'async':
+        if not asyncdb.available():
+            raise ValueError('The async database mode needs aiosqlite and an SQLite database')
+        return AsyncExecutor(queue_depth, workers or settings.FICNOTESBOT_DB_WORKERS)
+    raise ValueError('Unknown database mode: ' + mode)
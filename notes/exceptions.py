@@ -0,0 +1,36 @@
+# Copyright 2020 called2voyage
+#
+# This file is part of FicNotesBot.
+#
+# FicNotesBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# FicNotesBot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with FicNotesBot.  If not, see <https://www.gnu.org/licenses/>.
+
+class UserNotCreatedError(Exception):
+    """Raised when requesting user has not been added"""
+    pass
+
+class StoryNotFoundError(Exception):
+    """Raised when requested story does not exist"""
+    pass
+
+class ElementNotFoundError(Exception):
+    """Raised when requested element does not exist"""
+    pass
+
+class NoteNotFoundError(Exception):
+    """Raised when requested note does not exist"""
+    pass
+
+class DatabaseBusyError(Exception):
+    """Raised when too many database calls are already waiting"""
+    pass
@@ -0,0 +1,133 @@
+# Copyright 2020 called2voyage
+#
+# This file is part of FicNotesBot.
+#
+# FicNotesBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# FicNotesBot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with FicNotesBot.  If not, see <https://www.gnu.org/licenses/>.
+
+import io
+import json
+import re
+
+from notes.queries import resolve_story
+from notes.models import StoryElement, Note
+
+# Elements read from the database at a time, each with all of its notes
+EXPORT_CHUNK = 500
+
+# Discord rejects attachments larger than this
+ATTACHMENT_LIMIT = 8 * 1024 * 1024
+
+ELEMENT_TYPE_HEADINGS = {
+    StoryElement.CHARACTER: 'Characters',
+    StoryElement.OBJECT: 'Objects',
+    StoryElement.EVENT: 'Events',
+    StoryElement.PLACE: 'Places',
+    StoryElement.CONCEPT: 'Concepts',
+    StoryElement.PLOTPOINT: 'Plot Points',
+}
+
+ELEMENT_TYPE_DISPLAY = dict(StoryElement.ELEMENT_TYPE_CHOICES)
+
+def iter_elements(story_pk, type):
+    """Yield (name, plot point header, notes) for the story's elements of type in list order
+
+    Elements are streamed EXPORT_CHUNK at a time and the notes of each chunk
+    fetched with one more query, so memory use does not grow with the story.
+    """
+    elements = StoryElement.objects.filter(story_id=story_pk, type=type).values_list('id', 'name', 'plotpoint__header')
+    elements = elements.order_by('plotpoint__sort_key' if type == StoryElement.PLOTPOINT else 'name')
+    # iterator() ignores prefetch_related, so each chunk's notes are fetched here instead
+    chunk = []
+    for element in elements.iterator(chunk_size=EXPORT_CHUNK):
+        chunk.append(element)
+        if len(chunk) == EXPORT_CHUNK:
+            yield from _with_notes(chunk)
+            chunk = []
+    yield from _with_notes(chunk)
+
+def _with_notes(chunk):
+    if not chunk:
+        return
+    notes = {}
+    rows = Note.objects.filter(element_id__in=[id for id, _, _ in chunk]).order_by('element_id', 'id').values_list('element_id', 'note')
+    for element_id, note in rows.iterator(chunk_size=EXPORT_CHUNK):
+        notes.setdefault(element_id, []).append(note)
+    for id, name, header in chunk:
+        yield name, header, notes.get(id, [])
+
+def _markdown_line(text):
+    # Keep a note's line breaks inside its list item
+    return text.replace('\n', '\n  ')
+
+def write_markdown(story, file):
+    file.write('# ' + story.name + '\n')
+    for type, heading in ELEMENT_TYPE_HEADINGS.items():
+        wrote_heading = False
+        for name, header, notes in iter_elements(story.pk, type):
+            if not wrote_heading:
+                file.write('\n## ' + heading + '\n')
+                wrote_heading = True
+            file.write('\n### ' + (name if header is None else name + ' ' + header) + '\n')
+            if notes:
+                file.write('\n')
+            for note in notes:
+                file.write('* ' + _markdown_line(note) + '\n')
+
+def write_json(story, file):
+    file.write('{"story": ' + json.dumps(story.name) + ', "elements": [')
+    separator = '\n'
+    for type in ELEMENT_TYPE_HEADINGS:
+        display = ELEMENT_TYPE_DISPLAY[type]
+        for name, header, notes in iter_elements(story.pk, type):
+            item = {'type': display, 'name': name}
+            if header is not None:
+                item['header'] = header
+            item['notes'] = notes
+            file.write(separator + json.dumps(item))
+            separator = ',\n'
+    file.write(']}\n')
+
+WRITERS = {
+    'markdown': write_markdown,
+    'json': write_json,
+}
+
+EXTENSIONS = {
+    'markdown': '.md',
+    'json': '.json',
+}
+
+def export_story(user_id, story, file, format='markdown'):
+    """Write the whole story, every element with its notes, to the text file and return the story's name"""
+    story = resolve_story(user_id, story)
+    WRITERS[format](story, file)
+    return story.name
+
+def export_story_file(user_id, story, file, format='markdown'):
+    """Export the story as UTF-8 into the binary file and return its name and the file's size
+
+    The file is left positioned at its start, ready to be sent.
+    """
+    text = io.TextIOWrapper(file, encoding='utf-8')
+    try:
+        name = export_story(user_id, story, text, format)
+    finally:
+        text.flush()
+        text.detach()
+    size = file.tell()
+    file.seek(0)
+    return name, size
+
+def filename_for(story, format):
+    return re.sub(r'[^\w.-]+', '_', story) + EXTENSIONS[format]
@@ -0,0 +1,188 @@
+# Copyright 2020 called2voyage
+#
+# This file is part of FicNotesBot.
+#
+# FicNotesBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# FicNotesBot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with FicNotesBot.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import itertools
+import time
+import types
+
+# Stand-ins for the parts of discord.py the bot uses, so the real event
+# handlers can be driven locally without connecting to Discord.
+
+_ids = itertools.count(1)
+
+class FakeUser:
+    def __init__(self, id, name='user'):
+        self.id = id
+        self.name = name
+        self.mention = '<@' + str(id) + '>'
+
+class FakeGuild:
+    def __init__(self, id):
+        self.id = id
+
+class FakeMessage:
+    def __init__(self, id, content, author, channel, attachments=()):
+        self.id = id
+        self.content = content
+        self.author = author
+        self.channel = channel
+        self.guild = channel.guild
+        self.attachments = list(attachments)
+
+    async def edit(self, content=None, view=None):
+        self.channel.calls.append(('edit', self.id))
+        if content is not None:
+            self.content = content
+
+    async def delete(self):
+        self.channel.calls.append(('delete', self.id))
+
+class FakeChannel:
+    """Stands in for a discord channel, recording what is sent to it"""
+
+    def __init__(self, id, latency=0.05, guild=None):
+        self.id = id
+        self.latency = latency
+        self.guild = guild
+        self.sent = []
+        # (API call, message id) for everything done in the channel
+        self.calls = []
+
+    async def send(self, content=None, file=None, view=None):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.sent.append(content)
+        message = FakeMessage(next(_ids), content, None, self)
+        self.calls.append(('send', message.id))
+        return message
+
+    def get_partial_message(self, id):
+        return FakeMessage(id, None, None, self)
+
+class FakeResponse:
+    """Stands in for an interaction's response, recording it as an API call on the clicked message"""
+
+    def __init__(self, interaction):
+        self.interaction = interaction
+        self.done = False
+
+    def is_done(self):
+        return self.done
+
+    def _respond(self, call):
+        message = self.interaction.message
+        if self.interaction.late:
+            import discord
+            raise discord.NotFound(types.SimpleNamespace(status=404, reason='Not Found'), 'Unknown interaction')
+        message.channel.calls.append((call, message.id))
+        self.done = True
+
+    async def edit_message(self, content=None, view=None):
+        self._respond('respond')
+        if content is not None:
+            self.interaction.message.content = content
+
+    async def defer(self):
+        self._respond('defer')
+
+class FakeClick:
+    """A user clicking option's button on the last message sent in channel, delivered as on_interaction
+
+    A late click is answered after Discord has given up on it, so responding fails.
+    """
+
+    def __init__(self, channel, user_id, option, late=False):
+        self.channel = channel
+        self.user = FakeUser(user_id)
+        self.data = {'custom_id': option}
+        self.late = late
+        self.message = None
+        self.response = FakeResponse(self)
+
+class FakeGateway:
+    """Stands in for discord.Client, delivering messages to the bot's event handlers
+
+    At most concurrency messages are being handled at once, much as events
+    from a busy gateway overlap. FakeClicks among the messages are
+    delivered as interactions; give them a concurrency of 1 so they follow
+    the message they answer.
+    """
+
+    def __init__(self, messages, concurrency=32):
+        self.messages = messages
+        self.concurrency = concurrency
+        self.channels = {message.channel.id: message.channel for message in messages}
+        self.loop = None
+        self.elapsed = None
+
+    def event(self, coro):
+        setattr(self, coro.__name__, coro)
+        return coro
+
+    async def change_presence(self, **kwargs):
+        pass
+
+    def get_channel(self, id):
+        return self.channels.get(id)
+
+    async def fetch_channel(self, id):
+        return self.channels[id]
+
+    def run(self, token):
+        asyncio.run(self._run())
+
+    async def _run(self):
+        self.loop = asyncio.get_running_loop()
+        await self.on_connect()
+        await self.on_ready()
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def deliver(message):
+            async with semaphore:
+                if isinstance(message, FakeClick):
+                    message.message = message.channel.get_partial_message([id for call, id in message.channel.calls if call == 'send'][-1])
+                    await self.on_interaction(message)
+                else:
+                    await self.on_message(message)
+
+        start = time.perf_counter()
+        await asyncio.gather(*[deliver(message) for message in self.messages])
+        self.elapsed = time.perf_counter() - start
+
+def run_bot(messages, shard_id=None, shard_count=None, concurrency=32, record=None):
+    """Run the real rundiscordbot handlers over messages without rate limits and return the seconds they took
+
+    record is passed on as rundiscordbot's --record.
+    """
+    # Imported here so the fakes above stay usable without discord.py
+    from notes import outbound
+    from notes.management.commands import rundiscordbot
+
+    gateway = FakeGateway(messages, concurrency)
+
+    class Command(rundiscordbot.Command):
+        def create_client(self, shard_id, shard_count):
+            return gateway
+
+        def create_outbox(self):
+            unlimited = (len(messages) * 10 + 1, 1.0)
+            return outbound.Outbox({route: unlimited for route in outbound.ROUTE_LIMITS}, unlimited)
+
+    Command().handle(shard_id=shard_id, shard_count=shard_count, record=record, metrics_port=None,
+                      profile_sample=0.0, profile_slow_ms=None, profile_dir=None)
+    return gateway.elapsed
@@ -0,0 +1,94 @@
+# Copyright 2020 called2voyage
+#
+# This file is part of FicNotesBot.
+#
+# FicNotesBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# FicNotesBot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with FicNotesBot.  If not, see <https://www.gnu.org/licenses/>.
+
+import itertools
+import threading
+from collections import Counter
+
+# Names less similar than this to what was typed are never suggested
+SIMILARITY_THRESHOLD = 0.4
+
+# A typo (one letter added, dropped, replaced or two swapped) changes at most this many trigrams
+TYPO_TRIGRAMS = 4
+
+# Rare query trigrams a name must share beyond those a typo can change
+HITS = 2
+
+# Most names a not-found reply suggests
+SUGGESTIONS = 3
+
+def trigrams(name):
+    """The set of three-letter pieces of name, padded so the start and end of the name count"""
+    padded = '  ' + name.lower() + ' '
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+class TrigramIndex:
+    """Finds the names most similar to a misspelt one by their shared trigrams
+
+    Similarity is the Jaccard index of two names' trigram sets. A name one typo
+    away from the query shares all but TYPO_TRIGRAMS of any of the query's
+    trigrams, so only the postings of the TYPO_TRIGRAMS + HITS rarest query
+    trigrams are read to find candidates, keeping lookups short however many
+    names share the common trigrams.
+    """
+
+    def __init__(self, names=()):
+        self.names = []
+        self.grams = []
+        self.ids = {}
+        self.postings = {}
+        self._lock = threading.Lock()
+        for name in names:
+            self.add(name)
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, name):
+        with self._lock:
+            if name in self.ids:
+                return
+            id = self.ids[name] = len(self.names)
+            grams = trigrams(name)
+            self.names.append(name)
+            self.grams.append(grams)
+            for gram in grams:
+                self.postings.setdefault(gram, []).append(id)
+
+    def suggest(self, name, limit=SUGGESTIONS, threshold=SIMILARITY_THRESHOLD):
+        """Return up to limit indexed names at least threshold similar to name, most similar first
+
+        Every name one typo away is considered; names further away are found
+        when they share enough of the query's rarer trigrams.
+        """
+        query = trigrams(name)
+        read = min(len(query), TYPO_TRIGRAMS + HITS)
+        needed = max(1, read - TYPO_TRIGRAMS)
+        with self._lock:
+            postings = sorted((self.postings.get(gram, ()) for gram in query), key=len)
+            hits = Counter(itertools.chain.from_iterable(postings[:read]))
+            scored = []
+            for id, count in hits.most_common():
+                if count < needed:
+                    break
+                grams = self.grams[id]
+                shared = len(query & grams)
+                similarity = shared / (len(query) + len(grams) - shared)
+                if similarity >= threshold:
+                    scored.append((-similarity, self.names[id]))
+        scored.sort()
+        return [name for _, name in scored[:limit]]
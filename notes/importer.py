@@ -0,0 +1,151 @@
+# Copyright 2020 called2voyage
+#
+# This file is part of FicNotesBot.
+#
+# FicNotesBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# FicNotesBot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with FicNotesBot.  If not, see <https://www.gnu.org/licenses/>.
+
+import csv
+import io
+import json
+from collections import namedtuple
+
+from django.db import transaction
+
+from notes.queries import resolve_user
+from notes.models import Story, StoryElement, Note
+
+# Most notes a single import may add
+MAX_IMPORT_NOTES = 5000
+
+ImportRow = namedtuple('ImportRow', ['line', 'note', 'element', 'story', 'type'])
+
+ELEMENT_TYPES = {}
+for code, display in StoryElement.ELEMENT_TYPE_CHOICES:
+    ELEMENT_TYPES[code.lower()] = code
+    ELEMENT_TYPES[display.lower()] = code
+
+class ImportResult:
+    """How many notes an import added and why the other lines were skipped"""
+
+    def __init__(self):
+        self.created = 0
+        self.failures = []
+
+    def fail(self, line, reason):
+        self.failures.append((line, reason))
+
+def _row(result, line, fields):
+    fields = [field.strip() for field in fields]
+    if len(fields) not in (3, 4) or not all(fields):
+        result.fail(line, 'expected "[note_text] > [element] > [story]"')
+        return None
+    type = None
+    if len(fields) == 4:
+        type = ELEMENT_TYPES.get(fields[3].lower())
+        if type is None:
+            result.fail(line, 'unknown element type ' + fields[3])
+            return None
+    return ImportRow(line, fields[0], fields[1], fields[2], type)
+
+def parse_lines(text, result):
+    """Rows from lines written like the add note command: note > element > story [> type]"""
+    rows = []
+    for line, content in enumerate(text.splitlines(), 1):
+        if content.strip():
+            rows.append(_row(result, line, content.split(' > ')))
+    return [row for row in rows if row is not None]
+
+def parse_csv(text, result):
+    """Rows from CSV with note, element, story and optionally type columns"""
+    rows = []
+    for line, fields in enumerate(csv.reader(io.StringIO(text)), 1):
+        if line == 1 and [f.strip().lower() for f in fields[:3]] == ['note', 'element', 'story']:
+            continue
+        if fields:
+            rows.append(_row(result, line, fields))
+    return [row for row in rows if row is not None]
+
+def parse_json(text, result):
+    """Rows from a JSON list of objects with note, element, story and optionally type keys"""
+    try:
+        items = json.loads(text)
+    except ValueError as e:
+        result.fail(0, 'invalid JSON: ' + str(e))
+        return []
+    if not isinstance(items, list):
+        result.fail(0, 'expected a JSON list of notes')
+        return []
+    rows = []
+    for line, item in enumerate(items, 1):
+        if not isinstance(item, dict):
+            result.fail(line, 'expected an object with note, element and story')
+            continue
+        fields = [str(item.get(key) or '') for key in ('note', 'element', 'story')]
+        if item.get('type'):
+            fields.append(str(item['type']))
+        rows.append(_row(result, line, fields))
+    return [row for row in rows if row is not None]
+
+PARSERS = {
+    'text': parse_lines,
+    'csv': parse_csv,
+    'json': parse_json,
+}
+
+def format_for(filename):
+    """Guess an import format from a file name"""
+    name = filename.lower()
+    if name.endswith('.csv'):
+        return 'csv'
+    if name.endswith('.json'):
+        return 'json'
+    return 'text'
+
+def import_notes(user_id, text, format='text'):
+    """Add every note described by text to the user's stories in one transaction"""
+    result = ImportResult()
+    rows = PARSERS[format](text, result)
+    if len(rows) > MAX_IMPORT_NOTES:
+        result.fail(rows[MAX_IMPORT_NOTES].line, 'only %d notes can be imported at once' % MAX_IMPORT_NOTES)
+        rows = rows[:MAX_IMPORT_NOTES]
+    if not rows:
+        return result
+    resolve_user(user_id)
+    # Every element the import refers to, in one query
+    candidates = {}
+    elements = StoryElement.objects.filter(story__owner__user_id=user_id,
+                                           story__name__in={row.story for row in rows},
+                                           name__in={row.element for row in rows})
+    for id, story, name, type in elements.values_list('id', 'story__name', 'name', 'type'):
+        candidates.setdefault((story, name), []).append((id, type))
+    stories = None
+    notes = []
+    for row in rows:
+        matches = [id for id, type in candidates.get((row.story, row.element), []) if row.type in (None, type)]
+        if len(matches) == 1:
+            notes.append(Note(element_id=matches[0], note=row.note))
+        elif matches:
+            result.fail(row.line, 'more than one ' + row.element + ' in ' + row.story + '; add its type after the story')
+        else:
+            if stories is None:
+                stories = set(Story.objects.filter(owner__user_id=user_id, name__in={row.story for row in rows}).values_list('name', flat=True))
+            if row.story in stories:
+                result.fail(row.line, row.element + ' not found in ' + row.story)
+            else:
+                result.fail(row.line, row.story + ' not found')
+    with transaction.atomic():
+        Note.objects.bulk_create(notes, batch_size=500)
+    result.created = len(notes)
+    result.failures.sort()
+    return result
@@ -0,0 +1,50 @@
+# Copyright 2020 called2voyage
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from django.core.management.base import BaseCommand, CommandError
+
+from notes import benchmarks
+
+SCENARIOS = {
+    'async': benchmarks.bench_async,
+    'backends': benchmarks.bench_backends,
+    'cache': benchmarks.bench_cache,
+    'commits': benchmarks.bench_commits,
+    'concurrency': benchmarks.bench_concurrency,
+    'dispatch': benchmarks.bench_dispatch,
+    'export': benchmarks.bench_export,
+    'fuzzy': benchmarks.bench_fuzzy,
+    'outbox': benchmarks.bench_outbox,
+    'pages': benchmarks.bench_pages,
+    'prompts': benchmarks.bench_prompts,
+    'rss': benchmarks.bench_rss,
+    'search': benchmarks.bench_search,
+    'shards': benchmarks.bench_shards,
+    'startup': benchmarks.bench_startup,
+    'summaries': benchmarks.bench_summaries,
+    'writebehind': benchmarks.bench_writebehind,
+    'writes': benchmarks.bench_writes,
+}
+
+class Command(BaseCommand):
+    help = 'Runs the bot microbenchmarks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenario', choices=sorted(SCENARIOS))
+
+    def handle(self, *args, **options):
+        failures = SCENARIOS[options['scenario']](self.stdout.write)
+        if failures:
+            raise CommandError('Over budget: ' + ', '.join(failures))
@@ -0,0 +1,45 @@
+# Copyright 2020 called2voyage
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from django.core.management.base import BaseCommand, CommandError
+
+from notes import exporter
+from notes.exceptions import UserNotCreatedError, StoryNotFoundError
+
+class Command(BaseCommand):
+    help = 'Exports a Discord user\'s story with all of its elements and notes as Markdown or JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('user_id', type=int, help='Discord ID of the user who owns the story')
+        parser.add_argument('story')
+        parser.add_argument('--format', choices=sorted(exporter.WRITERS), default='markdown')
+        parser.add_argument('--output', help='File to write to instead of standard output')
+
+    def handle(self, *args, **options):
+        if options['output']:
+            file = open(options['output'], 'w', encoding='utf-8')
+        else:
+            # The export writes its own line endings
+            self.stdout.ending = ''
+            file = self.stdout
+        try:
+            exporter.export_story(options['user_id'], options['story'], file, options['format'])
+        except UserNotCreatedError:
+            raise CommandError('User %d has not created any stories' % options['user_id'])
+        except StoryNotFoundError:
+            raise CommandError('User %d has no story named %s' % (options['user_id'], options['story']))
+        finally:
+            if options['output']:
+                file.close()
@@ -0,0 +1,39 @@
+# Copyright 2020 called2voyage
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from django.core.management.base import BaseCommand, CommandError
+
+from notes import importer
+from notes.exceptions import UserNotCreatedError
+
+class Command(BaseCommand):
+    help = 'Imports notes from a text, CSV or JSON file into a Discord user\'s stories'
+
+    def add_arguments(self, parser):
+        parser.add_argument('user_id', type=int, help='Discord ID of the user who owns the stories')
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=sorted(importer.PARSERS), help='Defaults to a guess from the file name')
+
+    def handle(self, *args, **options):
+        with open(options['path'], encoding='utf-8') as file:
+            text = file.read()
+        format = options['format'] or importer.format_for(options['path'])
+        try:
+            result = importer.import_notes(options['user_id'], text, format)
+        except UserNotCreatedError:
+            raise CommandError('User %d has not created any stories' % options['user_id'])
+        for line, reason in result.failures:
+            self.stderr.write('Line %d: %s' % (line, reason))
+        self.stdout.write('Added %d notes.' % result.created)
@@ -0,0 +1,55 @@
+# Copyright 2020 called2voyage
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import io
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from notes import profiling
+
+class Command(BaseCommand):
+    help = 'Summarizes the command profiles captured by rundiscordbot'
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory', nargs='?', default=settings.FICNOTESBOT_PROFILE_DIR)
+        parser.add_argument('--limit', type=int, default=20, help='Rows to show in each table')
+        parser.add_argument('--command', help='Only summarize captures of this command, such as list_notes')
+        parser.add_argument('--sort', default='cumulative', choices=['cumulative', 'tottime', 'ncalls'],
+                            help='Order of the function table')
+
+    def handle(self, *args, **options):
+        captures = profiling.load_captures(options['directory'])
+        if options['command']:
+            captures = [capture for capture in captures if capture[1]['command'] == options['command']]
+        if not captures:
+            raise CommandError('No captures in ' + options['directory'])
+        limit = options['limit']
+
+        self.stdout.write('%d captures, slowest first:' % len(captures))
+        for path, details in captures[:limit]:
+            self.stdout.write('%9.1f ms %9.1f ms db %4d queries  %s' % (details['seconds'] * 1000, details['db_seconds'] * 1000,
+                                                                      len(details['sql']), details['text'].replace('\n', ' ')[:80]))
+
+        self.stdout.write('\nQueries by total time:')
+        self.stdout.write('%7s %10s %10s  %s' % ('runs', 'total ms', 'max ms', 'sql'))
+        for sql, count, total, slowest in profiling.query_totals(captures)[:limit]:
+            self.stdout.write('%7d %10.1f %10.1f  %s' % (count, total * 1000, slowest * 1000, sql))
+
+        self.stdout.write('\nHottest functions:')
+        # pstats prints line by line, which OutputWrapper would end with extra newlines
+        output = io.StringIO()
+        profiling.function_stats(captures, output).sort_stats(options['sort']).print_stats(limit)
+        self.stdout.write(output.getvalue())
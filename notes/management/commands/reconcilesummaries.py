@@ -0,0 +1,39 @@
+# Copyright 2020 called2voyage
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from django.core.management.base import BaseCommand, CommandError
+
+from notes import summaries
+
+class Command(BaseCommand):
+    help = 'Recounts story summaries that no longer match the elements and notes they count'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true', help='Only report differences, failing if there are any')
+        parser.add_argument('--limit', type=int, default=20, help='Differences to list')
+
+    def handle(self, *args, **options):
+        drift = summaries.reconcile(fix=not options['check'])
+        for story_pk, field, stored, actual in drift[:options['limit']]:
+            self.stdout.write('story %d %s: %d stored, %d counted' % (story_pk, field, stored, actual))
+        if len(drift) > options['limit']:
+            self.stdout.write('...and %d more.' % (len(drift) - options['limit']))
+        stories = len({story_pk for story_pk, _, _, _ in drift})
+        if options['check']:
+            if drift:
+                raise CommandError('%d stories have summaries that differ from their counts' % stories)
+            self.stdout.write('Every story summary matches.')
+        else:
+            self.stdout.write('Recounted %d stories.' % stories)
@@ -0,0 +1,47 @@
+# Copyright 2020 called2voyage
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from django.core.management.base import BaseCommand, CommandError
+
+from notes import replay
+
+class Command(BaseCommand):
+    help = 'Replays a message log against a throwaway database and reports latency and queries per command'
+
+    def add_arguments(self, parser):
+        parser.add_argument('log', nargs='?', help='JSON lines written by rundiscordbot --record; generated if left out')
+        parser.add_argument('--users', type=int, default=20, help='Users in the generated log')
+        parser.add_argument('--commands', type=int, default=2000, help='Commands in the generated log after setup')
+        parser.add_argument('--seed', type=int, default=0, help='Seed for the generated log')
+        parser.add_argument('--p99-budget', type=float, help='Fail if any command has a p99 latency above this many milliseconds')
+
+    def handle(self, *args, **options):
+        if options['log']:
+            with open(options['log'], encoding='utf-8') as file:
+                requests = replay.load_log(file)
+        else:
+            requests = replay.generate_log(options['users'], options['commands'], options['seed'])
+        rows = replay.summarize(replay.replay(requests))
+        self.stdout.write('%-14s %7s %9s %9s %9s %9s' % ('command', 'count', 'p50 ms', 'p99 ms', 'queries', 'max'))
+        failures = []
+        for name, count, p50, p99, mean_queries, most_queries in rows:
+            self.stdout.write('%-14s %7d %9.2f %9.2f %9.2f %9d' % (name, count, p50 * 1000, p99 * 1000, mean_queries, most_queries))
+            budget = replay.QUERY_BUDGETS.get(name)
+            if budget is not None and most_queries > budget:
+                failures.append('%s made %d queries (budget %d)' % (name, most_queries, budget))
+            if options['p99_budget'] is not None and p99 * 1000 > options['p99_budget']:
+                failures.append('%s p99 %.2fms (budget %gms)' % (name, p99 * 1000, options['p99_budget']))
+        if failures:
+            raise CommandError('Over budget: ' + ', '.join(failures))
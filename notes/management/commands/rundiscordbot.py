@@ -13,486 +13,209 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import json
 import os
-import asyncio
 
-import discord
 from dotenv import load_dotenv
 
+from django.conf import settings
 from django.core.management.base import BaseCommand, CommandError
-from django.db import IntegrityError
-from django.core.exceptions import MultipleObjectsReturned
-from asgiref.sync import sync_to_async
-from notes.models import DiscordUser, Story, StoryElement, PlotPoint, Note
+from notes import core, dbpool, metrics, outbound, profiling, shards, writebehind
 
-class UserNotCreatedError(Exception):
-    """Raised when requesting user has not been added"""
-    pass
-
-class StoryNotFoundError(Exception):
-    """Raised when requested story does not exist"""
-    pass
-
-class ElementNotFoundError(Exception):
-    """Raised when requested element does not exist"""
-    pass
-
-class NoteNotFoundError(Exception):
-    """Raised when requested note does not exist"""
-    pass
+def guild_id(channel):
+    guild = getattr(channel, 'guild', None)
+    return guild.id if guild is not None else None
 
 class Command(BaseCommand):
     help = 'Launches the Discord bot'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--shard-count', type=int,
+                            help='Number of gateway shards; without --shard-id, runs and supervises a process per shard')
+        parser.add_argument('--shard-id', type=int, help='The shard this process connects as')
+        parser.add_argument('--metrics-port', type=int, default=settings.FICNOTESBOT_METRICS_PORT,
+                            help='Serve Prometheus metrics on this localhost port, plus the shard id when sharded')
+        parser.add_argument('--record',
+                            help='Append every command received to this file, for replaybot; sharded bots add the shard id before the extension')
+        parser.add_argument('--profile-sample', type=float, default=0.0,
+                            help='Percentage of commands to profile, with the SQL they run')
+        parser.add_argument('--profile-slow-ms', type=float,
+                            help='Also profile any command taking at least this many milliseconds; profiles every command to catch them')
+        parser.add_argument('--profile-dir', default=settings.FICNOTESBOT_PROFILE_DIR,
+                            help='Directory to save profiles to, for profilesummary')
+
+    def create_client(self, shard_id, shard_count):
+        import discord
+        intents = discord.Intents.default()
+        # Commands are read from messages, a privileged intent the bot has to be granted
+        intents.message_content = True
+        if shard_count is None:
+            return discord.Client(intents=intents)
+        return discord.Client(intents=intents, shard_id=shard_id, shard_count=shard_count)
+
+    def create_outbox(self):
+        return outbound.Outbox()
+
+    def shard_args(self, options):
+        """The options the supervisor passes on to each shard process"""
+        args = []
+        for option in ('metrics_port', 'record', 'profile_slow_ms', 'profile_dir'):
+            if options[option] is not None:
+                args += ['--' + option.replace('_', '-'), str(options[option])]
+        if options['profile_sample']:
+            args += ['--profile-sample', str(options['profile_sample'])]
+        return args
+
     def handle(self, *args, **options):
         active = True
+        shard_id = options['shard_id']
+        shard_count = options['shard_count']
+        if shard_id is not None and shard_count is None:
+            raise CommandError('--shard-id needs --shard-count')
+        if shard_count is not None and shard_id is None:
+            shards.Supervisor(shard_count, self.shard_args(options)).run()
+            return
+        if shard_id is not None and not 0 <= shard_id < shard_count:
+            raise CommandError('--shard-id must be between 0 and %d' % (shard_count - 1))
+
+        # Deferred to here so the shard supervisor, which never connects, doesn't load discord.py
+        import discord
 
         load_dotenv()
         TOKEN = os.getenv('DISCORD_TOKEN')
 
-        client = discord.Client()
-
-        @sync_to_async
-        def save_story(message, name):
-            story = None
-            if DiscordUser.objects.filter(user_id=message.author.id).exists():
-                user = DiscordUser.objects.get(user_id=message.author.id)
-                story = Story(owner=user, name=name)
-                story.save()
-            else:
-                user = DiscordUser(user_id=message.author.id, name=message.author.name)
-                user.save()
-                story = Story(owner=user, name=name)
-                story.save()
-            return story.name
-
-        @sync_to_async
-        def save_element(message, name, story, type):
-            return save_element_sync(message, name, story, type)
-
-        def save_element_sync(message, name, story, type):
-            element = None
-            if DiscordUser.objects.filter(user_id=message.author.id).exists():
-                user = DiscordUser.objects.get(user_id=message.author.id)
-                if Story.objects.filter(owner=user, name=story).exists():
-                    story = Story.objects.get(owner=user, name=story)
-                    element = StoryElement(story=story, type=type, name=name)
-                    element.save()
+        client = self.create_client(shard_id, shard_count)
+
+        database = dbpool.database_executor()
+        outbox = self.create_outbox()
+        profiler = None
+        if options['profile_sample'] or options['profile_slow_ms'] is not None:
+            threshold = options['profile_slow_ms'] / 1000 if options['profile_slow_ms'] is not None else None
+            profiler = profiling.Profiler(options['profile_dir'], options['profile_sample'] / 100, threshold)
+        batcher = writebehind.note_batcher(database)
+        bot = core.Core(database, profiler, batcher)
+        metrics.watch(outbox, bot.pending, database)
+        record = None
+        if options['record']:
+            path = options['record'] if shard_id is None else shards.shard_path(options['record'], shard_id)
+            record = open(path, 'a', encoding='utf-8')
+
+        async def get_channel(channel_id):
+            return client.get_channel(channel_id) or await client.fetch_channel(channel_id)
+
+        def prompt_view(prompt):
+            """A button for each of the prompt's options"""
+            view = discord.ui.View(timeout=None)
+            for option in prompt.options:
+                view.add_item(discord.ui.Button(emoji=option, custom_id=option))
+            # Stopped so discord.py doesn't keep it: clicks are answered in on_interaction,
+            # which also sees those on prompts restored after a restart
+            view.stop()
+            return view
+
+        async def respond(interaction, edit=None, view=None):
+            """Answer a click with edit to its message, or only acknowledge it; False if that is no longer possible"""
+            if interaction.response.is_done():
+                return False
+            try:
+                if edit is None:
+                    await interaction.response.defer()
+                elif edit.content is None:
+                    await interaction.response.edit_message(view=view)
                 else:
-                    raise StoryNotFoundError
-            else:
-                raise UserNotCreatedError
-            return story.name, element.name
-
-        @sync_to_async
-        def save_plotpoint(message, index, header, story):
-            story, index = save_element_sync(message, index, story, StoryElement.PLOTPOINT)
-            user = DiscordUser.objects.get(user_id=message.author.id)
-            story = Story.objects.get(owner=user, name=story)
-            element = StoryElement.objects.get(story=story, name=index)
-            plotpoint = PlotPoint(index=element, header=header)
-            plotpoint.save()
-            return story.name, index
-
-        @sync_to_async
-        def save_note(message, note, element, story):
-            if DiscordUser.objects.filter(user_id=message.author.id).exists():
-                user = DiscordUser.objects.get(user_id=message.author.id)
-                if Story.objects.filter(owner=user, name=story).exists():
-                    story = Story.objects.get(owner=user, name=story)
-                    if StoryElement.objects.filter(story=story, name=element).exists():
-                        try:
-                            element = StoryElement.objects.get(story=story, name=element)
-                            note = Note(element=element, note=note)
-                            note.save()
-                        except MultipleObjectsReturned:
-                            elements = StoryElement.objects.filter(story=story, name=element)
-                            type_list = [element.get_type_display() for element in elements]
-                            raise MultipleObjectsReturned(type_list)
-                    else:
-                        raise ElementNotFoundError
-                else:
-                    raise StoryNotFoundError
-            else:
-                raise UserNotCreatedError
-            return element.name
-
-        @sync_to_async
-        def save_note_by_type(message, note, element, type, story):
-            if DiscordUser.objects.filter(user_id=message.author.id).exists():
-                user = DiscordUser.objects.get(user_id=message.author.id)
-                if Story.objects.filter(owner=user, name=story).exists():
-                    story = Story.objects.get(owner=user, name=story)
-                    if StoryElement.objects.filter(story=story, name=element, type=type).exists():
-                        element = StoryElement.objects.get(story=story, name=element, type=type)
-                        note = Note(element=element, note=note)
-                        note.save()
+                    await interaction.response.edit_message(content=edit.content, view=view)
+            except discord.NotFound:
+                # Discord forgets interactions not answered within three seconds
+                return False
+            return True
+
+        async def send_replies(channel, user_id, replies, interaction=None):
+            for reply in replies:
+                view = prompt_view(reply.prompt) if reply.prompt is not None else None
+                if isinstance(reply, core.Edit):
+                    # Answering the click edits its message in the same call, while it still can
+                    answered = (interaction is not None and interaction.message.id == reply.message_id
+                                and await respond(interaction, reply, view))
+                    if answered:
+                        interaction = None
                     else:
-                        raise ElementNotFoundError
+                        await outbox.edit(channel.get_partial_message(reply.message_id), reply.content, view)
+                    prompt_id = reply.message_id
+                elif reply.file is not None:
+                    # discord.py closes the file once it has been sent
+                    await outbox.send_file(channel, reply.content, discord.File(reply.file, reply.filename))
+                elif view is not None:
+                    prompt_id = (await outbox.send_view(channel, reply.content, view, reply.priority)).id
                 else:
-                    raise StoryNotFoundError
-            else:
-                raise UserNotCreatedError
-            return element.name
+                    await outbox.send(channel, reply.content, reply.priority, reply.coalesce)
+                # The buttons go out with the message, so only the choice is left to wait on.
+                # Edits without a view take the old ones off, leaving the answer in their place.
+                if reply.prompt is not None:
+                    await bot.wait_for_choice(reply.prompt.choice(prompt_id, user_id, channel.id, guild_id(channel)))
 
-        @sync_to_async
-        def list_stories(user):
-            if DiscordUser.objects.filter(user_id=user).exists():
-                user = DiscordUser.objects.get(user_id=user)
-                return [s.name for s in Story.objects.filter(owner=user)]
-            else:
-                raise UserNotCreatedError
-
-        @sync_to_async
-        def list_elements_by_type(user, story, type):
-            if DiscordUser.objects.filter(user_id=user).exists():
-                user = DiscordUser.objects.get(user_id=user)
-                if Story.objects.filter(owner=user, name=story).exists():
-                    story = Story.objects.get(owner=user, name=story)
-                    if StoryElement.objects.filter(story=story, type=type).exists():
-                        if type == StoryElement.PLOTPOINT:
-                            return [(p.index.name, p.header) for p in PlotPoint.objects.filter(index__story=story)]
-                        return [e.name for e in StoryElement.objects.filter(story=story, type=type)]
-                    else:
-                        raise ElementNotFoundError
-                else:
-                    raise StoryNotFoundError
-            else:
-                raise UserNotCreatedError
-
-        @sync_to_async
-        def list_notes(user, element, story):
-            if DiscordUser.objects.filter(user_id=user).exists():
-                user = DiscordUser.objects.get(user_id=user)
-                if Story.objects.filter(owner=user, name=story).exists():
-                    story = Story.objects.get(owner=user, name=story)
-                    if StoryElement.objects.filter(story=story, name=element).exists():
-                        try:
-                            element = StoryElement.objects.get(story=story, name=element)
-                            if Note.objects.filter(element=element).exists():
-                                return [n.note for n in Note.objects.filter(element=element)]
-                            else:
-                                raise NoteNotFoundError
-                        except MultipleObjectsReturned:
-                            elements = StoryElement.objects.filter(story=story, name=element)
-                            type_list = [element.get_type_display() for element in elements]
-                            raise MultipleObjectsReturned(type_list)
-                    else:
-                        raise ElementNotFoundError
-                else:
-                    raise StoryNotFoundError
-            else:
-                raise UserNotCreatedError
-
-        @sync_to_async
-        def list_notes_by_type(user, element, type, story):
-            if DiscordUser.objects.filter(user_id=user).exists():
-                user = DiscordUser.objects.get(user_id=user)
-                if Story.objects.filter(owner=user, name=story).exists():
-                    story = Story.objects.get(owner=user, name=story)
-                    if StoryElement.objects.filter(story=story, name=element, type=type).exists():
-                        element = StoryElement.objects.get(story=story, name=element, type=type)
-                        if Note.objects.filter(element=element).exists():
-                            return [n.note for n in Note.objects.filter(element=element)]
-                        else:
-                            raise NoteNotFoundError
-                    else:
-                        raise ElementNotFoundError
-                else:
-                    raise StoryNotFoundError
-            else:
-                raise UserNotCreatedError
+        async def expire_choice(choice):
+            replies = await bot.expire(choice)
+            if replies:
+                await send_replies(await get_channel(choice.channel_id), choice.user_id, replies)
 
         @client.event
         async def on_message(message):
-            if message.content.startswith('!ficnotesbot add '):
-                if message.content.startswith('!ficnotesbot add story '):
-                    name = message.content.split('!ficnotesbot add story ')[1]
-                    try:
-                        story = await save_story(message, name)
-                        await message.channel.send(message.author.mention+ ' ' + story + ' has been added to your stories.')
-                    except IntegrityError:
-                        await message.channel.send(message.author.mention+ ' ' + name + ' already exists.')
-                if message.content.startswith('!ficnotesbot add character '):
-                    character_story = message.content.split('!ficnotesbot add character ')[1]
-                    name = character_story.split(' > ')[0]
-                    story = character_story.split(' > ')[1]
-                    try:
-                        story, character = await save_element(message, name, story, StoryElement.CHARACTER)
-                        await message.channel.send(message.author.mention+ ' ' + character + ' has been added to ' + story + '.')
-                    except UserNotCreatedError:
-                        await message.channel.send(message.author.mention+ ' You have not created any stories yet.')
-                    except StoryNotFoundError:
-                        await message.channel.send(message.author.mention+ ' ' + story + ' not found. Try adding it first with "!ficnotesbot add story ' + story + '".')
-                    except IntegrityError:
-                        await message.channel.send(message.author.mention+ ' ' + name + ' is already in ' + story + '.')
-                if message.content.startswith('!ficnotesbot add object '):
-                    object_story = message.content.split('!ficnotesbot add object ')[1]
-                    name = object_story.split(' > ')[0]
-                    story = object_story.split(' > ')[1]
-                    try:
-                        story, object = await save_element(message, name, story, StoryElement.OBJECT)
-                        await message.channel.send(message.author.mention+ ' ' + object + ' has been added to ' + story + '.')
-                    except UserNotCreatedError:
-                        await message.channel.send(message.author.mention+ ' You have not created any stories yet.')
-                    except StoryNotFoundError:
-                        await message.channel.send(message.author.mention+ ' ' + story + ' not found. Try adding it first with "!ficnotesbot add story ' + story + '".')
-                    except IntegrityError:
-                        await message.channel.send(message.author.mention+ ' ' + name + ' is already in ' + story + '.')
-                if message.content.startswith('!ficnotesbot add event '):
-                    event_story = message.content.split('!ficnotesbot add event ')[1]
-                    name = event_story.split(' > ')[0]
-                    story = event_story.split(' > ')[1]
-                    try:
-                        story, event = await save_element(message, name, story, StoryElement.EVENT)
-                        await message.channel.send(message.author.mention+ ' ' + event + ' has been added to ' + story + '.')
-                    except UserNotCreatedError:
-                        await message.channel.send(message.author.mention+ ' You have not created any stories yet.')
-                    except StoryNotFoundError:
-                        await message.channel.send(message.author.mention+ ' ' + story + ' not found. Try adding it first with "!ficnotesbot add story ' + story + '".')
-                    except IntegrityError:
-                        await message.channel.send(message.author.mention+ ' ' + name + ' is already in ' + story + '.')
-                if message.content.startswith('!ficnotesbot add place '):
-                    place_story = message.content.split('!ficnotesbot add place ')[1]
-                    name = place_story.split(' > ')[0]
-                    story = place_story.split(' > ')[1]
-                    try:
-                        story, place = await save_element(message, name, story, StoryElement.PLACE)
-                        await message.channel.send(message.author.mention+ ' ' + place + ' has been added to ' + story + '.')
-                    except UserNotCreatedError:
-                        await message.channel.send(message.author.mention+ ' You have not created any stories yet.')
-                    except StoryNotFoundError:
-                        await message.channel.send(message.author.mention+ ' ' + story + ' not found. Try adding it first with "!ficnotesbot add story ' + story + '".')
-                    except IntegrityError:
-                        await message.channel.send(message.author.mention+ ' ' + name + ' is already in ' + story + '.')
-                if message.content.startswith('!ficnotesbot add concept '):
-                    concept_story = message.content.split('!ficnotesbot add concept ')[1]
-                    name = concept_story.split(' > ')[0]
-                    story = concept_story.split(' > ')[1]
-                    try:
-                        story, concept = await save_element(message, name, story, StoryElement.CONCEPT)
-                        await message.channel.send(message.author.mention+ ' ' + concept + ' has been added to ' + story + '.')
-                    except UserNotCreatedError:
-                        await message.channel.send(message.author.mention+ ' You have not created any stories yet.')
-                    except StoryNotFoundError:
-                        await message.channel.send(message.author.mention+ ' ' + story + ' not found. Try adding it first with "!ficnotesbot add story ' + story + '".')
-                    except IntegrityError:
-                        await message.channel.send(message.author.mention+ ' ' + name + ' is already in ' + story + '.')
-                if message.content.startswith('!ficnotesbot add plotpoint '):
-                    plotpoint_story = message.content.split('!ficnotesbot add plotpoint ')[1]
-                    index_header = plotpoint_story.split(' > ')[0]
-                    story = plotpoint_story.split(' > ')[1]
-                    index = index_header.split('"')[1]
-                    header = index_header.split('" ')[1]
-                    try:
-                        story, index = await save_plotpoint(message, index, header, story)
-                        await message.channel.send(message.author.mention+ ' ' + index + ' has been added to ' + story + '.')
-                    except UserNotCreatedError:
-                        await message.channel.send(message.author.mention+ ' You have not created any stories yet.')
-                    except StoryNotFoundError:
-                        await message.channel.send(message.author.mention+ ' ' + story + ' not found. Try adding it first with "!ficnotesbot add story ' + story + '".')
-                    except IntegrityError:
-                        await message.channel.send(message.author.mention+ ' ' + index + ' is already in ' + story + '.')
-                if message.content.startswith('!ficnotesbot add note '):
-                    note_element_story = message.content.split('!ficnotesbot add note ')[1]
-                    note = note_element_story.split(' > ')[0]
-                    element = note_element_story.split(' > ')[1]
-                    story = note_element_story.split(' > ')[2]
-                    try:
-                        element = await save_note(message, note, element, story)
-                        await message.channel.send(message.author.mention+ ' Added a note to ' + element + '.')
-                    except UserNotCreatedError:
-                        await message.channel.send(message.author.mention+ ' You have not created any stories yet.')
-                    except StoryNotFoundError:
-                        await message.channel.send(message.author.mention+ ' ' + story + ' not found. Try adding it first with "!ficnotesbot add story ' + story + '".')
-                    except ElementNotFoundError:
-                        await message.channel.send(message.author.mention+ ' ' + element + ' not found in ' + story + '. Try adding it first with "!ficnotesbot add [type] ' + element + ' > ' + story + '".')
-                    except MultipleObjectsReturned as e:
-                        message_str = message.author.mention + ' Which ' + element + ' did you mean?\n'
-                        emoji = ['6️⃣', '5️⃣', '4️⃣', '3️⃣', '2️⃣', '1️⃣']
-                        sent_emoji = {}
-                        for type in e.args[0]:
-                            em = emoji.pop()
-                            message_str = message_str + ' ' + em + ' - ' + type + '\n'
-                            sent_emoji[em] = type
-                        msg = await message.channel.send(message_str)
-                        if '1️⃣' not in emoji:
-                            await msg.add_reaction('1️⃣')
-                        if '2️⃣' not in emoji:
-                            await msg.add_reaction('2️⃣')
-                        if '3️⃣' not in emoji:
-                            await msg.add_reaction('3️⃣')
-                        if '4️⃣' not in emoji:
-                            await msg.add_reaction('4️⃣')
-                        if '5️⃣' not in emoji:
-                            await msg.add_reaction('5️⃣')
-                        if '6️⃣' not in emoji:
-                            await msg.add_reaction('6️⃣')
-
-                        def check(reaction, user):
-                            return user == message.author and str(reaction.emoji) in sent_emoji
+            request = core.Request(message.author.id, message.author.name, message.channel.id, message.content,
+                                   guild_id(message.channel), message.attachments, message.author.mention)
+            replies = await bot.handle(request)
+            if replies is None:
+                return
+            if record is not None:
+                record.write(json.dumps(core.request_to_json(request)) + '\n')
+                record.flush()
+            await send_replies(message.channel, message.author.id, replies)
 
-                        try:
-                            reaction, _ = await client.wait_for('reaction_add', timeout=60.0, check=check)
-                            type = StoryElement.ELEMENT_TYPE_CHOICES[[i for i, t in enumerate(StoryElement.ELEMENT_TYPE_CHOICES) if sent_emoji[reaction.emoji] in t][0]][0]
-                            element = await save_note_by_type(message, note, element, type, story)
-                            await msg.delete()
-                            await message.channel.send(message.author.mention+ ' Added a note to ' + element + '.')
-                        except asyncio.TimeoutError:
-                            await msg.delete()
-                            await message.channel.send('Timeout. Try again.')
-            if message.content.startswith('!ficnotesbot list '):
-                if message.content.startswith('!ficnotesbot list stories'):
-                    try:
-                        list = await list_stories(message.author.id)
-                        msg = "You have the following stories:\n"
-                        for story in list:
-                            msg = msg + '* ' + story + '\n'
-                        await message.channel.send(message.author.mention+ ' ' + msg)
-                    except UserNotCreatedError:
-                        await message.channel.send(message.author.mention+ ' You have not created any stories yet.')
-                if message.content.startswith('!ficnotesbot list characters in '):
-                    story = message.content.split('!ficnotesbot list characters in ')[1]
-                    try:
-                        list = await list_elements_by_type(message.author.id, story, StoryElement.CHARACTER)
-                        msg = story + " characters:\n"
-                        for character in list:
-                            msg = msg + '* ' + character + '\n'
-                        await message.channel.send(message.author.mention+ ' ' + msg)
-                    except UserNotCreatedError:
-                        await message.channel.send(message.author.mention+ ' You have not created any stories yet.')
-                    except StoryNotFoundError:
-                        await message.channel.send(message.author.mention+ ' ' + story + ' not found. Try adding it first with "!ficnotesbot add story ' + story + '".')
-                    except ElementNotFoundError:
-                        await message.channel.send(message.author.mention+ ' You have not added any characters to ' + story + '. Try adding one first with "!ficnotesbot add character [name] > ' + story + '".')
-                if message.content.startswith('!ficnotesbot list objects in '):
-                    story = message.content.split('!ficnotesbot list objects in ')[1]
-                    try:
-                        list = await list_elements_by_type(message.author.id, story, StoryElement.OBJECT)
-                        msg = story + " objects:\n"
-                        for object in list:
-                            msg = msg + '* ' + object + '\n'
-                        await message.channel.send(message.author.mention+ ' ' + msg)
-                    except UserNotCreatedError:
-                        await message.channel.send(message.author.mention+ ' You have not created any stories yet.')
-                    except StoryNotFoundError:
-                        await message.channel.send(message.author.mention+ ' ' + story + ' not found. Try adding it first with "!ficnotesbot add story ' + story + '".')
-                    except ElementNotFoundError:
-                        await message.channel.send(message.author.mention+ ' You have not added any objects to ' + story + '. Try adding one first with "!ficnotesbot add object [name] > ' + story + '".')
-                if message.content.startswith('!ficnotesbot list events in '):
-                    story = message.content.split('!ficnotesbot list events in ')[1]
-                    try:
-                        list = await list_elements_by_type(message.author.id, story, StoryElement.EVENT)
-                        msg = story + " events:\n"
-                        for event in list:
-                            msg = msg + '* ' + event + '\n'
-                        await message.channel.send(message.author.mention+ ' ' + msg)
-                    except UserNotCreatedError:
-                        await message.channel.send(message.author.mention+ ' You have not created any stories yet.')
-                    except StoryNotFoundError:
-                        await message.channel.send(message.author.mention+ ' ' + story + ' not found. Try adding it first with "!ficnotesbot add story ' + story + '".')
-                    except ElementNotFoundError:
-                        await message.channel.send(message.author.mention+ ' You have not added any events to ' + story + '. Try adding one first with "!ficnotesbot add event [name] > ' + story + '".')
-                if message.content.startswith('!ficnotesbot list places in '):
-                    story = message.content.split('!ficnotesbot list places in ')[1]
-                    try:
-                        list = await list_elements_by_type(message.author.id, story, StoryElement.PLACE)
-                        msg = story + " places:\n"
-                        for place in list:
-                            msg = msg + '* ' + place + '\n'
-                        await message.channel.send(message.author.mention+ ' ' + msg)
-                    except UserNotCreatedError:
-                        await message.channel.send(message.author.mention+ ' You have not created any stories yet.')
-                    except StoryNotFoundError:
-                        await message.channel.send(message.author.mention+ ' ' + story + ' not found. Try adding it first with "!ficnotesbot add story ' + story + '".')
-                    except ElementNotFoundError:
-                        await message.channel.send(message.author.mention+ ' You have not added any places to ' + story + '. Try adding one first with "!ficnotesbot add place [name] > ' + story + '".')
-                if message.content.startswith('!ficnotesbot list concepts in '):
-                    story = message.content.split('!ficnotesbot list concepts in ')[1]
-                    try:
-                        list = await list_elements_by_type(message.author.id, story, StoryElement.CONCEPT)
-                        msg = story + " concepts:\n"
-                        for concept in list:
-                            msg = msg + '* ' + concept + '\n'
-                        await message.channel.send(message.author.mention+ ' ' + msg)
-                    except UserNotCreatedError:
-                        await message.channel.send(message.author.mention+ ' You have not created any stories yet.')
-                    except StoryNotFoundError:
-                        await message.channel.send(message.author.mention+ ' ' + story + ' not found. Try adding it first with "!ficnotesbot add story ' + story + '".')
-                    except ElementNotFoundError:
-                        await message.channel.send(message.author.mention+ ' You have not added any concepts to ' + story + '. Try adding one first with "!ficnotesbot add concept [name] > ' + story + '".')
-                if message.content.startswith('!ficnotesbot list plotpoints in '):
-                    story = message.content.split('!ficnotesbot list plotpoints in ')[1]
-                    try:
-                        list = await list_elements_by_type(message.author.id, story, StoryElement.PLOTPOINT)
-                        msg = story + " plot points:\n"
-                        for plotpoint in list:
-                            msg = msg + '* ' + plotpoint[0] + ' ' + plotpoint[1] + '\n'
-                        await message.channel.send(message.author.mention+ ' ' + msg)
-                    except UserNotCreatedError:
-                        await message.channel.send(message.author.mention+ ' You have not created any stories yet.')
-                    except StoryNotFoundError:
-                        await message.channel.send(message.author.mention+ ' ' + story + ' not found. Try adding it first with "!ficnotesbot add story ' + story + '".')
-                    except ElementNotFoundError:
-                        await message.channel.send(message.author.mention+ ' You have not added any plot points to ' + story + '. Try adding one first with "!ficnotesbot add plotpoint "[index]" [header] > ' + story + '".')
-                if message.content.startswith('!ficnotesbot list notes for '):
-                    element_story = message.content.split('!ficnotesbot list notes for ')[1]
-                    element = element_story.split(' > ')[0]
-                    story = element_story.split(' > ')[1]
-                    try:
-                        list = await list_notes(message.author.id, element, story)
-                        msg = element + " notes:\n"
-                        for note in list:
-                            msg = msg + '* ' + note + '\n'
-                        await message.channel.send(message.author.mention+ ' ' + msg)
-                    except UserNotCreatedError:
-                        await message.channel.send(message.author.mention+ ' You have not created any stories yet.')
-                    except StoryNotFoundError:
-                        await message.channel.send(message.author.mention+ ' ' + story + ' not found. Try adding it first with "!ficnotesbot add story ' + story + '".')
-                    except ElementNotFoundError:
-                        await message.channel.send(message.author.mention+ ' ' + element + ' not found in ' + story + '. Try adding it first with "!ficnotesbot add [type] ' + element + ' > ' + story + '".')
-                    except NoteNotFoundError:
-                        await message.channel.send(message.author.mention+ ' You have not added any notes to ' + element + '. Try adding one first with "!ficnotesbot add note [note_text] > ' + element + ' > ' + story + '".')
-                    except MultipleObjectsReturned as e:
-                        message_str = message.author.mention + ' Which ' + element + ' did you mean?\n'
-                        emoji = ['6️⃣', '5️⃣', '4️⃣', '3️⃣', '2️⃣', '1️⃣']
-                        sent_emoji = {}
-                        for type in e.args[0]:
-                            em = emoji.pop()
-                            message_str = message_str + ' ' + em + ' - ' + type + '\n'
-                            sent_emoji[em] = type
-                        qmsg = await message.channel.send(message_str)
-                        if '1️⃣' not in emoji:
-                            await qmsg.add_reaction('1️⃣')
-                        if '2️⃣' not in emoji:
-                            await qmsg.add_reaction('2️⃣')
-                        if '3️⃣' not in emoji:
-                            await qmsg.add_reaction('3️⃣')
-                        if '4️⃣' not in emoji:
-                            await qmsg.add_reaction('4️⃣')
-                        if '5️⃣' not in emoji:
-                            await qmsg.add_reaction('5️⃣')
-                        if '6️⃣' not in emoji:
-                            await qmsg.add_reaction('6️⃣')
-
-                        def check(reaction, user):
-                            return user == message.author and str(reaction.emoji) in sent_emoji
+        @client.event
+        async def on_interaction(interaction):
+            custom_id = (interaction.data or {}).get('custom_id')
+            if custom_id is None or interaction.message is None:
+                return
+            taken = bot.pending.take(interaction.message.id, interaction.user.id, custom_id)
+            if taken is None:
+                # Someone else's prompt, or one already answered or timed out
+                await respond(interaction)
+                return
+            choice, value = taken
+            if database.pending:
+                # Queued behind other calls, the answer could miss Discord's three seconds;
+                # acknowledge now and edit the message itself once it is ready
+                await respond(interaction)
+            replies = await bot.choose(choice, value)
+            if not any(isinstance(reply, core.Edit) and reply.message_id == choice.prompt_id for reply in replies):
+                # Clicks have to be acknowledged, even those that leave their message as it is
+                await respond(interaction)
+                interaction = None
+            await send_replies(await get_channel(choice.channel_id), choice.user_id, replies, interaction)
+
+        restored = False
 
-                        try:
-                            reaction, _ = await client.wait_for('reaction_add', timeout=60.0, check=check)
-                            type = StoryElement.ELEMENT_TYPE_CHOICES[[i for i, t in enumerate(StoryElement.ELEMENT_TYPE_CHOICES) if sent_emoji[reaction.emoji] in t][0]][0]
-                            list = await list_notes_by_type(message.author.id, element, type, story)
-                            msg = element + " notes:\n"
-                            for note in list:
-                                msg = msg + '* ' + note + '\n'
-                            await qmsg.delete()
-                            await message.channel.send(message.author.mention+ ' ' + msg)
-                        except asyncio.TimeoutError:
-                            await qmsg.delete()
-                            await message.channel.send('Timeout. Try again.')
+        @client.event
+        async def on_ready():
+            nonlocal restored
+            if restored:
+                return
+            restored = True
+            if options['metrics_port'] is not None:
+                await metrics.serve(options['metrics_port'] + (shard_id or 0))
+            for choice in await bot.restore(shard_id, shard_count):
+                await expire_choice(choice)
+            client.loop.create_task(bot.pending.run(expire_choice))
 
         @client.event
         async def on_connect():
             await client.change_presence(activity=discord.Game(name="!ficnotesbot help"))
 
-        client.run(TOKEN)
+        try:
+            client.run(TOKEN)
+        finally:
+            database.shutdown()
+            # Stopping the loop cancels batches mid-flight; write what didn't commit
+            if batcher is not None:
+                batcher.drain_sync()
+            if record is not None:
+                record.close()
@@ -0,0 +1,272 @@
+# Copyright 2020 called2voyage
+#
+# This file is part of FicNotesBot.
+#
+# FicNotesBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# FicNotesBot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with FicNotesBot.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import contextvars
+import functools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from django.db import connection
+
+from notes import cache
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the latency histogram buckets, in seconds
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Upper bounds of the queries per command histogram buckets
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34)
+
+def _labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"')) for name, value in zip(names, values)) + '}'
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    """A count for each combination of label values"""
+
+    type = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            return [(self.name, _labels(self.labels, key), value) for key, value in sorted(self.values.items())]
+
+class Histogram:
+    """Cumulative bucket counts, sum and count of observations for each combination of label values"""
+
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=SECONDS_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self.lock:
+            counts = self.values.get(labels)
+            if counts is None:
+                counts = self.values[labels] = [[0] * len(self.buckets), 0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[0][i] += 1
+                    break
+            counts[1] += value
+            counts[2] += 1
+
+    def samples(self):
+        samples = []
+        with self.lock:
+            for key, (buckets, total, count) in sorted(self.values.items()):
+                cumulative = 0
+                for bound, n in zip(self.buckets, buckets):
+                    cumulative += n
+                    samples.append((self.name + '_bucket', _labels(self.labels + ('le',), key + (_number(bound),)), cumulative))
+                samples.append((self.name + '_sum', _labels(self.labels, key), total))
+                samples.append((self.name + '_count', _labels(self.labels, key), count))
+        return samples
+
+class Gauge:
+    """A value read when the metrics are rendered, from callback returning {label values: value}
+
+    type 'counter' marks a callback whose values only go up, such as a running total.
+    """
+
+    def __init__(self, name, help, callback, labels=(), type='gauge'):
+        self.type = type
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.callback = callback
+
+    def samples(self):
+        return [(self.name, _labels(self.labels, key), value) for key, value in sorted(self.callback().items())]
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+
+    def add(self, metric):
+        """Register metric, replacing any earlier one with its name"""
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        """Every metric in the Prometheus text exposition format"""
+        lines = []
+        for name, metric in sorted(self.metrics.items()):
+            lines.append('# HELP %s %s' % (name, metric.help))
+            lines.append('# TYPE %s %s' % (name, metric.type))
+            for sample, labels, value in metric.samples():
+                lines.append('%s%s %s' % (sample, labels, _number(value)))
+        return '\n'.join(lines) + '\n'
+
+registry = Registry()
+
+command_seconds = registry.add(Histogram('ficnotesbot_command_seconds', 'Time to handle a command, up to its replies being queued', ['command']))
+command_db_seconds = registry.add(Histogram('ficnotesbot_command_db_seconds', 'Time a command spent running database calls', ['command']))
+command_db_wait_seconds = registry.add(Histogram('ficnotesbot_command_db_wait_seconds', 'Time a command\'s database calls waited for a thread', ['command']))
+command_queries = registry.add(Histogram('ficnotesbot_command_queries', 'SQL queries a command ran', ['command'], QUERY_BUCKETS))
+command_errors = registry.add(Counter('ficnotesbot_command_errors_total', 'Exceptions raised while handling commands, by type', ['command', 'error']))
+
+def _cache_stats(key):
+    return lambda: {(name,): stats[key] for name, stats in cache.stats().items()}
+
+registry.add(Gauge('ficnotesbot_cache_entries', 'Entries held by each lookup cache', _cache_stats('size'), ['cache']))
+registry.add(Gauge('ficnotesbot_cache_hits_total', 'Lookups each cache answered since it was last cleared', _cache_stats('hits'), ['cache'], 'counter'))
+registry.add(Gauge('ficnotesbot_cache_misses_total', 'Lookups each cache could not answer since it was last cleared', _cache_stats('misses'), ['cache'], 'counter'))
+
+def watch(outbox, pending, executor):
+    """Report the state of the running bot's outbox, pending choices and database executor"""
+    registry.add(Gauge('ficnotesbot_outbox_depth', 'Replies waiting to be sent', lambda: {(): outbox.depth}))
+    registry.add(Gauge('ficnotesbot_outbox_sent_total', 'Replies sent, counting each merged reply', lambda: {(): outbox.sent}, type='counter'))
+    registry.add(Gauge('ficnotesbot_outbox_merged_total', 'Replies merged into an earlier message', lambda: {(): outbox.merged}, type='counter'))
+    registry.add(Gauge('ficnotesbot_outbox_wait_seconds_max', 'Longest a reply has waited to be sent', lambda: {(): outbox.wait_max}))
+    registry.add(Gauge('ficnotesbot_pending_choices', 'Prompts waiting for a click', lambda: {(): len(pending)}))
+    registry.add(Gauge('ficnotesbot_db_pending', 'Database calls running or waiting for a thread', lambda: {(): executor.pending}))
+
+class CommandStats:
+    """What the database calls made for one command cost"""
+
+    def __init__(self, name):
+        self.name = name
+        self.db = 0.0
+        self.wait = 0.0
+        self.queries = 0
+        # Exceptions raised, whether or not the handler caught them
+        self.errors = []
+        # Set by a notes.profiling.Profiler for commands it captures
+        self.sampled = False
+        self.profile = None
+        self.sql = None
+
+    def count_query(self, execute, sql, params, many, context):
+        self.queries += 1
+        if self.sql is None:
+            return execute(sql, params, many, context)
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql.append((sql, time.perf_counter() - start))
+
+_current = contextvars.ContextVar('ficnotesbot_command', default=None)
+
+def current():
+    """The CommandStats of the command the running task is handling, if any"""
+    return _current.get()
+
+@contextmanager
+def command(name, profiler=None, text=None):
+    """Measure the enclosed handling of a command and record it under name
+
+    profiler, a notes.profiling.Profiler, may also capture it along with text.
+    """
+    stats = CommandStats(name)
+    if profiler is not None:
+        profiler.start(stats)
+    token = _current.set(stats)
+    start = time.perf_counter()
+    try:
+        yield stats
+    except Exception as e:
+        if e not in stats.errors:
+            stats.errors.append(e)
+        raise
+    finally:
+        _current.reset(token)
+        elapsed = time.perf_counter() - start
+        command_seconds.observe(elapsed, name)
+        command_db_seconds.observe(stats.db, name)
+        command_db_wait_seconds.observe(stats.wait, name)
+        command_queries.observe(stats.queries, name)
+        for error in stats.errors:
+            command_errors.inc(name, type(error).__name__)
+        if profiler is not None:
+            profiler.finish(stats, text, elapsed)
+
+def measured(func):
+    """Wrap a database helper to take the caller's CommandStats and submit time, and charge its cost to them
+
+    The wrapper runs on the database thread, so the queries it counts are its own.
+    """
+    @functools.wraps(func)
+    def run(stats, submitted, *args, **kwargs):
+        if stats is None:
+            return func(*args, **kwargs)
+        started = time.perf_counter()
+        stats.wait += started - submitted
+        if stats.profile is not None:
+            stats.profile.enable()
+        try:
+            with connection.execute_wrapper(stats.count_query):
+                return func(*args, **kwargs)
+        except Exception as e:
+            stats.errors.append(e)
+            raise
+        finally:
+            if stats.profile is not None:
+                stats.profile.disable()
+            stats.db += time.perf_counter() - started
+    return run
+
+async def _respond(reader, writer):
+    try:
+        request = await reader.readline()
+        # Skip the headers; nothing in them changes the response
+        while (await reader.readline()).strip():
+            pass
+        parts = request.split()
+        if len(parts) >= 2 and parts[0] == b'GET' and parts[1].split(b'?')[0] == b'/metrics':
+            status, body = '200 OK', registry.render().encode('utf-8')
+        else:
+            status, body = '404 Not Found', b'Not found\n'
+        writer.write(('HTTP/1.1 %s\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n'
+                      'Content-Length: %d\r\nConnection: close\r\n\r\n' % (status, len(body))).encode('ascii') + body)
+        await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+async def serve(port, host='127.0.0.1'):
+    """Serve GET /metrics on the running event loop and return the asyncio server"""
+    server = await asyncio.start_server(_respond, host, port)
+    logger.info('Serving metrics on http://%s:%d/metrics', host, port)
+    return server
@@ -0,0 +1,61 @@
+# Generated by Django 3.1.2 on 2026-10-17 15:06
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DiscordUser',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id', models.IntegerField(unique=True)),
+                ('name', models.CharField(max_length=32)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Story',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='notes.discorduser')),
+            ],
+            options={
+                'unique_together': {('owner', 'name')},
+            },
+        ),
+        migrations.CreateModel(
+            name='StoryElement',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('type', models.CharField(choices=[('CHAR', 'Character'), ('OBJ', 'Object'), ('EVNT', 'Event'), ('PLCE', 'Place'), ('CNCP', 'Concept'), ('PLOT', 'Plot Point')], max_length=4)),
+                ('name', models.CharField(max_length=255)),
+                ('story', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='notes.story')),
+            ],
+            options={
+                'unique_together': {('story', 'type', 'name')},
+            },
+        ),
+        migrations.CreateModel(
+            name='PlotPoint',
+            fields=[
+                ('index', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='notes.storyelement')),
+                ('header', models.TextField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Note',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('note', models.TextField()),
+                ('element', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='notes.storyelement')),
+            ],
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 3.1.2 on 2026-10-17 15:09
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='note',
+            name='element',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='notes.storyelement'),
+        ),
+        migrations.AddIndex(
+            model_name='note',
+            index=models.Index(fields=['element', 'id'], name='notes_note_element_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='storyelement',
+            index=models.Index(fields=['story', 'name'], name='notes_element_story_name_idx'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 3.1.2 on 2026-10-17 15:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0002_lookup_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingChoice',
+            fields=[
+                ('prompt_id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('kind', models.CharField(max_length=16)),
+                ('user_id', models.BigIntegerField()),
+                ('channel_id', models.BigIntegerField()),
+                ('options', models.JSONField()),
+                ('payload', models.JSONField()),
+                ('expires', models.DateTimeField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,50 @@
+from django.db import migrations
+
+# Full text index over notes. Each row also carries an 's<story id>' token so
+# a search can be narrowed to one story inside the FTS MATCH itself. SQLite
+# triggers keep it in sync with notes_note, including bulk_create and
+# cascading deletes; other backends search without it.
+
+CREATE_SQL = [
+    "CREATE VIRTUAL TABLE notes_note_fts USING fts5(note, story, tokenize='porter unicode61')",
+    """CREATE TRIGGER notes_note_fts_insert AFTER INSERT ON notes_note BEGIN
+        INSERT INTO notes_note_fts(rowid, note, story)
+        SELECT new.id, new.note, 's' || story_id FROM notes_storyelement WHERE id = new.element_id;
+    END""",
+    """CREATE TRIGGER notes_note_fts_delete AFTER DELETE ON notes_note BEGIN
+        DELETE FROM notes_note_fts WHERE rowid = old.id;
+    END""",
+    """CREATE TRIGGER notes_note_fts_update AFTER UPDATE ON notes_note BEGIN
+        DELETE FROM notes_note_fts WHERE rowid = old.id;
+        INSERT INTO notes_note_fts(rowid, note, story)
+        SELECT new.id, new.note, 's' || story_id FROM notes_storyelement WHERE id = new.element_id;
+    END""",
+    """INSERT INTO notes_note_fts(rowid, note, story)
+        SELECT n.id, n.note, 's' || e.story_id FROM notes_note n JOIN notes_storyelement e ON e.id = n.element_id""",
+]
+
+DROP_SQL = [
+    'DROP TRIGGER IF EXISTS notes_note_fts_insert',
+    'DROP TRIGGER IF EXISTS notes_note_fts_delete',
+    'DROP TRIGGER IF EXISTS notes_note_fts_update',
+    'DROP TABLE IF EXISTS notes_note_fts',
+]
+
+def run_on_sqlite(statements):
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor != 'sqlite':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0003_pendingchoice'),
+    ]
+
+    operations = [
+        migrations.RunPython(run_on_sqlite(CREATE_SQL), run_on_sqlite(DROP_SQL)),
+    ]
@@ -0,0 +1,39 @@
+import re
+
+from django.db import migrations, models
+
+# A copy of notes.models.natural_sort_key as it was when this migration was
+# written, so later changes to it don't change what the backfill writes
+
+DIGITS = re.compile(r'([0-9]+)')
+
+def natural_sort_key(index):
+    parts = DIGITS.split(index.lower())
+    for i in range(1, len(parts), 2):
+        number = parts[i].lstrip('0') or '0'
+        parts[i] = '%03d%s' % (len(number), number)
+    return ''.join(parts) + '\x01' + index
+
+
+def fill_sort_keys(apps, schema_editor):
+    PlotPoint = apps.get_model('notes', 'PlotPoint')
+    plotpoints = list(PlotPoint.objects.select_related('index'))
+    for plotpoint in plotpoints:
+        plotpoint.sort_key = natural_sort_key(plotpoint.index.name)
+    PlotPoint.objects.bulk_update(plotpoints, ['sort_key'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0004_note_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='plotpoint',
+            name='sort_key',
+            field=models.TextField(default=''),
+        ),
+        migrations.RunPython(fill_sort_keys, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0005_plotpoint_sort_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pendingchoice',
+            name='guild_id',
+            field=models.BigIntegerField(null=True),
+        ),
+    ]
@@ -0,0 +1,41 @@
+from django.db import migrations, models
+
+# Discord user ids need 64 bits, which SQLite integers always had.
+#
+# PostgreSQL also gets counterparts of what SQLite gets elsewhere: a GIN index
+# over each note's text search vector for notes.search, and bytewise ordering
+# of plot point sort keys, which a linguistic collation would scramble.
+
+CREATE_SQL = [
+    "CREATE INDEX notes_note_search_idx ON notes_note USING gin (to_tsvector('english', note))",
+    'ALTER TABLE notes_plotpoint ALTER COLUMN sort_key TYPE text COLLATE "C"',
+]
+
+DROP_SQL = [
+    'DROP INDEX IF EXISTS notes_note_search_idx',
+    'ALTER TABLE notes_plotpoint ALTER COLUMN sort_key TYPE text COLLATE "default"',
+]
+
+def run_on_postgresql(statements):
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor != 'postgresql':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0006_pendingchoice_guild_id'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='discorduser',
+            name='user_id',
+            field=models.BigIntegerField(unique=True),
+        ),
+        migrations.RunPython(run_on_postgresql(CREATE_SQL), run_on_postgresql(DROP_SQL)),
+    ]
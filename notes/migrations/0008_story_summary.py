@@ -0,0 +1,135 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+# Triggers keep notes_storysummary current in the same transaction as every
+# element and note write, including bulk_create and cascading deletes, much as
+# 0004 keeps the search index. The first element or note of a story creates
+# its row. Existing stories are counted once the triggers are in place.
+
+# Element type -> the column counting it
+TYPE_COLUMNS = [
+    ('CHAR', 'character_count'),
+    ('OBJ', 'object_count'),
+    ('EVNT', 'event_count'),
+    ('PLCE', 'place_count'),
+    ('CNCP', 'concept_count'),
+    ('PLOT', 'plotpoint_count'),
+]
+
+COLUMNS = ', '.join([column for _, column in TYPE_COLUMNS] + ['note_count'])
+
+def _added(row, cast=''):
+    # One for the column counting row's type, zero for the others, and no notes
+    return ', '.join(["(%s.type = '%s')%s" % (row, type, cast) for type, _ in TYPE_COLUMNS] + ['0'])
+
+def _removed(row, cast=''):
+    return ', '.join('%s = %s - (%s.type = \'%s\')%s' % (column, column, row, type, cast) for type, column in TYPE_COLUMNS)
+
+# Add excluded's counts to an existing row
+UPSERT = 'ON CONFLICT (story_id) DO UPDATE SET ' + ', '.join(
+    '%s = notes_storysummary.%s + excluded.%s' % (column, column, column) for column in COLUMNS.split(', '))
+
+NOTE_COUNT = '0, ' * len(TYPE_COLUMNS)
+
+BACKFILL_SQL = ('INSERT INTO notes_storysummary (story_id, ' + COLUMNS + ') SELECT s.id, ' + ', '.join(
+    ["(SELECT count(*) FROM notes_storyelement e WHERE e.story_id = s.id AND e.type = '%s')" % type for type, _ in TYPE_COLUMNS]
+    + ['(SELECT count(*) FROM notes_note n JOIN notes_storyelement e ON e.id = n.element_id WHERE e.story_id = s.id)'])
+    + ' FROM notes_story s WHERE EXISTS (SELECT 1 FROM notes_storyelement e WHERE e.story_id = s.id)')
+
+SQLITE_CREATE_SQL = [
+    """CREATE TRIGGER notes_storysummary_element_insert AFTER INSERT ON notes_storyelement BEGIN
+        INSERT INTO notes_storysummary (story_id, %s) VALUES (new.story_id, %s) %s;
+    END""" % (COLUMNS, _added('new'), UPSERT),
+    """CREATE TRIGGER notes_storysummary_element_delete AFTER DELETE ON notes_storyelement BEGIN
+        UPDATE notes_storysummary SET %s WHERE story_id = old.story_id;
+    END""" % _removed('old'),
+    """CREATE TRIGGER notes_storysummary_element_update AFTER UPDATE OF type, story_id ON notes_storyelement BEGIN
+        UPDATE notes_storysummary SET %s WHERE story_id = old.story_id;
+        INSERT INTO notes_storysummary (story_id, %s) VALUES (new.story_id, %s) %s;
+    END""" % (_removed('old'), COLUMNS, _added('new'), UPSERT),
+    # SQLite needs the WHERE to tell the upsert from a join in INSERT ... SELECT
+    """CREATE TRIGGER notes_storysummary_note_insert AFTER INSERT ON notes_note BEGIN
+        INSERT INTO notes_storysummary (story_id, %s)
+        SELECT story_id, %s1 FROM notes_storyelement WHERE id = new.element_id %s;
+    END""" % (COLUMNS, NOTE_COUNT, UPSERT),
+    """CREATE TRIGGER notes_storysummary_note_delete AFTER DELETE ON notes_note BEGIN
+        UPDATE notes_storysummary SET note_count = note_count - 1
+        WHERE story_id = (SELECT story_id FROM notes_storyelement WHERE id = old.element_id);
+    END""",
+    BACKFILL_SQL,
+]
+
+SQLITE_DROP_SQL = [
+    'DROP TRIGGER IF EXISTS notes_storysummary_element_insert',
+    'DROP TRIGGER IF EXISTS notes_storysummary_element_delete',
+    'DROP TRIGGER IF EXISTS notes_storysummary_element_update',
+    'DROP TRIGGER IF EXISTS notes_storysummary_note_insert',
+    'DROP TRIGGER IF EXISTS notes_storysummary_note_delete',
+]
+
+POSTGRESQL_CREATE_SQL = [
+    """CREATE FUNCTION notes_storysummary_element() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            UPDATE notes_storysummary SET %s WHERE story_id = OLD.story_id;
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            INSERT INTO notes_storysummary (story_id, %s) VALUES (NEW.story_id, %s) %s;
+        END IF;
+        RETURN NULL;
+    END $$ LANGUAGE plpgsql""" % (_removed('OLD', '::int'), COLUMNS, _added('NEW', '::int'), UPSERT),
+    """CREATE FUNCTION notes_storysummary_note() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'DELETE' THEN
+            UPDATE notes_storysummary SET note_count = note_count - 1
+            WHERE story_id = (SELECT story_id FROM notes_storyelement WHERE id = OLD.element_id);
+        ELSE
+            INSERT INTO notes_storysummary (story_id, %s)
+            SELECT story_id, %s1 FROM notes_storyelement WHERE id = NEW.element_id %s;
+        END IF;
+        RETURN NULL;
+    END $$ LANGUAGE plpgsql""" % (COLUMNS, NOTE_COUNT, UPSERT),
+    """CREATE TRIGGER notes_storysummary_element AFTER INSERT OR DELETE OR UPDATE OF type, story_id ON notes_storyelement
+        FOR EACH ROW EXECUTE PROCEDURE notes_storysummary_element()""",
+    """CREATE TRIGGER notes_storysummary_note AFTER INSERT OR DELETE ON notes_note
+        FOR EACH ROW EXECUTE PROCEDURE notes_storysummary_note()""",
+    BACKFILL_SQL,
+]
+
+POSTGRESQL_DROP_SQL = [
+    'DROP TRIGGER IF EXISTS notes_storysummary_element ON notes_storyelement',
+    'DROP TRIGGER IF EXISTS notes_storysummary_note ON notes_note',
+    'DROP FUNCTION IF EXISTS notes_storysummary_element()',
+    'DROP FUNCTION IF EXISTS notes_storysummary_note()',
+]
+
+def run_for_vendor(statements):
+    def run(apps, schema_editor):
+        for statement in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0007_postgresql_support'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StorySummary',
+            fields=[
+                ('story', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='notes.story')),
+                ('character_count', models.IntegerField(default=0)),
+                ('object_count', models.IntegerField(default=0)),
+                ('event_count', models.IntegerField(default=0)),
+                ('place_count', models.IntegerField(default=0)),
+                ('concept_count', models.IntegerField(default=0)),
+                ('plotpoint_count', models.IntegerField(default=0)),
+                ('note_count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(run_for_vendor({'sqlite': SQLITE_CREATE_SQL, 'postgresql': POSTGRESQL_CREATE_SQL}),
+                             run_for_vendor({'sqlite': SQLITE_DROP_SQL, 'postgresql': POSTGRESQL_DROP_SQL})),
+    ]
@@ -0,0 +1,94 @@
+from importlib import import_module
+
+from django.db import migrations
+
+# 0008's triggers counted element and note inserts and deletes, but a note
+# moved to an element of another story, or an element moved to another story
+# with its notes, left note_count with the old story. These triggers move the
+# counts along. Run reconcilesummaries to fix stories that drifted before.
+
+story_summary = import_module('notes.migrations.0008_story_summary')
+COLUMNS = story_summary.COLUMNS
+UPSERT = story_summary.UPSERT
+NOTE_COUNT = story_summary.NOTE_COUNT
+
+def _added_with_notes(row, cast=''):
+    # As 0008's _added, but bringing the element's notes with it
+    return ', '.join(["(%s.type = '%s')%s" % (row, type, cast) for type, _ in story_summary.TYPE_COLUMNS]
+                     + ['(SELECT count(*) FROM notes_note WHERE element_id = %s.id)' % row])
+
+def _removed_with_notes(row, cast=''):
+    return story_summary._removed(row, cast) + ', note_count = note_count - (SELECT count(*) FROM notes_note WHERE element_id = %s.id)' % row
+
+SQLITE_CREATE_SQL = [
+    'DROP TRIGGER IF EXISTS notes_storysummary_element_update',
+    """CREATE TRIGGER notes_storysummary_element_update AFTER UPDATE OF type, story_id ON notes_storyelement
+        WHEN old.type IS NOT new.type OR old.story_id IS NOT new.story_id BEGIN
+        UPDATE notes_storysummary SET %s WHERE story_id = old.story_id;
+        INSERT INTO notes_storysummary (story_id, %s) VALUES (new.story_id, %s) %s;
+    END""" % (_removed_with_notes('old'), COLUMNS, _added_with_notes('new'), UPSERT),
+    """CREATE TRIGGER notes_storysummary_note_update AFTER UPDATE OF element_id ON notes_note
+        WHEN old.element_id IS NOT new.element_id BEGIN
+        UPDATE notes_storysummary SET note_count = note_count - 1
+        WHERE story_id = (SELECT story_id FROM notes_storyelement WHERE id = old.element_id);
+        INSERT INTO notes_storysummary (story_id, %s)
+        SELECT story_id, %s1 FROM notes_storyelement WHERE id = new.element_id %s;
+    END""" % (COLUMNS, NOTE_COUNT, UPSERT),
+]
+
+SQLITE_DROP_SQL = [
+    'DROP TRIGGER IF EXISTS notes_storysummary_note_update',
+    'DROP TRIGGER IF EXISTS notes_storysummary_element_update',
+    story_summary.SQLITE_CREATE_SQL[2],
+]
+
+POSTGRESQL_CREATE_SQL = [
+    """CREATE OR REPLACE FUNCTION notes_storysummary_element() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'DELETE' THEN
+            UPDATE notes_storysummary SET %s WHERE story_id = OLD.story_id;
+        END IF;
+        IF TG_OP = 'UPDATE' THEN
+            UPDATE notes_storysummary SET %s WHERE story_id = OLD.story_id;
+            INSERT INTO notes_storysummary (story_id, %s) VALUES (NEW.story_id, %s) %s;
+        END IF;
+        IF TG_OP = 'INSERT' THEN
+            INSERT INTO notes_storysummary (story_id, %s) VALUES (NEW.story_id, %s) %s;
+        END IF;
+        RETURN NULL;
+    END $$ LANGUAGE plpgsql""" % (story_summary._removed('OLD', '::int'),
+                                  _removed_with_notes('OLD', '::int'), COLUMNS, _added_with_notes('NEW', '::int'), UPSERT,
+                                  COLUMNS, story_summary._added('NEW', '::int'), UPSERT),
+    """CREATE OR REPLACE FUNCTION notes_storysummary_note() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            UPDATE notes_storysummary SET note_count = note_count - 1
+            WHERE story_id = (SELECT story_id FROM notes_storyelement WHERE id = OLD.element_id);
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            INSERT INTO notes_storysummary (story_id, %s)
+            SELECT story_id, %s1 FROM notes_storyelement WHERE id = NEW.element_id %s;
+        END IF;
+        RETURN NULL;
+    END $$ LANGUAGE plpgsql""" % (COLUMNS, NOTE_COUNT, UPSERT),
+    """CREATE TRIGGER notes_storysummary_note_update AFTER UPDATE OF element_id ON notes_note
+        FOR EACH ROW WHEN (OLD.element_id IS DISTINCT FROM NEW.element_id) EXECUTE PROCEDURE notes_storysummary_note()""",
+]
+
+POSTGRESQL_DROP_SQL = [
+    'DROP TRIGGER IF EXISTS notes_storysummary_note_update ON notes_note',
+    story_summary.POSTGRESQL_CREATE_SQL[0].replace('CREATE FUNCTION', 'CREATE OR REPLACE FUNCTION', 1),
+    story_summary.POSTGRESQL_CREATE_SQL[1].replace('CREATE FUNCTION', 'CREATE OR REPLACE FUNCTION', 1),
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0008_story_summary'),
+    ]
+
+    operations = [
+        migrations.RunPython(story_summary.run_for_vendor({'sqlite': SQLITE_CREATE_SQL, 'postgresql': POSTGRESQL_CREATE_SQL}),
+                             story_summary.run_for_vendor({'sqlite': SQLITE_DROP_SQL, 'postgresql': POSTGRESQL_DROP_SQL})),
+    ]
@@ -15,10 +15,27 @@
 # You should have received a copy of the GNU General Public License
 # along with FicNotesBot.  If not, see <https://www.gnu.org/licenses/>.
 
+import re
+
 from django.db import models
 
+DIGITS = re.compile(r'([0-9]+)')
+
+def natural_sort_key(index):
+    """A string that sorts plot point indexes naturally, so "2" comes before "10" and "1.9" before "1.10"
+
+    Each run of digits is written with its length first, and the index itself
+    is appended so indexes differing only in case or leading zeros stay apart.
+    """
+    parts = DIGITS.split(index.lower())
+    for i in range(1, len(parts), 2):
+        number = parts[i].lstrip('0') or '0'
+        parts[i] = '%03d%s' % (len(number), number)
+    return ''.join(parts) + '\x01' + index
+
 class DiscordUser(models.Model):
-    user_id = models.IntegerField(unique=True)
+    # Discord ids are 64 bit
+    user_id = models.BigIntegerField(unique=True)
     name = models.CharField(max_length=32)
 
 class Story(models.Model):
@@ -51,11 +68,69 @@ class StoryElement(models.Model):
 
     class Meta:
         unique_together = ['story', 'type', 'name']
+        # unique_together already indexes (story, type, name) for lookups by type
+        indexes = [
+            models.Index(fields=['story', 'name'], name='notes_element_story_name_idx'),
+        ]
 
 class PlotPoint(models.Model):
     index = models.OneToOneField(StoryElement, on_delete=models.CASCADE, primary_key=True)
     header = models.TextField()
+    # natural_sort_key of the index's name, so plot points are ordered in the database
+    sort_key = models.TextField(default='')
+
+    def save(self, *args, **kwargs):
+        if not self.sort_key:
+            self.sort_key = natural_sort_key(self.index.name)
+        super().save(*args, **kwargs)
+
+class StorySummary(models.Model):
+    """How many elements of each type and notes a story holds
+
+    Database triggers keep the counts current in the same transaction as each
+    element and note write, bulk_create and cascading deletes included; the
+    reconcilesummaries command repairs any drift. Stories with nothing added
+    yet have no row.
+    """
+    story = models.OneToOneField(Story, on_delete=models.CASCADE, primary_key=True)
+    character_count = models.IntegerField(default=0)
+    object_count = models.IntegerField(default=0)
+    event_count = models.IntegerField(default=0)
+    place_count = models.IntegerField(default=0)
+    concept_count = models.IntegerField(default=0)
+    plotpoint_count = models.IntegerField(default=0)
+    note_count = models.IntegerField(default=0)
+
+    # StoryElement type -> the field counting elements of that type
+    TYPE_FIELDS = {
+        StoryElement.CHARACTER: 'character_count',
+        StoryElement.OBJECT: 'object_count',
+        StoryElement.EVENT: 'event_count',
+        StoryElement.PLACE: 'place_count',
+        StoryElement.CONCEPT: 'concept_count',
+        StoryElement.PLOTPOINT: 'plotpoint_count',
+    }
+    COUNT_FIELDS = list(TYPE_FIELDS.values()) + ['note_count']
 
 class Note(models.Model):
-    element = models.ForeignKey(StoryElement, on_delete=models.CASCADE)
+    # Indexed together with id below, which also serves lookups by element alone
+    element = models.ForeignKey(StoryElement, on_delete=models.CASCADE, db_index=False)
     note = models.TextField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['element', 'id'], name='notes_note_element_id_idx'),
+        ]
+
+class PendingChoice(models.Model):
+    """A prompt the bot is waiting for a click on, kept so it survives a restart"""
+    prompt_id = models.BigIntegerField(primary_key=True)
+    kind = models.CharField(max_length=16)
+    user_id = models.BigIntegerField()
+    channel_id = models.BigIntegerField()
+    # None for direct messages; decides which shard restores the prompt
+    guild_id = models.BigIntegerField(null=True)
+    # Emoji -> value chosen by clicking its button
+    options = models.JSONField()
+    payload = models.JSONField()
+    expires = models.DateTimeField()
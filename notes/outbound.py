@@ -0,0 +1,206 @@
+# Copyright 2020 called2voyage
+#
+# This file is part of FicNotesBot.
+#
+# FicNotesBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# FicNotesBot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with FicNotesBot.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import heapq
+import itertools
+
+from notes.pagination import MESSAGE_LIMIT
+
+# Lower values are sent first
+CONFIRMATION = 0
+PAGE = 1
+
+# Route -> (operations, per seconds), following Discord's documented limits
+ROUTE_LIMITS = {
+    'message': (5, 5.0),
+    'edit': (5, 5.0),
+}
+GLOBAL_LIMIT = (50, 1.0)
+
+class TokenBucket:
+    """Allows capacity operations per period, refilling continuously"""
+
+    def __init__(self, capacity, period):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.tokens = capacity
+        self.updated = None
+
+    def reserve(self, now):
+        """Take a token and return how long to wait before using it"""
+        if self.updated is not None:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate
+
+    def refund(self):
+        """Give back a reserved token that went unused"""
+        self.tokens = min(self.capacity, self.tokens + 1)
+
+class _Outgoing:
+    __slots__ = ['priority', 'route', 'content', 'call', 'coalesce', 'future', 'enqueued']
+
+    def __init__(self, priority, route, content=None, call=None, coalesce=False):
+        self.priority = priority
+        self.route = route
+        self.content = content
+        self.call = call
+        self.coalesce = coalesce
+        self.future = None
+        self.enqueued = None
+
+class Outbox:
+    """Sends everything the bot posts through one priority queue per channel
+
+    Each channel's queue is drained by its own task under per-route token
+    buckets, so a burst in one channel never stalls another. Consecutive
+    coalescable replies waiting for the same channel go out as one message.
+    """
+
+    def __init__(self, route_limits=ROUTE_LIMITS, global_limit=GLOBAL_LIMIT):
+        self.route_limits = route_limits
+        self.global_bucket = TokenBucket(*global_limit)
+        self.buckets = {}
+        self.queues = {}
+        self.workers = {}
+        self.sequence = itertools.count()
+        self.sent = 0
+        self.merged = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    @property
+    def depth(self):
+        return sum(len(queue) for queue in self.queues.values())
+
+    def stats(self):
+        return {
+            'depth': self.depth,
+            'sent': self.sent,
+            'merged': self.merged,
+            'wait_avg': self.wait_total / self.sent if self.sent else 0.0,
+            'wait_max': self.wait_max,
+        }
+
+    def send(self, channel, content, priority=CONFIRMATION, coalesce=True):
+        """Queue a message; the returned future resolves to the discord.Message it went out in"""
+        return self._enqueue(channel, _Outgoing(priority, 'message', content=content, coalesce=coalesce))
+
+    def send_file(self, channel, content, file):
+        """Queue a message with a discord.File attached; it is never merged with other replies"""
+        return self._enqueue(channel, _Outgoing(CONFIRMATION, 'message', call=lambda: channel.send(content, file=file)))
+
+    def send_view(self, channel, content, view, priority=CONFIRMATION):
+        """Queue a message carrying a discord.ui.View's components; it is never merged with other replies"""
+        return self._enqueue(channel, _Outgoing(priority, 'message', call=lambda: channel.send(content, view=view)))
+
+    def edit(self, message, content, view=None):
+        """Queue replacing the message's content, unless it is None, and its components with view's, or none"""
+        fields = {'view': view} if content is None else {'content': content, 'view': view}
+        return self._enqueue(message.channel, _Outgoing(CONFIRMATION, 'edit', call=lambda: message.edit(**fields)))
+
+    def delete(self, message):
+        return self._enqueue(message.channel, _Outgoing(CONFIRMATION, 'edit', call=message.delete))
+
+    def _enqueue(self, channel, item):
+        loop = asyncio.get_running_loop()
+        item.future = loop.create_future()
+        item.enqueued = loop.time()
+        queue = self.queues.setdefault(channel.id, [])
+        heapq.heappush(queue, (item.priority, next(self.sequence), item))
+        if channel.id not in self.workers:
+            self.workers[channel.id] = loop.create_task(self._work(channel))
+        return item.future
+
+    def _take(self, queue):
+        _, _, item = heapq.heappop(queue)
+        items = [item]
+        if item.coalesce:
+            length = len(item.content)
+            while queue:
+                priority, _, following = queue[0]
+                if priority != item.priority or not following.coalesce:
+                    break
+                length += len(following.content) + 1
+                if length > MESSAGE_LIMIT:
+                    break
+                items.append(heapq.heappop(queue)[2])
+        return items
+
+    def _bucket(self, route, channel_id):
+        bucket = self.buckets.get((route, channel_id))
+        if bucket is None:
+            bucket = self.buckets[(route, channel_id)] = TokenBucket(*self.route_limits[route])
+        return bucket
+
+    async def _wait(self, route, channel_id):
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        delay = max(self._bucket(route, channel_id).reserve(now), self.global_bucket.reserve(now))
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def _work(self, channel):
+        loop = asyncio.get_running_loop()
+        queue = self.queues[channel.id]
+        try:
+            while queue:
+                # Wait before taking, so replies queued meanwhile can be merged
+                route = queue[0][2].route
+                await self._wait(route, channel.id)
+                if queue[0][2].route != route:
+                    # Something more urgent on another route arrived meanwhile;
+                    # hand the token back and wait on the new head's route
+                    self._bucket(route, channel.id).refund()
+                    self.global_bucket.refund()
+                    continue
+                items = self._take(queue)
+                first = items[0]
+                now = loop.time()
+                for item in items:
+                    wait = now - item.enqueued
+                    self.wait_total += wait
+                    self.wait_max = max(self.wait_max, wait)
+                self.sent += len(items)
+                self.merged += len(items) - 1
+                try:
+                    if first.content is not None:
+                        result = await channel.send('\n'.join(item.content for item in items))
+                    else:
+                        result = await first.call()
+                except Exception as e:
+                    for item in items:
+                        if not item.future.done():
+                            item.future.set_exception(e)
+                else:
+                    for item in items:
+                        if not item.future.done():
+                            item.future.set_result(result)
+        finally:
+            del self.workers[channel.id]
+            if not queue:
+                del self.queues[channel.id]
+
+    async def close(self):
+        workers = list(self.workers.values())
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
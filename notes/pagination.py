@@ -0,0 +1,94 @@
+# Copyright 2020 called2voyage
+#
+# This file is part of FicNotesBot.
+#
+# FicNotesBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# FicNotesBot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with FicNotesBot.  If not, see <https://www.gnu.org/licenses/>.
+
+from collections import deque
+
+# Discord rejects messages longer than this
+MESSAGE_LIMIT = 2000
+
+# Rows fetched from the database per page
+PAGE_ROWS = 100
+
+NEXT_PAGE_EMOJI = '➡️'
+
+class Pager:
+    """Packs list rows into messages of at most MESSAGE_LIMIT characters, fetching rows a page at a time
+
+    rows is the first page of rows, each starting with its keyset pagination key.
+    fetch(after, limit) is an async callable returning up to limit rows whose key
+    is greater than after, or None if rows already holds everything. Passing
+    rows=None resumes a listing after the key of the last row already sent.
+    """
+
+    def __init__(self, prefix, title, rows, fetch=None, format=None, page_rows=PAGE_ROWS, after=None, page=0):
+        self.prefix = prefix
+        self.title = title
+        self.fetch = fetch
+        self.format = format or (lambda row: row[1])
+        self.page_rows = page_rows
+        self.page = page
+        self.lines = deque()
+        self.after = after
+        self.sent_after = after
+        if rows is None:
+            self.exhausted = fetch is None
+        else:
+            self._add_rows(rows, fetch is None)
+
+    def _add_rows(self, rows, complete):
+        self.exhausted = complete or len(rows) <= self.page_rows
+        if not complete:
+            rows = rows[:self.page_rows]
+        if rows:
+            self.after = rows[-1][0]
+        self.lines.extend((row[0], '* ' + self.format(row) + '\n') for row in rows)
+
+    @property
+    def has_more(self):
+        return bool(self.lines) or not self.exhausted
+
+    async def next_message(self):
+        """Build the next message, or return None once every row has been sent"""
+        if not self.has_more and self.page > 0:
+            return None
+        self.page += 1
+        if self.page == 1:
+            header = self.prefix + self.title + ':\n'
+        else:
+            header = self.prefix + self.title + ' (page ' + str(self.page) + '):\n'
+        parts = [header]
+        room = MESSAGE_LIMIT - len(header)
+        while room > 0:
+            if not self.lines:
+                if self.exhausted:
+                    break
+                self._add_rows(await self.fetch(self.after, self.page_rows + 1), False)
+                continue
+            key, line = self.lines[0]
+            if len(line) <= room:
+                self.lines.popleft()
+                self.sent_after = key
+                parts.append(line)
+                room -= len(line)
+            elif room == MESSAGE_LIMIT - len(header):
+                # A single line longer than a whole message is split across messages
+                parts.append(line[:room])
+                self.lines[0] = (key, line[room:])
+                room = 0
+            else:
+                break
+        return ''.join(parts)
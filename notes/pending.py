@@ -0,0 +1,115 @@
+# Copyright 2020 called2voyage
+#
+# This file is part of FicNotesBot.
+#
+# FicNotesBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# FicNotesBot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with FicNotesBot.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import logging
+import math
+import time
+
+logger = logging.getLogger(__name__)
+
+# Seconds a user has to answer a prompt
+CHOICE_TIMEOUT = 60.0
+
+class TimerWheel:
+    """Buckets deadlines into fixed slots, so expiring any number of timers costs one tick per resolution"""
+
+    def __init__(self, span, resolution=1.0):
+        self.resolution = resolution
+        self.slots = [set() for _ in range(int(math.ceil(span / resolution)) + 1)]
+        self.position = 0
+
+    def add(self, key, delay):
+        """Schedule key to come due after delay seconds and return its slot"""
+        ticks = min(max(1, int(math.ceil(delay / self.resolution))), len(self.slots) - 1)
+        slot = (self.position + ticks) % len(self.slots)
+        self.slots[slot].add(key)
+        return slot
+
+    def remove(self, key, slot):
+        self.slots[slot].discard(key)
+
+    def tick(self):
+        """Advance one slot and return the keys that came due"""
+        self.position = (self.position + 1) % len(self.slots)
+        due = self.slots[self.position]
+        self.slots[self.position] = set()
+        return due
+
+class Choice:
+    """A prompt waiting for user_id to click one of options"""
+
+    def __init__(self, prompt_id, kind, user_id, channel_id, options, payload, expires=None, guild_id=None):
+        self.prompt_id = prompt_id
+        self.kind = kind
+        self.user_id = user_id
+        self.channel_id = channel_id
+        self.guild_id = guild_id
+        self.options = options
+        self.payload = payload
+        self.expires = expires if expires is not None else time.time() + CHOICE_TIMEOUT
+        self.slot = None
+        # In-memory state that can be rebuilt from payload after a restart
+        self.state = None
+        # The task saving the choice, which deleting it has to wait for
+        self.saving = None
+
+class PendingChoices:
+    """Choices the bot is waiting on, keyed by the id of the prompt message"""
+
+    def __init__(self, timeout=CHOICE_TIMEOUT, resolution=1.0):
+        self.choices = {}
+        self.wheel = TimerWheel(timeout, resolution)
+
+    def __len__(self):
+        return len(self.choices)
+
+    def add(self, choice):
+        choice.slot = self.wheel.add(choice.prompt_id, choice.expires - time.time())
+        self.choices[choice.prompt_id] = choice
+
+    def take(self, prompt_id, user_id, emoji):
+        """Remove and return the choice answered by this click with the chosen value, or None"""
+        choice = self.choices.get(prompt_id)
+        if choice is None or choice.user_id != user_id or emoji not in choice.options:
+            return None
+        self.discard(choice)
+        return choice, choice.options[emoji]
+
+    def discard(self, choice):
+        if self.choices.pop(choice.prompt_id, None) is not None:
+            self.wheel.remove(choice.prompt_id, choice.slot)
+
+    def expire(self):
+        """Advance the wheel and remove and return the choices that ran out of time"""
+        expired = []
+        for prompt_id in self.wheel.tick():
+            choice = self.choices.pop(prompt_id, None)
+            if choice is not None:
+                expired.append(choice)
+        return expired
+
+    async def run(self, on_expire):
+        """Expire choices every resolution seconds for as long as the bot runs"""
+        while True:
+            await asyncio.sleep(self.wheel.resolution)
+            for choice in self.expire():
+                try:
+                    await on_expire(choice)
+                except Exception:
+                    # One failed cleanup must not stop expiry for everyone else
+                    logger.exception('Expiring prompt %d failed', choice.prompt_id)
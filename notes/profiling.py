@@ -0,0 +1,130 @@
+# Copyright 2020 called2voyage
+#
+# This file is part of FicNotesBot.
+#
+# FicNotesBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# FicNotesBot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with FicNotesBot.  If not, see <https://www.gnu.org/licenses/>.
+
+import cProfile
+import glob
+import json
+import logging
+import os
+import pstats
+import random
+import time
+
+logger = logging.getLogger(__name__)
+
+# Captures kept in the profile directory; the oldest are deleted beyond this
+PROFILE_KEEP = 200
+
+class Profiler:
+    """Captures commands under cProfile with the SQL they ran
+
+    A sample fraction of commands are captured, and with threshold set, so is
+    any command that took at least threshold seconds. Catching slow commands
+    means profiling every one and throwing most away, which costs more.
+
+    Only the database calls are profiled, as they run on their own thread
+    while the event loop interleaves other commands' work.
+
+    Each capture is a .prof file that pstats reads, next to a .json file with
+    the command text, its timing and the SQL it ran.
+    """
+
+    def __init__(self, directory, sample=0.0, threshold=None, keep=PROFILE_KEEP):
+        self.directory = directory
+        self.sample = sample
+        self.threshold = threshold
+        self.keep = keep
+        self.written = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def start(self, stats):
+        stats.sampled = random.random() < self.sample
+        if stats.sampled or self.threshold is not None:
+            stats.profile = cProfile.Profile()
+            stats.sql = []
+
+    def finish(self, stats, text, seconds):
+        if stats.profile is None:
+            return
+        if not stats.sampled and seconds < self.threshold:
+            return
+        try:
+            self.write(stats, text, seconds)
+        except OSError:
+            logger.exception('Could not save a profile of %s', stats.name)
+
+    def write(self, stats, text, seconds):
+        self.written += 1
+        stem = os.path.join(self.directory, '%s-%06d-%d-%s' % (time.strftime('%Y%m%d-%H%M%S'), self.written % 1000000, os.getpid(), stats.name))
+        stats.profile.dump_stats(stem + '.prof')
+        with open(stem + '.json', 'w', encoding='utf-8') as file:
+            json.dump({
+                'command': stats.name,
+                'text': text,
+                'seconds': seconds,
+                'db_seconds': stats.db,
+                'wait_seconds': stats.wait,
+                'sampled': stats.sampled,
+                'errors': [type(error).__name__ for error in stats.errors],
+                'sql': stats.sql,
+            }, file)
+        self.rotate()
+
+    def rotate(self):
+        profiles = []
+        for path in glob.glob(os.path.join(self.directory, '*.prof')):
+            try:
+                profiles.append((os.path.getmtime(path), path))
+            except FileNotFoundError:
+                # Shards share the directory, so another may have rotated it away
+                continue
+        profiles.sort()
+        for _, path in profiles[:max(0, len(profiles) - self.keep)]:
+            for name in (path, path[:-len('.prof')] + '.json'):
+                try:
+                    os.remove(name)
+                except FileNotFoundError:
+                    pass
+
+def load_captures(directory):
+    """The (.prof path, details) of every capture in directory, slowest first"""
+    captures = []
+    for path in glob.glob(os.path.join(directory, '*.prof')):
+        try:
+            with open(path[:-len('.prof')] + '.json', encoding='utf-8') as file:
+                details = json.load(file)
+        except (OSError, ValueError):
+            continue
+        captures.append((path, details))
+    captures.sort(key=lambda capture: -capture[1]['seconds'])
+    return captures
+
+def function_stats(captures, stream):
+    """The captures' profiles merged into one pstats.Stats printing to stream"""
+    stats = pstats.Stats(stream=stream)
+    for path, _ in captures:
+        stats.add(path)
+    return stats
+
+def query_totals(captures):
+    """Rows of (sql, times run, total seconds, slowest seconds) over the captures, by total time"""
+    totals = {}
+    for _, details in captures:
+        for sql, seconds in details['sql']:
+            count, total, slowest = totals.get(sql, (0, 0.0, 0.0))
+            totals[sql] = (count + 1, total + seconds, max(slowest, seconds))
+    return sorted(((sql,) + row for sql, row in totals.items()), key=lambda row: -row[2])
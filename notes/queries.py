@@ -0,0 +1,258 @@
+# Copyright 2020 called2voyage
+#
+# This file is part of FicNotesBot.
+#
+# FicNotesBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# FicNotesBot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with FicNotesBot.  If not, see <https://www.gnu.org/licenses/>.
+
+import functools
+import operator
+import sqlite3
+from datetime import datetime, timezone
+
+from django.core.exceptions import MultipleObjectsReturned
+from django.db import connection, transaction
+from django.db.models import F
+from django.db.models.functions import Coalesce
+
+from notes import cache
+from notes.fuzzy import TrigramIndex
+from notes.exceptions import UserNotCreatedError, StoryNotFoundError, ElementNotFoundError, NoteNotFoundError
+from notes.models import DiscordUser, Story, StoryElement, StorySummary, PlotPoint, Note, PendingChoice
+from notes.pending import Choice
+from notes.shards import shard_for
+
+# The resolvers below fetch what a command needs in a single joined query and
+# only go back to the database to work out which error to raise when it is empty.
+# User and story primary keys are remembered in notes.cache, so repeat commands
+# skip those lookups entirely.
+#
+# Each save runs its writes in one transaction, so a command commits once and
+# never leaves half of what it added behind.
+
+# Insert the user or refresh their name, returning their primary key either way.
+# SQLite (3.35 and later) and PostgreSQL both take this form.
+UPSERT_USER_SQL = ('INSERT INTO notes_discorduser (user_id, name) VALUES (%s, %s) '
+                   'ON CONFLICT (user_id) DO UPDATE SET name = excluded.name RETURNING id')
+
+# Older SQLite has the upsert but not RETURNING, so the key is read back after it
+RETURNING_SQLITE_VERSION = (3, 35)
+
+def resolve_user(user_id):
+    user_pk = cache.users.get(user_id)
+    if user_pk is not None:
+        return user_pk
+    try:
+        user_pk = DiscordUser.objects.values_list('pk', flat=True).get(user_id=user_id)
+    except DiscordUser.DoesNotExist:
+        raise UserNotCreatedError
+    cache.users.set(user_id, user_pk)
+    return user_pk
+
+def resolve_story(user_id, story):
+    cached = cache.stories.get((user_id, story))
+    if cached is not None:
+        return Story(pk=cached[0], owner_id=cached[1], name=story)
+    try:
+        story = Story.objects.get(owner__user_id=user_id, name=story)
+    except Story.DoesNotExist:
+        resolve_user(user_id)
+        raise StoryNotFoundError
+    cache_story(user_id, story)
+    return story
+
+def cache_story(user_id, story):
+    cache.users.set(user_id, story.owner_id)
+    cache.stories.set((user_id, story.name), (story.pk, story.owner_id))
+
+def resolve_element(user_id, element, story, type=None):
+    cached = cache.stories.get((user_id, story))
+    if cached is not None:
+        element_pk = cache.elements.get((cached[0], element, type)) if type is not None else None
+        if element_pk is not None:
+            return StoryElement(pk=element_pk, story_id=cached[0], name=element)
+        elements = StoryElement.objects.filter(story_id=cached[0], name=element)
+    else:
+        elements = StoryElement.objects.select_related('story').filter(story__owner__user_id=user_id, story__name=story, name=element)
+    if type is not None:
+        elements = elements.filter(type=type)
+    elements = list(elements)
+    if not elements:
+        # Don't trust a cached story for the error message
+        cache.stories.discard((user_id, story))
+        story = resolve_story(user_id, story)
+        raise ElementNotFoundError([name for name in element_names(story.pk).suggest(element) if name != element])
+    if cached is None:
+        cache_story(user_id, elements[0].story)
+    if len(elements) > 1:
+        raise MultipleObjectsReturned([e.get_type_display() for e in elements])
+    if type is not None:
+        cache.elements.set((elements[0].story_id, element, type), elements[0].pk)
+    return elements[0]
+
+def element_names(story_pk):
+    """The story's fuzzy element name index, loaded on first use"""
+    index = cache.element_names.get(story_pk)
+    if index is None:
+        index = TrigramIndex(StoryElement.objects.filter(story_id=story_pk).values_list('name', flat=True).iterator())
+        cache.element_names.set(story_pk, index)
+    return index
+
+def index_element(story_pk, name):
+    index = cache.element_names.get(story_pk)
+    if index is not None:
+        index.add(name)
+
+def upsert_user(user_id, user_name):
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite' and sqlite3.sqlite_version_info < RETURNING_SQLITE_VERSION:
+            cursor.execute(UPSERT_USER_SQL[:-len(' RETURNING id')], [user_id, user_name])
+            cursor.execute('SELECT id FROM notes_discorduser WHERE user_id = %s', [user_id])
+        else:
+            cursor.execute(UPSERT_USER_SQL, [user_id, user_name])
+        return cursor.fetchone()[0]
+
+def save_story(user_id, user_name, name):
+    user_pk = cache.users.get(user_id)
+    if user_pk is not None:
+        story = Story(owner_id=user_pk, name=name)
+        story.save()
+    else:
+        with transaction.atomic():
+            story = Story(owner_id=upsert_user(user_id, user_name), name=name)
+            story.save()
+    cache_story(user_id, story)
+    return story.name
+
+def save_element(user_id, name, story, type):
+    story = resolve_story(user_id, story)
+    element = StoryElement(story=story, type=type, name=name)
+    element.save()
+    index_element(story.pk, element.name)
+    return story.name, element.name
+
+def save_plotpoint(user_id, index, header, story):
+    story = resolve_story(user_id, story)
+    with transaction.atomic():
+        element = StoryElement(story=story, type=StoryElement.PLOTPOINT, name=index)
+        element.save()
+        PlotPoint(index=element, header=header).save(force_insert=True)
+    index_element(story.pk, element.name)
+    return story.name, element.name
+
+def save_note(user_id, note, element, story, type=None):
+    element = resolve_element(user_id, element, story, type)
+    Note(element=element, note=note).save()
+    return element.name
+
+def note_element(user_id, element, story, type=None):
+    """The primary key and name of the element a note would be saved to, raising as save_note does"""
+    element = resolve_element(user_id, element, story, type)
+    return element.pk, element.name
+
+def save_notes(rows):
+    """Insert (element primary key, note) rows in one transaction"""
+    with transaction.atomic():
+        Note.objects.bulk_create([Note(element_id=element_pk, note=note) for element_pk, note in rows], batch_size=500)
+
+# A story's element and note totals from its StorySummary, zero without one
+STORY_TOTALS = [
+    Coalesce(functools.reduce(operator.add, [F('storysummary__' + field) for field in StorySummary.TYPE_FIELDS.values()]), 0),
+    Coalesce(F('storysummary__note_count'), 0),
+]
+
+def list_stories(user_id, limit=None):
+    """Return the user's primary key and up to limit of their stories ordered by name
+
+    Each row is (name, name, elements, notes).
+    """
+    user_pk = cache.users.get(user_id)
+    if user_pk is not None:
+        return user_pk, list(Story.objects.filter(owner_id=user_pk).order_by('name').values_list('name', 'name', *STORY_TOTALS)[:limit])
+    rows = list(Story.objects.filter(owner__user_id=user_id).order_by('name').values_list('owner_id', 'name', 'name', *STORY_TOTALS)[:limit])
+    if not rows:
+        return resolve_user(user_id), []
+    cache.users.set(user_id, rows[0][0])
+    return rows[0][0], [row[1:] for row in rows]
+
+def list_stories_after(user_pk, after, limit):
+    return list(Story.objects.filter(owner_id=user_pk, name__gt=after).order_by('name').values_list('name', 'name', *STORY_TOTALS)[:limit])
+
+def story_lookup(user_id, story, path='story'):
+    """Filter arguments selecting the user's story through the relation at path"""
+    cached = cache.stories.get((user_id, story))
+    if cached is not None:
+        return {path + '_id': cached[0]}
+    return {path + '__owner__user_id': user_id, path + '__name': story}
+
+def list_elements_by_type(user_id, story, type, limit=None):
+    """Return the story's primary key and up to limit of its elements of type
+
+    Elements come back as (name, name) rows ordered by name, and plot points as
+    (sort key, index, header) rows in natural index order, each keyed for
+    list_elements_after.
+    """
+    if type == StoryElement.PLOTPOINT:
+        # Driven from StoryElement so the (story, type) index picks the story's plot points
+        rows = StoryElement.objects.filter(type=type, **story_lookup(user_id, story)).order_by('plotpoint__sort_key').values_list('story_id', 'plotpoint__sort_key', 'name', 'plotpoint__header')
+    else:
+        rows = StoryElement.objects.filter(type=type, **story_lookup(user_id, story)).order_by('name').values_list('story_id', 'name', 'name')
+    rows = list(rows[:limit])
+    if not rows:
+        cache.stories.discard((user_id, story))
+        resolve_story(user_id, story)
+        raise ElementNotFoundError
+    return rows[0][0], [row[1:] for row in rows]
+
+def list_elements_after(story_pk, type, after, limit):
+    if type == StoryElement.PLOTPOINT:
+        rows = StoryElement.objects.filter(story_id=story_pk, type=type, plotpoint__sort_key__gt=after).order_by('plotpoint__sort_key').values_list('plotpoint__sort_key', 'name', 'plotpoint__header')
+    else:
+        rows = StoryElement.objects.filter(story_id=story_pk, type=type, name__gt=after).order_by('name').values_list('name', 'name')
+    return list(rows[:limit])
+
+def story_summary(user_id, story):
+    """Return the story's counts as {StorySummary count field: count}, all zero before anything is added to it"""
+    rows = list(StorySummary.objects.filter(**story_lookup(user_id, story)).values_list(*StorySummary.COUNT_FIELDS))
+    if rows:
+        return dict(zip(StorySummary.COUNT_FIELDS, rows[0]))
+    cache.stories.discard((user_id, story))
+    resolve_story(user_id, story)
+    return dict.fromkeys(StorySummary.COUNT_FIELDS, 0)
+
+def list_notes(user_id, element, story, type=None, limit=None):
+    """Return the element's primary key and up to limit of its notes as (id, note) rows"""
+    element = resolve_element(user_id, element, story, type)
+    notes = list(Note.objects.filter(element=element).order_by('id').values_list('id', 'note')[:limit])
+    if not notes:
+        raise NoteNotFoundError
+    return element.pk, notes
+
+def list_notes_after(element_pk, after, limit):
+    return list(Note.objects.filter(element_id=element_pk, id__gt=after).order_by('id').values_list('id', 'note')[:limit])
+
+def save_pending(choice):
+    PendingChoice(prompt_id=choice.prompt_id, kind=choice.kind, user_id=choice.user_id, channel_id=choice.channel_id,
+                  guild_id=choice.guild_id, options=choice.options, payload=choice.payload,
+                  expires=datetime.fromtimestamp(choice.expires, timezone.utc)).save(force_insert=True)
+
+def delete_pending(prompt_id):
+    PendingChoice.objects.filter(prompt_id=prompt_id).delete()
+
+def load_pending(shard_id=None, shard_count=None):
+    """Return the pending choices, only those for guilds on the given shard if there is one"""
+    choices = [Choice(p.prompt_id, p.kind, p.user_id, p.channel_id, p.options, p.payload, p.expires.timestamp(), p.guild_id)
+               for p in PendingChoice.objects.all()]
+    if shard_count is None:
+        return choices
+    return [choice for choice in choices if shard_for(choice.guild_id, shard_count) == shard_id]
@@ -0,0 +1,167 @@
+# Copyright 2020 called2voyage
+#
+# This file is part of FicNotesBot.
+#
+# FicNotesBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# FicNotesBot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with FicNotesBot.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import functools
+import itertools
+import json
+import math
+import random
+import time
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from notes import core, dbpool, router
+from notes.benchmarks import test_database
+
+# Most queries each command may make when replayed, including saving any prompt it sends
+QUERY_BUDGETS = {
+    'add_story': 3,
+    'add_element': 1,
+    # Including the BEGIN of the transaction the element and plot point share
+    'add_plotpoint': 3,
+    'add_note': 2,
+    'add_notes': 4,
+    'list_stories': 1,
+    'list_elements': 1,
+    'list_notes': 3,
+    'search': 1,
+    'story_stats': 1,
+    # Two per element type with elements, one per type without
+    'export_story': 13,
+}
+
+class CountingExecutor(dbpool.PoolExecutor):
+    """Runs calls on a single pool thread, counting the queries they make"""
+
+    def __init__(self):
+        super().__init__(queue_depth=1, workers=1)
+        self.queries = 0
+
+    def runner(self, func):
+        @functools.wraps(func)
+        def counted(*args, **kwargs):
+            with CaptureQueriesContext(connection) as captured:
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.queries += len(captured)
+        return super().runner(counted)
+
+class Sample:
+    """How long one replayed command took and how many queries it made"""
+
+    def __init__(self, name, seconds, queries):
+        self.name = name
+        self.seconds = seconds
+        self.queries = queries
+
+def load_log(file):
+    """Requests from a file of JSON lines, as rundiscordbot --record writes"""
+    return [core.request_from_json(json.loads(line)) for line in file if line.strip()]
+
+def generate_log(users=20, commands=2000, seed=0):
+    """A reproducible session: each user sets up a story, then sends commands in proportions like a busy server's"""
+    rng = random.Random(seed)
+    setup = []
+    mixed = []
+    characters = ['Alice', 'Bob', 'Carol', 'Dave', 'Erin']
+
+    def request(user, content):
+        return core.Request(1000 + user, 'user%d' % user, 1 + user % 4, '!ficnotesbot ' + content, 1 << 22)
+
+    for user in range(users):
+        setup.append(request(user, 'add story Story'))
+        for name in characters:
+            setup.append(request(user, 'add character %s > Story' % name))
+        # Paris is both, so notes for it ask which one is meant
+        setup.append(request(user, 'add character Paris > Story'))
+        setup.append(request(user, 'add place Paris > Story'))
+        for i in range(1, 6):
+            setup.append(request(user, 'add plotpoint "%d" Chapter %d > Story' % (i, i)))
+        for i in range(10):
+            setup.append(request(user, 'add note Note %d about the harbour > %s > Story' % (i, characters[i % len(characters)])))
+    mix = [
+        (40, lambda user: 'list notes for %s > Story' % rng.choice(characters)),
+        (20, lambda user: 'add note Seen again near the harbour > %s > Story' % rng.choice(characters)),
+        (10, lambda user: 'list characters in Story'),
+        (5, lambda user: 'list plotpoints in Story'),
+        (5, lambda user: 'list stories'),
+        (8, lambda user: 'search harbour > Story'),
+        (5, lambda user: 'list notes for Alicia > Story'),
+        (4, lambda user: 'add note Which one? > Paris > Story'),
+        (2, lambda user: 'add notes\nImported > Bob > Story\nImported > Nobody > Story'),
+        (1, lambda user: 'export story Story'),
+        (3, lambda user: 'stats Story'),
+    ]
+    weights = list(itertools.accumulate(weight for weight, _ in mix))
+    for _ in range(commands):
+        user = rng.randrange(users)
+        _, content = rng.choices(mix, cum_weights=weights)[0]
+        mixed.append(request(user, content(user)))
+    return setup + mixed
+
+async def _replay(bot, executor, requests):
+    samples = []
+    prompt_ids = itertools.count(1)
+    for request in requests:
+        command = router.parse(request.content)
+        if command is None:
+            continue
+        queries = executor.queries
+        start = time.perf_counter()
+        replies = await bot.run(request, command)
+        for reply in replies:
+            if isinstance(reply, core.Reply):
+                if reply.prompt is not None:
+                    await bot.wait_for_choice(reply.prompt.choice(next(prompt_ids), request.user_id, request.channel_id, request.guild_id))
+                if reply.file is not None:
+                    reply.file.close()
+        samples.append(Sample(command.name, time.perf_counter() - start, executor.queries - queries))
+    return samples
+
+def replay_requests(requests):
+    """Run requests one at a time against the current database and return a Sample for each command"""
+    executor = CountingExecutor()
+    try:
+        return asyncio.run(_replay(core.Core(executor), executor, requests))
+    finally:
+        executor.shutdown()
+
+def replay(requests):
+    """Run requests one at a time against a fresh test database and return a Sample for each command"""
+    with test_database():
+        return replay_requests(requests)
+
+def percentile(values, p):
+    """The nearest-rank pth percentile of values"""
+    values = sorted(values)
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+def summarize(samples):
+    """Rows of (command, count, p50 seconds, p99 seconds, mean queries, most queries), one per command"""
+    by_name = {}
+    for sample in samples:
+        by_name.setdefault(sample.name, []).append(sample)
+    rows = []
+    for name in sorted(by_name):
+        group = by_name[name]
+        seconds = [s.seconds for s in group]
+        queries = [s.queries for s in group]
+        rows.append((name, len(group), percentile(seconds, 50), percentile(seconds, 99), sum(queries) / len(queries), max(queries)))
+    return rows
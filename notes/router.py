@@ -0,0 +1,109 @@
+# Copyright 2020 called2voyage
+#
+# This file is part of FicNotesBot.
+#
+# FicNotesBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# FicNotesBot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with FicNotesBot.  If not, see <https://www.gnu.org/licenses/>.
+
+from collections import namedtuple
+
+from notes.models import StoryElement
+
+PREFIX = '!ficnotesbot '
+
+ParsedCommand = namedtuple('ParsedCommand', ['name', 'type', 'args'])
+
+def _required(*args):
+    """args, raising ValueError if any is blank, as in '!ficnotesbot add story'"""
+    if any(not arg.strip() for arg in args):
+        raise ValueError
+    return args
+
+def _parse_nothing(rest):
+    return ()
+
+def _parse_story(rest):
+    return _required(rest)
+
+def _parse_text(rest):
+    # May be empty when the text comes as an attachment instead
+    return (rest,)
+
+def _parse_element(rest):
+    parts = rest.split(' > ')
+    return _required(parts[0], parts[1])
+
+def _parse_plotpoint(rest):
+    parts = rest.split(' > ')
+    index_header = parts[0]
+    return _required(index_header.split('"')[1], index_header.split('" ')[1], parts[1])
+
+def _parse_note(rest):
+    parts = rest.split(' > ')
+    return _required(parts[0], parts[1], parts[2])
+
+def _parse_export(rest):
+    story, _, format = rest.partition(' > ')
+    return _required(story) + (format or 'markdown',)
+
+# (verb, noun) -> (command name, element type, connective, argument parser)
+ROUTES = {
+    ('add', 'story'): ('add_story', None, None, _parse_story),
+    ('add', 'character'): ('add_element', StoryElement.CHARACTER, None, _parse_element),
+    ('add', 'object'): ('add_element', StoryElement.OBJECT, None, _parse_element),
+    ('add', 'event'): ('add_element', StoryElement.EVENT, None, _parse_element),
+    ('add', 'place'): ('add_element', StoryElement.PLACE, None, _parse_element),
+    ('add', 'concept'): ('add_element', StoryElement.CONCEPT, None, _parse_element),
+    ('add', 'plotpoint'): ('add_plotpoint', StoryElement.PLOTPOINT, None, _parse_plotpoint),
+    ('add', 'note'): ('add_note', None, None, _parse_note),
+    ('add', 'notes'): ('add_notes', None, None, _parse_text),
+    ('list', 'stories'): ('list_stories', None, None, _parse_nothing),
+    ('list', 'characters'): ('list_elements', StoryElement.CHARACTER, 'in', _parse_story),
+    ('list', 'objects'): ('list_elements', StoryElement.OBJECT, 'in', _parse_story),
+    ('list', 'events'): ('list_elements', StoryElement.EVENT, 'in', _parse_story),
+    ('list', 'places'): ('list_elements', StoryElement.PLACE, 'in', _parse_story),
+    ('list', 'concepts'): ('list_elements', StoryElement.CONCEPT, 'in', _parse_story),
+    ('list', 'plotpoints'): ('list_elements', StoryElement.PLOTPOINT, 'in', _parse_story),
+    ('list', 'notes'): ('list_notes', None, 'for', _parse_element),
+    ('export', 'story'): ('export_story', None, None, _parse_export),
+    # Verbs without a noun take everything after the verb
+    ('search', None): ('search', None, None, _parse_element),
+    ('stats', None): ('story_stats', None, None, _parse_story),
+}
+
+def parse(content):
+    """Turn message content into a ParsedCommand, or None if it is not a bot command or lacks an argument"""
+    if not content.startswith(PREFIX):
+        return None
+    verb, _, after_verb = content[len(PREFIX):].partition(' ')
+    noun, separator, rest = after_verb.partition(' ')
+    if '\n' in noun:
+        # Bulk commands put their lines straight after the noun
+        noun, _, first = noun.partition('\n')
+        rest = first + separator + rest
+    route = ROUTES.get((verb, noun))
+    if route is None:
+        route = ROUTES.get((verb, None))
+        rest = after_verb
+    if route is None:
+        return None
+    name, type, connective, parser = route
+    if connective is not None:
+        word, _, rest = rest.partition(' ')
+        if word != connective:
+            return None
+    try:
+        return ParsedCommand(name, type, parser(rest))
+    except (IndexError, ValueError):
+        # A part is missing or blank
+        return None
@@ -0,0 +1,94 @@
+# Copyright 2020 called2voyage
+#
+# This file is part of FicNotesBot.
+#
+# FicNotesBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# FicNotesBot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with FicNotesBot.  If not, see <https://www.gnu.org/licenses/>.
+
+import re
+
+from django.db import connection, transaction
+
+from notes.queries import resolve_story
+from notes.models import Note
+
+# Most results a search returns
+SEARCH_LIMIT = 10
+
+WORD = re.compile(r'\w+')
+
+SEARCH_SQL = """
+    SELECT e.name, e.type, snippet(notes_note_fts, 0, '**', '**', '...', 12)
+    FROM notes_note_fts
+    JOIN notes_note n ON n.id = notes_note_fts.rowid
+    JOIN notes_storyelement e ON e.id = n.element_id
+    WHERE notes_note_fts MATCH %s
+    ORDER BY bm25(notes_note_fts)
+    LIMIT %s
+"""
+
+# Uses the GIN index over to_tsvector('english', note) from migration 0007
+POSTGRESQL_SEARCH_SQL = """
+    SELECT e.name, e.type, ts_headline('english', n.note, q, 'StartSel=**, StopSel=**, MaxWords=12, MinWords=4')
+    FROM notes_note n
+    JOIN notes_storyelement e ON e.id = n.element_id,
+    plainto_tsquery('english', %s) q
+    WHERE e.story_id = %s AND to_tsvector('english', n.note) @@ q
+    ORDER BY ts_rank(to_tsvector('english', n.note), q) DESC
+    LIMIT %s
+"""
+
+def match_expression(terms, story_pk):
+    """An FTS5 query for notes in the story containing every word of terms"""
+    words = ' '.join('"' + word + '"' for word in WORD.findall(terms))
+    return 'story : "s%d" AND note : (%s)' % (story_pk, words)
+
+def search_notes(user_id, terms, story, limit=SEARCH_LIMIT):
+    """Return up to limit (element name, element type, snippet) rows for notes in story matching terms, best first"""
+    story = resolve_story(user_id, story)
+    if not WORD.search(terms):
+        return []
+    if connection.vendor == 'sqlite':
+        sql, params = SEARCH_SQL, [match_expression(terms, story.pk), limit]
+    elif connection.vendor == 'postgresql':
+        sql, params = POSTGRESQL_SEARCH_SQL, [' '.join(WORD.findall(terms)), story.pk, limit]
+    else:
+        return _search_without_index(terms, story.pk, limit)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+def _search_without_index(terms, story_pk, limit):
+    notes = Note.objects.filter(element__story_id=story_pk).select_related('element')
+    for word in WORD.findall(terms):
+        notes = notes.filter(note__icontains=word)
+    return [(n.element.name, n.element.type, n.note) for n in notes.order_by('id')[:limit]]
+
+def rebuild_index():
+    """Rebuild the search index from the notes table and return how many notes it holds"""
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('REINDEX INDEX notes_note_search_idx')
+            cursor.execute('SELECT count(*) FROM notes_note')
+            return cursor.fetchone()[0]
+    if connection.vendor != 'sqlite':
+        return 0
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute('DELETE FROM notes_note_fts')
+        cursor.execute("""
+            INSERT INTO notes_note_fts(rowid, note, story)
+            SELECT n.id, n.note, 's' || e.story_id FROM notes_note n JOIN notes_storyelement e ON e.id = n.element_id
+        """)
+        cursor.execute("INSERT INTO notes_note_fts(notes_note_fts) VALUES('optimize')")
+        cursor.execute('SELECT count(*) FROM notes_note_fts')
+        return cursor.fetchone()[0]
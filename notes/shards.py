@@ -0,0 +1,121 @@
+# Copyright 2020 called2voyage
+#
+# This file is part of FicNotesBot.
+#
+# FicNotesBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# FicNotesBot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with FicNotesBot.  If not, see <https://www.gnu.org/licenses/>.
+
+import logging
+import os
+import signal
+import subprocess
+import sys
+import time
+
+logger = logging.getLogger(__name__)
+
+# Seconds before restarting a crashed shard, doubling up to RESTART_DELAY_MAX
+# while it keeps crashing
+RESTART_DELAY = 1.0
+RESTART_DELAY_MAX = 60.0
+
+# A shard that ran this long before crashing is restarted without delay
+STABLE_AFTER = 60.0
+
+def shard_for(guild_id, shard_count):
+    """The shard Discord sends a guild's events to; direct messages go to shard 0"""
+    if guild_id is None:
+        return 0
+    return (guild_id >> 22) % shard_count
+
+def shard_path(path, shard_id):
+    """path with the shard id before its extension, so each shard process writes a file of its own"""
+    root, extension = os.path.splitext(path)
+    return '%s.%d%s' % (root, shard_id, extension)
+
+class Shard:
+    """One worker process and when to start it next"""
+
+    def __init__(self, shard_id):
+        self.shard_id = shard_id
+        self.process = None
+        self.started = None
+        self.delay = RESTART_DELAY
+        self.restart_at = 0.0
+
+class Supervisor:
+    """Runs one rundiscordbot process per shard and restarts any that crash
+
+    A shard that exits cleanly is left stopped. SIGINT or SIGTERM stops every
+    shard before the supervisor returns.
+    """
+
+    def __init__(self, shard_count, extra_args=(), poll=0.5):
+        self.shard_count = shard_count
+        self.extra_args = list(extra_args)
+        self.poll = poll
+        self.shards = [Shard(i) for i in range(shard_count)]
+        self.stopping = False
+
+    def command(self, shard_id):
+        # Relaunch the same manage.py the supervisor was started through
+        return [sys.executable, sys.argv[0], 'rundiscordbot',
+                '--shard-id', str(shard_id), '--shard-count', str(self.shard_count)] + self.extra_args
+
+    def start(self, shard):
+        shard.process = subprocess.Popen(self.command(shard.shard_id))
+        shard.started = time.monotonic()
+        logger.info('Started shard %d as process %d', shard.shard_id, shard.process.pid)
+
+    def check(self, shard, now):
+        """Reap a shard that has exited and start it again once its delay has passed"""
+        if shard.process is not None:
+            code = shard.process.poll()
+            if code is None:
+                return
+            shard.process = None
+            if code == 0:
+                logger.info('Shard %d exited', shard.shard_id)
+                shard.restart_at = None
+                return
+            if now - shard.started >= STABLE_AFTER:
+                shard.delay = RESTART_DELAY
+            shard.restart_at = now + shard.delay
+            logger.warning('Shard %d exited with %d, restarting in %.0f s', shard.shard_id, code, shard.delay)
+            shard.delay = min(shard.delay * 2, RESTART_DELAY_MAX)
+        if shard.restart_at is not None and now >= shard.restart_at:
+            self.start(shard)
+
+    def stop(self, signum=None, frame=None):
+        self.stopping = True
+
+    def run(self):
+        """Supervise the shards until a signal arrives or every shard has exited cleanly"""
+        previous = {sig: signal.signal(sig, self.stop) for sig in (signal.SIGINT, signal.SIGTERM)}
+        try:
+            while not self.stopping:
+                now = time.monotonic()
+                for shard in self.shards:
+                    self.check(shard, now)
+                if all(shard.process is None and shard.restart_at is None for shard in self.shards):
+                    break
+                time.sleep(self.poll)
+        finally:
+            for shard in self.shards:
+                if shard.process is not None:
+                    shard.process.terminate()
+            for shard in self.shards:
+                if shard.process is not None:
+                    shard.process.wait()
+            for sig, handler in previous.items():
+                signal.signal(sig, handler)
@@ -0,0 +1,48 @@
+# Copyright 2020 called2voyage
+#
+# This file is part of FicNotesBot.
+#
+# FicNotesBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# FicNotesBot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with FicNotesBot.  If not, see <https://www.gnu.org/licenses/>.
+
+import sqlite3
+
+from django.conf import settings
+from django.core import checks
+from django.db import connections
+
+# The story summary triggers of migration 0008 upsert, which SQLite took up in 3.24
+MIN_SQLITE_VERSION = (3, 24)
+
+def configure_connection(sender, connection, **kwargs):
+    """Apply FICNOTESBOT_SQLITE_PRAGMAS to each new SQLite connection"""
+    if connection.vendor != 'sqlite':
+        return
+    pragmas = getattr(settings, 'FICNOTESBOT_SQLITE_PRAGMAS', {})
+    if not pragmas:
+        return
+    with connection.cursor() as cursor:
+        for name, value in pragmas.items():
+            cursor.execute('PRAGMA %s = %s' % (name, value))
+
+def check_sqlite_version(app_configs, **kwargs):
+    """Fail with a clear message on an SQLite too old for the bot's SQL, rather than at the first write"""
+    if not any(connections[alias].vendor == 'sqlite' for alias in connections):
+        return []
+    if sqlite3.sqlite_version_info >= MIN_SQLITE_VERSION:
+        return []
+    return [checks.Error(
+        'SQLite %s is too old; FicNotesBot needs %s or later.' % (sqlite3.sqlite_version, '.'.join(map(str, MIN_SQLITE_VERSION))),
+        hint='Upgrade the SQLite library Python links against, or use PostgreSQL through DATABASE_URL.',
+        id='notes.E001',
+    )]
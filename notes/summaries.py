@@ -0,0 +1,70 @@
+# Copyright 2020 called2voyage
+#
+# This file is part of FicNotesBot.
+#
+# FicNotesBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# FicNotesBot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with FicNotesBot.  If not, see <https://www.gnu.org/licenses/>.
+
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from notes.models import StoryElement, StorySummary, Note
+
+# Stories recounted per UPDATE
+RECOUNT_BATCH = 500
+
+def _count(queryset, key):
+    return Coalesce(Subquery(queryset.order_by().values(key).annotate(n=Count('pk')).values('n')), 0)
+
+# StorySummary field -> an expression counting it from scratch for the row being updated
+RECOUNTS = {field: _count(StoryElement.objects.filter(story_id=OuterRef('story_id'), type=type), 'story_id')
+            for type, field in StorySummary.TYPE_FIELDS.items()}
+RECOUNTS['note_count'] = _count(Note.objects.filter(element__story_id=OuterRef('story_id')), 'element__story_id')
+
+def actual_counts():
+    """{story primary key: {count field: count}} for every story with elements, counted from scratch"""
+    counts = {}
+
+    def story(story_pk):
+        return counts.setdefault(story_pk, dict.fromkeys(StorySummary.COUNT_FIELDS, 0))
+
+    for story_pk, type, count in StoryElement.objects.order_by().values_list('story_id', 'type').annotate(Count('pk')):
+        story(story_pk)[StorySummary.TYPE_FIELDS[type]] = count
+    for story_pk, count in Note.objects.order_by().values_list('element__story_id').annotate(Count('pk')):
+        story(story_pk)['note_count'] = count
+    return counts
+
+def reconcile(fix=False):
+    """Compare every story's summary with what it holds, returning (story pk, field, stored, actual) for each difference
+
+    fix recounts the stories that differ. Each recount is a single statement,
+    so notes added meanwhile are neither lost nor counted twice.
+    """
+    actual = actual_counts()
+    stored = {row[0]: dict(zip(StorySummary.COUNT_FIELDS, row[1:]))
+              for row in StorySummary.objects.values_list('story_id', *StorySummary.COUNT_FIELDS)}
+    zero = dict.fromkeys(StorySummary.COUNT_FIELDS, 0)
+    drift = []
+    for story_pk in sorted(set(actual) | set(stored)):
+        have = stored.get(story_pk, zero)
+        want = actual.get(story_pk, zero)
+        drift.extend((story_pk, field, have[field], want[field]) for field in StorySummary.COUNT_FIELDS if have[field] != want[field])
+    if fix and drift:
+        recount(sorted({story_pk for story_pk, _, _, _ in drift}))
+    return drift
+
+def recount(story_pks):
+    """Set the stories' summaries from their elements and notes"""
+    StorySummary.objects.bulk_create([StorySummary(story_id=story_pk) for story_pk in story_pks], ignore_conflicts=True)
+    for i in range(0, len(story_pks), RECOUNT_BATCH):
+        StorySummary.objects.filter(story_id__in=story_pks[i:i + RECOUNT_BATCH]).update(**RECOUNTS)
@@ -0,0 +1,149 @@
+# Copyright 2020 called2voyage
+#
+# This file is part of FicNotesBot.
+#
+# FicNotesBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# FicNotesBot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with FicNotesBot.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import itertools
+import random
+import time
+
+from django.core.exceptions import MultipleObjectsReturned
+from django.db import connection
+
+from notes import queries
+from notes.exceptions import UserNotCreatedError, StoryNotFoundError, ElementNotFoundError, NoteNotFoundError, DatabaseBusyError
+from notes.models import DiscordUser, Story, StoryElement, PlotPoint, Note, natural_sort_key
+
+# Fixtures shared by the tests, the benchmarks and the replay harness
+
+USER_ID = 1000
+USER_NAME = 'bench'
+
+def seed_story():
+    """A story with a character, a place and a concept both named Paris, a plot point and two notes"""
+    queries.save_story(USER_ID, USER_NAME, 'Story')
+    queries.save_element(USER_ID, 'Alice', 'Story', StoryElement.CHARACTER)
+    queries.save_element(USER_ID, 'Paris', 'Story', StoryElement.PLACE)
+    queries.save_element(USER_ID, 'Paris', 'Story', StoryElement.CONCEPT)
+    queries.save_plotpoint(USER_ID, '1', 'It begins', 'Story')
+    queries.save_note(USER_ID, 'First note', 'Alice', 'Story')
+    queries.save_note(USER_ID, 'First note', 'Paris', 'Story', StoryElement.PLACE)
+
+# name -> (a call of one of the bot's query helpers against seed_story, the exception it raises)
+HELPER_CALLS = {
+    'save_story': (lambda: queries.save_story(USER_ID, USER_NAME, 'Budget'), None),
+    'save_element': (lambda: queries.save_element(USER_ID, 'Bob', 'Story', StoryElement.CHARACTER), None),
+    'save_plotpoint': (lambda: queries.save_plotpoint(USER_ID, '2', 'Things happen', 'Story'), None),
+    'save_note': (lambda: queries.save_note(USER_ID, 'A note', 'Alice', 'Story'), None),
+    'save_note (ambiguous)': (lambda: queries.save_note(USER_ID, 'A note', 'Paris', 'Story'), MultipleObjectsReturned),
+    'save_note (by type)': (lambda: queries.save_note(USER_ID, 'A note', 'Paris', 'Story', StoryElement.PLACE), None),
+    'list_stories': (lambda: queries.list_stories(USER_ID), None),
+    'list_elements_by_type': (lambda: queries.list_elements_by_type(USER_ID, 'Story', StoryElement.CHARACTER), None),
+    'list_elements_by_type (plot points)': (lambda: queries.list_elements_by_type(USER_ID, 'Story', StoryElement.PLOTPOINT), None),
+    'list_notes': (lambda: queries.list_notes(USER_ID, 'Alice', 'Story'), None),
+    'list_notes (by type)': (lambda: queries.list_notes(USER_ID, 'Paris', 'Story', StoryElement.PLACE), None),
+    'list_notes (no user)': (lambda: queries.list_notes(USER_ID + 1, 'Alice', 'Story'), UserNotCreatedError),
+    'list_notes (no story)': (lambda: queries.list_notes(USER_ID, 'Alice', 'Missing'), StoryNotFoundError),
+    'list_notes (no element)': (lambda: queries.list_notes(USER_ID, 'Carol', 'Story'), ElementNotFoundError),
+    'list_notes (no notes)': (lambda: queries.list_notes(USER_ID, 'Bob', 'Story'), NoteNotFoundError),
+    'story_summary': (lambda: queries.story_summary(USER_ID, 'Story'), None),
+    'story_summary (no story)': (lambda: queries.story_summary(USER_ID, 'Missing'), StoryNotFoundError),
+}
+
+def call_helper(name):
+    """Make the call HELPER_CALLS names, swallowing the exception it is expected to raise"""
+    call, expected = HELPER_CALLS[name]
+    try:
+        return call()
+    except Exception as e:
+        if expected is None or not isinstance(e, expected):
+            raise
+
+def with_query_latency(func, seconds):
+    """Add a fixed delay to every query func runs, as a networked database would"""
+    def delay(execute, sql, params, many, context):
+        time.sleep(seconds)
+        return execute(sql, params, many, context)
+
+    def run(*args, **kwargs):
+        with connection.execute_wrapper(delay):
+            return func(*args, **kwargs)
+    return run
+
+async def simulate_messages(executor, count, latency=0):
+    """Send count list commands against seed_story through executor at once, returning the seconds taken and how many were refused as busy"""
+    list_notes = executor.wrap(with_query_latency(queries.list_notes, latency))
+    list_elements = executor.wrap(with_query_latency(queries.list_elements_by_type, latency))
+
+    async def message(i):
+        try:
+            if i % 2:
+                await list_notes(USER_ID, 'Alice', 'Story')
+            else:
+                await list_elements(USER_ID, 'Story', StoryElement.CHARACTER)
+            return True
+        except DatabaseBusyError:
+            return False
+    start = time.perf_counter()
+    results = await asyncio.gather(*[message(i) for i in range(count)])
+    return time.perf_counter() - start, results.count(False)
+
+# Syllables the seeded notes' made-up words are built from
+SEED_SYLLABLES = ['ka', 'ri', 'mo', 'ten', 'sha', 'lu', 'ver', 'do', 'ni', 'gal', 'bro', 'eth', 'qui', 'zan', 'ol', 'pra']
+
+def seed_vocabulary(rng, count=2000):
+    """Made-up words, most frequent first, with Zipf cumulative weights like those of natural language"""
+    words = []
+    seen = set()
+    while len(words) < count:
+        word = ''.join(rng.choice(SEED_SYLLABLES) for _ in range(rng.randint(2, 4)))
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+    weights = list(itertools.accumulate(1 / rank for rank in range(1, count + 1)))
+    return words, weights
+
+def seed_notes(notes, stories=100, elements_per_story=100, plotpoints_per_story=20):
+    """Fill the database with notes spread over many stories, elements and plot points, and return the vocabulary they use"""
+    rng = random.Random(0)
+    words, weights = seed_vocabulary(rng)
+    DiscordUser.objects.bulk_create([DiscordUser(user_id=USER_ID + 1000 + i, name='seed') for i in range(stories)])
+    users = DiscordUser.objects.filter(name='seed')
+    Story.objects.bulk_create([Story(owner=user, name='Seed %d' % user.user_id) for user in users])
+    types = [t for t, _ in StoryElement.ELEMENT_TYPE_CHOICES if t != StoryElement.PLOTPOINT]
+    StoryElement.objects.bulk_create([
+        StoryElement(story=story, type=types[i % len(types)], name='Element %d' % i)
+        for story in Story.objects.filter(name__startswith='Seed ')
+        for i in range(elements_per_story)
+    ], batch_size=5000)
+    StoryElement.objects.bulk_create([
+        StoryElement(story=story, type=StoryElement.PLOTPOINT, name=str(i))
+        for story in Story.objects.filter(name__startswith='Seed ')
+        for i in range(plotpoints_per_story)
+    ], batch_size=5000)
+    PlotPoint.objects.bulk_create([
+        PlotPoint(index_id=id, header='Things happen', sort_key=natural_sort_key(name))
+        for id, name in StoryElement.objects.filter(story__name__startswith='Seed ', type=StoryElement.PLOTPOINT).values_list('id', 'name')
+    ], batch_size=5000)
+    element_ids = list(StoryElement.objects.filter(story__name__startswith='Seed ').exclude(type=StoryElement.PLOTPOINT).values_list('id', flat=True))
+    batch = []
+    for i in range(notes):
+        batch.append(Note(element_id=element_ids[i % len(element_ids)], note=' '.join(rng.choices(words, cum_weights=weights, k=8))))
+        if len(batch) == 10000:
+            Note.objects.bulk_create(batch)
+            batch = []
+    Note.objects.bulk_create(batch)
+    return words
@@ -0,0 +1,133 @@
+# Copyright 2020 called2voyage
+#
+# This file is part of FicNotesBot.
+#
+# FicNotesBot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# FicNotesBot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with FicNotesBot.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import logging
+
+from django.conf import settings
+
+from notes import metrics, queries
+
+logger = logging.getLogger(__name__)
+
+class Batch:
+    """Notes inserted together, and the future their commands wait on"""
+
+    def __init__(self, loop):
+        self.rows = []
+        self.done = loop.create_future()
+        # Set on the database thread once the rows are committed
+        self.written = False
+
+class NoteBatcher:
+    """Queues note inserts and commits them together with queries.save_notes
+
+    A batch is written interval seconds after its first note, or as soon as it
+    holds size notes, in one transaction on executor. Only one batch is written
+    at a time: SQLite takes one writer anyway, and notes arriving meanwhile join
+    the next batch. Each add returns once its batch is committed, so
+    confirmations still mean the note is saved.
+    """
+
+    def __init__(self, executor, interval, size):
+        self.interval = interval
+        self.size = size
+        self.write = executor.wrap(self.save)
+        self.batch = None
+        self.timer = None
+        # The task writing a batch, and whether the open one is due once it finishes
+        self.writing = None
+        self.due = False
+        # Batches not yet committed, written by drain_sync if the loop stops first
+        self.unwritten = []
+        self.batches = 0
+
+    def save(self, batch):
+        queries.save_notes(batch.rows)
+        batch.written = True
+
+    async def add(self, element_pk, note):
+        if self.batch is None:
+            loop = asyncio.get_running_loop()
+            self.batch = Batch(loop)
+            self.unwritten.append(self.batch)
+            self.timer = loop.call_later(self.interval, self.flush)
+        batch = self.batch
+        batch.rows.append((element_pk, note))
+        if len(batch.rows) >= self.size:
+            self.flush()
+        # The batch is written even if this command is cancelled
+        await asyncio.shield(batch.done)
+
+    def flush(self):
+        """Start writing the open batch, if there is one, or once the batch being written is"""
+        if self.batch is None:
+            return
+        if self.writing is not None:
+            self.due = True
+            return
+        batch, self.batch = self.batch, None
+        self.timer.cancel()
+        self.writing = asyncio.ensure_future(self._write(batch))
+
+    async def _write(self, batch):
+        try:
+            # Charged to a command of its own rather than whichever note filled the batch
+            with metrics.command('note_batch'):
+                await self.write(batch)
+        except asyncio.CancelledError:
+            # The loop is stopping; drain_sync checks whether the write got through
+            raise
+        except Exception as e:
+            # The commands waiting on the batch report the error, so it is not retried
+            self.unwritten.remove(batch)
+            batch.done.set_exception(e)
+        else:
+            self.batches += 1
+            self.unwritten.remove(batch)
+            batch.done.set_result(None)
+        self.writing = None
+        if self.due:
+            self.due = False
+            self.flush()
+
+    async def drain(self):
+        """Write the open batch and wait until no batch is left to write"""
+        while self.batch is not None or self.writing is not None:
+            self.flush()
+            await asyncio.wait([self.writing])
+
+    def drain_sync(self):
+        """Write the notes of batches the stopped event loop never committed
+
+        Call once the loop has closed and the database executor has finished
+        its calls, so no write is still running.
+        """
+        rows = [row for batch in self.unwritten if not batch.written for row in batch.rows]
+        self.batch = None
+        self.unwritten = []
+        if rows:
+            queries.save_notes(rows)
+            logger.info('Wrote %d batched notes left at shutdown', len(rows))
+        return len(rows)
+
+def note_batcher(executor, interval_ms=None, size=None):
+    """The NoteBatcher selected by the FICNOTESBOT_NOTE_BATCH_* settings, or None when batching is off"""
+    interval_ms = interval_ms or settings.FICNOTESBOT_NOTE_BATCH_MS
+    if not interval_ms:
+        return None
+    return NoteBatcher(executor, interval_ms / 1000, size or settings.FICNOTESBOT_NOTE_BATCH_ROWS)
@@ -1,6 +1,11 @@
 #!/bin/sh
 
 DIR=$1
+shift
 cd "$DIR"
 
-python3 manage.py rundiscordbot
+# The bot runs with lean settings unless told otherwise
+export DJANGO_SETTINGS_MODULE="${DJANGO_SETTINGS_MODULE:-FicNotesBot.settings_bot}"
+
+# Any further arguments, such as --shard-count, go to rundiscordbot
+python3 manage.py rundiscordbot "$@"